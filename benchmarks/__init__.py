@@ -0,0 +1,5 @@
+import os
+
+# the stand-ins need no network, but tiktoken downloads its encodings once,
+# `make benchmark-prepare` stores them here for the runs without network
+os.environ.setdefault("TIKTOKEN_CACHE_DIR", "cache/tiktoken")
@@ -0,0 +1,99 @@
+"""Check of the near-duplicate filter on edited copies of synthetic posts.
+
+Every post is indexed with copies of it where one word is replaced, and
+the check fails when too few of the copies are collapsed into it, or when
+too many distinct posts of the corpus are dropped as duplicates. Edits of
+posts shorter than ~15 words are below `DEDUP_THRESHOLD` and kept.
+
+    poetry run python -m benchmarks.dedup --posts 200 --min-collapsed 0.9
+"""
+import argparse
+import json
+import random
+import sys
+
+from langchain.docstore.document import Document
+
+from benchmarks.fakes import FILLER, TOPICS, make_posts
+from src.utils.dedup import NearDuplicateFilter
+
+WORDS = sorted({word for words in TOPICS.values() for word in words.split()})
+
+
+def edits(words, rng: random.Random):
+    """The copies of `words` with one of them replaced, at every position."""
+    for i in range(len(words)):
+        copy = list(words)
+        copy[i] = rng.choice([word for word in WORDS if word != words[i]])
+        yield copy
+
+
+def collapsed_rate(num_posts: int, num_words: int, seed: int) -> float:
+    rng = random.Random(seed)
+    collapsed = total = 0
+    for i in range(num_posts):
+        words = [rng.choice(WORDS + FILLER) for _ in range(num_words)]
+        duplicate_filter = NearDuplicateFilter(seed=seed + i)
+        duplicate_filter.add(Document(page_content=" ".join(words)))
+        for copy in edits(words, rng):
+            total += 1
+            collapsed += not duplicate_filter.add(Document(page_content=" ".join(copy)))
+    return collapsed / total
+
+
+def dropped_rate(num_posts: int, seed: int) -> float:
+    """Share of distinct posts dropped, the corpus has no duplicates."""
+    duplicate_filter = NearDuplicateFilter()
+    documents = [
+        Document(page_content=post["text"]) for post in make_posts(num_posts, seed)
+    ]
+    return 1 - len(list(duplicate_filter.filter(documents))) / len(documents)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=200)
+    parser.add_argument("--lengths", type=int, nargs="+", default=[15, 20, 30])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--min-collapsed",
+        type=float,
+        default=0.9,
+        help="minimum share of single-word edits collapsed, for every length",
+    )
+    parser.add_argument(
+        "--max-dropped",
+        type=float,
+        default=0.001,
+        help="maximum share of distinct posts dropped",
+    )
+    args = parser.parse_args()
+
+    results = dict(
+        collapsed={
+            length: round(collapsed_rate(args.posts, length, args.seed), 4)
+            for length in args.lengths
+        },
+        dropped=round(dropped_rate(args.posts * 10, args.seed), 4),
+    )
+    print(json.dumps(results, indent=2))
+
+    missed = [
+        length
+        for length, rate in results["collapsed"].items()
+        if rate < args.min_collapsed
+    ]
+    if missed:
+        sys.exit(
+            f"single-word edits of {', '.join(map(str, missed))} words posts are "
+            f"collapsed less than {args.min_collapsed:.0%} of the time"
+        )
+    if results["dropped"] > args.max_dropped:
+        sys.exit(
+            f"{results['dropped']:.2%} of distinct posts dropped as duplicates, "
+            f"more than {args.max_dropped:.2%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""End-to-end benchmark of the agent against stand-in services.
+
+For every corpus size, a fresh process runs `load_documents`,
+`init_docsearch`, `summarize` and `ask_the_db` on synthetic posts served
+by the fakes of `benchmarks.fakes`, in a scratch directory. Latency,
+throughput and peak memory of each stage are written as JSON to
+`benchmarks/results/`, and compared with `--baseline` when given.
+
+    poetry run python -m benchmarks.end_to_end --platform twitter \\
+        --sizes 100 1000 10000 100000 --baseline benchmarks/results/<run>.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(__file__), "results")
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+@contextmanager
+def _measure(stages: Dict[str, Dict[str, Any]], name: str):
+    """Record the latency and peak memory of a stage, `items` set by the caller."""
+    stage = dict(items=0)
+    rss_before = _peak_rss_mb()
+    start = time.perf_counter()
+    yield stage
+    elapsed = time.perf_counter() - start
+    stage.update(
+        elapsed_s=round(elapsed, 4),
+        throughput=round(stage["items"] / elapsed, 2) if elapsed else 0.0,
+        peak_rss_mb=round(_peak_rss_mb(), 1),
+        peak_rss_growth_mb=round(_peak_rss_mb() - rss_before, 1),
+    )
+    stages[name] = stage
+
+
+def run_case(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Run the agent on one corpus, in the current process."""
+    from benchmarks.fakes import FakeLLM, FakeReddit, FakeTwitterAPI, make_posts
+    from src.utils import display
+    from src.utils.agent import Agent
+    from src.utils.chains import LLMMetricsHandler
+    from src.utils.clients import ClientPool
+    from src.utils.config import RATE_LIMITS
+    from src.utils.document_loader import RedditSubLoader, TwitterTweetLoader
+    from src.utils.metrics import get_metrics
+    from src.utils.rate_limit import set_rate_limit
+
+    # the index, the caches and the history are written to a scratch directory
+    os.chdir(tempfile.mkdtemp(prefix="media-agent-benchmark-"))
+
+    # the stand-ins have no quota, only the simulated latency
+    for endpoint in RATE_LIMITS:
+        set_rate_limit(endpoint, rate=10**9, period=1, burst=10**9)
+    display.console.quiet = True
+
+    num_posts = params["num_posts"]
+    posts = make_posts(
+        num_posts,
+        seed=params["seed"],
+        duplicate_rate=params["duplicate_rate"],
+    )
+    if params["platform"] == "twitter":
+        loader = TwitterTweetLoader(
+            auth_handler=None,
+            twitter_users=None,
+            keywords="benchmark",
+            number_tweets=num_posts,
+            api=FakeTwitterAPI(posts, latency=params["api_latency"]),
+        )
+    else:
+        reddit = FakeReddit(posts, latency=params["api_latency"])
+        loader = RedditSubLoader(
+            number_submissions=num_posts,
+            keywords="benchmark",
+            # the fake is read-only, its workers share it
+            reddit_pool=ClientPool(lambda: reddit),
+        )
+
+    llm = FakeLLM(
+        latency=params["llm_latency"],
+        callbacks=[LLMMetricsHandler("fake")],
+    )
+    agent = Agent(
+        loader,
+        summary_method=params["summary_method"],
+        embedding_backend=params["embedding_backend"],
+        llm=llm,
+    )
+    agent.console.quiet = True
+    stages = {}
+
+    with _measure(stages, "load_documents") as stage:
+        # items are the chunks left after deduplication
+        agent.load_documents()
+        stage["items"] = len(agent.loaded_documents)
+
+    with _measure(stages, "init_docsearch") as stage:
+        agent.init_docsearch()
+        stage["items"] = len(agent.loaded_documents)
+
+    with _measure(stages, "summarize") as stage:
+        structured_summary = agent.summarize()
+        stage["items"] = len(agent.loaded_documents)
+    summary_llm_calls = len(llm.prompts)
+
+    questions = ["q1", "q2", "q3"]
+    with _measure(stages, "ask_the_db") as stage:
+        for question in questions:
+            agent.ask_the_db(question, structured_summary)
+        stage["items"] = len(questions)
+
+    # the same questions again, answered from the answer cache
+    with _measure(stages, "ask_the_db_cached") as stage:
+        for question in questions:
+            agent.ask_the_db(question, structured_summary)
+        stage["items"] = len(questions)
+
+    agent.history_writer.close()
+
+    return dict(
+        params,
+        num_chunks=len(agent.loaded_documents),
+        summary_llm_calls=summary_llm_calls,
+        llm_calls=len(llm.prompts),
+        stages=stages,
+        # a process per run, these are the metrics of this run only
+        metrics=get_metrics().to_dict(),
+    )
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]):
+    """Print the latency of every stage against the baseline run."""
+    baseline_runs = {
+        (run["platform"], run["num_posts"]): run for run in baseline["runs"]
+    }
+    print(f"\nagainst {baseline['git_commit']} ({baseline['created_at']})")
+    print(
+        f"{'posts':>8} {'stage':<18} {'baseline_s':>11} {'current_s':>10} {'ratio':>7}"
+    )
+
+    for run in results["runs"]:
+        baseline_run = baseline_runs.get((run["platform"], run["num_posts"]))
+        if baseline_run is None:
+            continue
+        for name, stage in run["stages"].items():
+            before = baseline_run["stages"].get(name, {}).get("elapsed_s")
+            if not before:
+                continue
+            print(
+                f"{run['num_posts']:>8} {name:<18} {before:>11.3f} "
+                f"{stage['elapsed_s']:>10.3f} {stage['elapsed_s'] / before:>6.2f}x"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--platform", choices=["twitter", "reddit"], default="twitter")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[100, 1000, 10000, 100000],
+        help="number of posts of every corpus",
+    )
+    parser.add_argument("--embedding-backend", default="hashing")
+    parser.add_argument("--summary-method", default="map_reduce")
+    parser.add_argument(
+        "--llm-latency",
+        type=float,
+        default=0.0,
+        help="seconds taken by every LLM call",
+    )
+    parser.add_argument(
+        "--api-latency",
+        type=float,
+        default=0.0,
+        help="seconds taken by every Twitter or Reddit request",
+    )
+    parser.add_argument(
+        "--duplicate-rate",
+        type=float,
+        default=0.0,
+        help="share of posts copied from earlier ones",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="results file, timestamped by default")
+    parser.add_argument("--baseline", help="results file to compare with")
+    args = parser.parse_args()
+
+    runs: List[Dict[str, Any]] = []
+    # a process per corpus, so that peak memory is measured independently
+    context = multiprocessing.get_context("spawn")
+    for num_posts in args.sizes:
+        params = dict(
+            platform=args.platform,
+            num_posts=num_posts,
+            embedding_backend=args.embedding_backend,
+            summary_method=args.summary_method,
+            llm_latency=args.llm_latency,
+            api_latency=args.api_latency,
+            duplicate_rate=args.duplicate_rate,
+            seed=args.seed,
+        )
+        with context.Pool(1) as pool:
+            run = pool.apply(run_case, (params,))
+        runs.append(run)
+
+        for name, stage in run["stages"].items():
+            print(
+                f"{num_posts:>8} {name:<18} {stage['elapsed_s']:>9.3f}s "
+                f"{stage['throughput']:>10.1f}/s {stage['peak_rss_mb']:>8.1f}MB"
+            )
+
+    results = dict(
+        created_at=datetime.now().isoformat(timespec="seconds"),
+        git_commit=_git_commit(),
+        python=platform.python_version(),
+        machine=platform.machine(),
+        runs=runs,
+    )
+
+    output = args.output or os.path.join(
+        RESULTS_DIRECTORY,
+        f"{args.platform}-{datetime.now():%Y%m%d-%H%M%S}.json",
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nresults written to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""Stand-ins for the Twitter, Reddit and OpenAI services.
+
+They serve a synthetic corpus with the same shapes and paging semantics
+as `tweepy.API` (JSON parser), PRAW listings and the chat model, so the
+agent runs end to end without credentials nor network.
+"""
+import bisect
+import json
+import random
+import re
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from langchain.callbacks.manager import CallbackManagerForLLMRun
+from langchain.llms.base import LLM
+
+TOPICS = {
+    "python": "python asyncio typing packaging wheels interpreter gil release",
+    "markets": "stocks bonds inflation rates earnings recession investors fed",
+    "football": "match goal league transfer coach striker penalty season",
+    "climate": "emissions heatwave carbon solar wind policy warming flood",
+    "space": "rocket launch orbit satellite moon mars telescope nasa",
+    "ai": "model training gpu dataset inference benchmark alignment agents",
+}
+FILLER = "the a of and to in is it that for on with this was at by from".split()
+
+_SOURCE = re.compile(r"Source: (\S+)")
+
+
+def make_posts(
+    num_posts: int,
+    seed: int = 0,
+    duplicate_rate: float = 0.0,
+) -> List[Dict[str, Any]]:
+    """Synthetic posts on a few topics, oldest first.
+
+    A `duplicate_rate` share of the posts are retweets or slightly edited
+    copies of earlier ones.
+    """
+    rng = random.Random(seed)
+    topics = {name: words.split() for name, words in TOPICS.items()}
+    posts = []
+
+    for i in range(num_posts):
+        topic = rng.choice(list(topics))
+        if posts and rng.random() < duplicate_rate:
+            original = rng.choice(posts)
+            topic = original["topic"]
+            text = rng.choice(
+                [
+                    f"RT @user{rng.randint(0, 99)}: {original['text']}",
+                    f"{original['text']} {rng.choice(topics[topic])}",
+                ]
+            )
+        else:
+            text = " ".join(
+                rng.choice(topics[topic]) if rng.random() < 0.4 else rng.choice(FILLER)
+                for _ in range(rng.randint(15, 60))
+            )
+        posts.append(
+            dict(
+                id=1_000_000 + i,
+                topic=topic,
+                text=text,
+                created_at=f"2023-05-{1 + i % 28:02d}",
+                comments=[
+                    " ".join(rng.choice(topics[topic] + FILLER) for _ in range(12))
+                    for _ in range(rng.randint(0, 5))
+                ],
+            )
+        )
+    return posts
+
+
+class FakeTwitterAPI(object):
+    """`tweepy.API` with a JSON parser, serving `posts` as tweets.
+
+    Tweets are paged newest first with `count`, `max_id` and `since_id`.
+    Every account tweets the whole corpus and every search matches it.
+    """
+
+    def __init__(self, posts: List[Dict[str, Any]], latency: float = 0.0):
+        self.posts = sorted(posts, key=lambda post: post["id"])
+        self.ids = [post["id"] for post in self.posts]
+        self.latency = latency
+        self.calls = 0
+
+    def _page(self, count=20, max_id=None, since_id=None, **_):
+        self.calls += 1
+        time.sleep(self.latency)
+        end = len(self.ids) if max_id is None else bisect.bisect_right(self.ids, max_id)
+        start = 0 if since_id is None else bisect.bisect_right(self.ids, since_id)
+        start = max(start, end - count)
+        return [
+            dict(
+                id=post["id"],
+                created_at=post["created_at"],
+                full_text=post["text"],
+            )
+            for post in reversed(self.posts[start:end])
+        ]
+
+    def user_timeline(self, screen_name=None, **params):
+        return self._page(**params)
+
+    def search_tweets(self, q=None, **params):
+        return {"statuses": self._page(**params)}
+
+
+class FakeSubmission(object):
+    def __init__(self, post: Dict[str, Any], latency: float):
+        self._post = post
+        self._latency = latency
+        self.id = format(post["id"], "x")
+        self.fullname = f"t3_{self.id}"
+        self.title = f"{post['topic']} thread {self.id}"
+        self.selftext = post["text"]
+        self.url = f"https://www.reddit.com/r/{post['topic']}/comments/{self.id}/"
+        self.created_utc = 1_683_000_000 + post["id"]
+        self.subreddit = SimpleNamespace(display_name=post["topic"])
+
+    @property
+    def comments(self):
+        # PRAW fetches the comment forest lazily, one request per submission
+        time.sleep(self._latency)
+        return [SimpleNamespace(body=body) for body in self._post["comments"]]
+
+
+class FakeSubreddit(object):
+    def __init__(self, reddit: "FakeReddit", name: str):
+        self.reddit = reddit
+        self.name = name
+
+    def _listing(self, limit: int, params: Optional[Dict[str, str]] = None):
+        after = (params or {}).get("after")
+        submissions = self.reddit.submissions
+        start = 0 if after is None else self.reddit.positions[after] + 1
+        for i, submission in enumerate(submissions[start : start + limit]):
+            if i % 100 == 0:
+                # one listing request per page of 100
+                time.sleep(self.reddit.latency)
+            yield submission
+
+    def top(self, limit=100, params=None, **_):
+        return self._listing(limit, params)
+
+    def search(self, query, limit=100, params=None, **_):
+        return self._listing(limit, params)
+
+
+class FakeReddit(object):
+    """`praw.Reddit` serving `posts` as submissions of every subreddit."""
+
+    def __init__(self, posts: List[Dict[str, Any]], latency: float = 0.0):
+        self.latency = latency
+        self.submissions = [FakeSubmission(post, latency) for post in reversed(posts)]
+        self.positions = {sub.fullname: i for i, sub in enumerate(self.submissions)}
+        self.by_id = {sub.id: sub for sub in self.submissions}
+
+    def subreddit(self, name: str) -> FakeSubreddit:
+        return FakeSubreddit(self, name)
+
+    def submission(self, id: str) -> FakeSubmission:
+        return self.by_id[id]
+
+
+class FakeLLM(LLM):
+    """Answers like the chat model would, after `latency` seconds.
+
+    Summary prompts asking for JSON get the summary and the three
+    questions, retrieval prompts get an answer citing the first source of
+    the context, every other prompt gets a short summary.
+    """
+
+    latency: float = 0.0
+    # length of every prompt received
+    prompts: List[int] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+    ) -> str:
+        self.prompts.append(len(prompt))
+        time.sleep(self.latency)
+
+        if "Format the output as a JSON" in prompt:
+            return json.dumps(
+                dict(
+                    summary="People discuss " + ", ".join(TOPICS) + ".",
+                    q1="What is said about python?",
+                    q2="How are the markets doing?",
+                    q3="Which rocket launches are mentioned?",
+                )
+            )
+        if "FINAL ANSWER" in prompt:
+            sources = _SOURCE.findall(prompt.rsplit("QUESTION:", 1)[-1])
+            return f"Synthetic answer.\nSOURCES: {sources[0] if sources else ''}"
+        # the beginning of the documents, after the first line of the template
+        return "Synthetic summary: " + " ".join(prompt.split()[4:44])
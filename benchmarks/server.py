@@ -0,0 +1,224 @@
+"""Concurrency benchmark of the multi-session server against stand-in services.
+
+Starts `src.server` in this process with sessions served by the fakes of
+`benchmarks.fakes`, then creates `--sessions` sessions and asks
+`--questions` questions in each, all at once, over HTTP. With an LLM
+latency, the wall-clock time shows how much of the work of concurrent
+sessions overlaps. A last session is deleted while it loads, which must
+leave its index closed once its running step is over.
+
+    poetry run python -m benchmarks.server --sessions 8 --llm-latency 0.5
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+import zlib
+from typing import Any, Dict, List, Tuple
+
+
+async def request(
+    port: int,
+    method: str,
+    path: str,
+    body: Dict[str, Any] = None,
+) -> Tuple[int, Dict[str, Any]]:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    content = json.dumps(body).encode() if body is not None else b""
+    writer.write(
+        (
+            f"{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(content)}\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode()
+        + content
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+
+    head, _, payload = response.partition(b"\r\n\r\n")
+    status = int(head.split()[1])
+    return status, json.loads(payload) if payload else {}
+
+
+async def _timed(latencies: List[float], coroutine):
+    start = time.perf_counter()
+    result = await coroutine
+    latencies.append(time.perf_counter() - start)
+    return result
+
+
+def _summary(latencies: List[float]) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    return dict(
+        count=len(latencies),
+        p50_s=round(statistics.median(latencies), 4),
+        p95_s=round(latencies[int(0.95 * (len(latencies) - 1))], 4),
+        max_s=round(latencies[-1], 4),
+    )
+
+
+async def run(args) -> Dict[str, Any]:
+    from benchmarks.fakes import FakeLLM, FakeTwitterAPI, make_posts
+    from src.server import AgentServer, SessionManager
+    from src.utils import display
+    from src.utils.agent import Agent
+    from src.utils.chains import LLMMetricsHandler
+    from src.utils.config import RATE_LIMITS
+    from src.utils.document_loader import TwitterTweetLoader
+    from src.utils.rate_limit import set_rate_limit
+
+    # the caches and the history are written to a scratch directory
+    os.chdir(tempfile.mkdtemp(prefix="media-agent-server-benchmark-"))
+    for endpoint in RATE_LIMITS:
+        set_rate_limit(endpoint, rate=10**9, period=1, burst=10**9)
+    display.console.quiet = True
+
+    llm = FakeLLM(latency=args.llm_latency, callbacks=[LLMMetricsHandler("fake")])
+    agents = {}
+
+    def agent_factory(spec):
+        posts = make_posts(
+            spec["number_of_posts"],
+            seed=zlib.crc32(spec["keywords"].encode()),
+        )
+        loader = TwitterTweetLoader(
+            auth_handler=None,
+            twitter_users=None,
+            keywords=spec["keywords"],
+            number_tweets=spec["number_of_posts"],
+            api=FakeTwitterAPI(posts, latency=args.api_latency),
+        )
+        agents[spec["keywords"]] = Agent(
+            loader,
+            embedding_backend="hashing",
+            persist_directory=None,
+            llm=llm,
+        )
+        return agents[spec["keywords"]]
+
+    server = await AgentServer(SessionManager(agent_factory)).start(port=0)
+    port = server.sockets[0].getsockname()[1]
+
+    create_latencies, ask_latencies = [], []
+    start = time.perf_counter()
+    async with server:
+        sessions = await asyncio.gather(
+            *(
+                _timed(
+                    create_latencies,
+                    request(
+                        port,
+                        "POST",
+                        "/sessions",
+                        dict(
+                            platform="twitter",
+                            keywords=f"topic {i}",
+                            number_of_posts=args.posts,
+                        ),
+                    ),
+                )
+                for i in range(args.sessions)
+            )
+        )
+        failed = [body for status, body in sessions if status != 201]
+        if failed:
+            raise RuntimeError(f"sessions could not be created: {failed}")
+
+        answers = await asyncio.gather(
+            *(
+                _timed(
+                    ask_latencies,
+                    request(
+                        port,
+                        "POST",
+                        f"/sessions/{body['session_id']}/ask",
+                        dict(question=f"q{1 + j % 3}"),
+                    ),
+                )
+                for _, body in sessions
+                for j in range(args.questions)
+            )
+        )
+        elapsed = time.perf_counter() - start
+        deleted_while_loading = await _delete_while_loading(port, agents, args)
+
+    return dict(
+        sessions=args.sessions,
+        questions=args.questions,
+        posts=args.posts,
+        llm_latency=args.llm_latency,
+        llm_calls=len(llm.prompts),
+        elapsed_s=round(elapsed, 3),
+        # what the same LLM calls take back to back
+        serial_llm_s=round(len(llm.prompts) * args.llm_latency, 3),
+        create=_summary(create_latencies),
+        ask=_summary(ask_latencies),
+        ask_errors=sum(status != 200 for status, _ in answers),
+        deleted_while_loading=deleted_while_loading,
+    )
+
+
+async def _delete_while_loading(port: int, agents, args) -> str:
+    status, body = await request(
+        port,
+        "POST",
+        "/sessions",
+        dict(
+            platform="twitter",
+            keywords="deleted",
+            number_of_posts=args.posts,
+            wait=False,
+        ),
+    )
+    if status != 202:
+        raise RuntimeError(f"session could not be created: {body}")
+    agent = agents["deleted"]
+    init_docsearch = agent.init_docsearch
+
+    def slow_init_docsearch():
+        time.sleep(0.5)
+        init_docsearch()
+
+    agent.init_docsearch = slow_init_docsearch
+    # deleted once it indexes, the step that opens the index
+    while not agent.loaded_documents:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.1)
+    status, _ = await request(port, "DELETE", f"/sessions/{body['session_id']}")
+    if status != 204:
+        raise RuntimeError(f"session could not be deleted: {status}")
+    # a step still running after the delete would open the index again
+    await asyncio.sleep(0.5)
+    if agent.docsearch is not None or agent.index_lock is not None:
+        raise RuntimeError("a session deleted while loading kept its index open")
+    return "closed"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--questions", type=int, default=3)
+    parser.add_argument("--posts", type=int, default=500)
+    parser.add_argument(
+        "--llm-latency",
+        type=float,
+        default=0.5,
+        help="seconds taken by every LLM call",
+    )
+    parser.add_argument(
+        "--api-latency",
+        type=float,
+        default=0.05,
+        help="seconds taken by every Twitter request",
+    )
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
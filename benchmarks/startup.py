@@ -0,0 +1,80 @@
+"""Cold-start benchmark of the CLI.
+
+Imports `src.main` in fresh interpreters, the way `python -m src.main` does
+before the intro is displayed, and fails when the median import time goes
+over the budget or when a heavy dependency is imported at startup.
+
+    poetry run python -m benchmarks.startup --runs 10 --budget 0.5
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# dependencies that must only be imported once the platform is selected
+HEAVY_MODULES = [
+    "langchain",
+    "chromadb",
+    "openai",
+    "tiktoken",
+    "numpy",
+    "praw",
+    "tweepy",
+]
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import src.main
+elapsed = time.perf_counter() - start
+heavy = [m for m in json.loads(sys.argv[1]) if m in sys.modules]
+print(json.dumps(dict(elapsed=elapsed, heavy=heavy)))
+"""
+
+
+def measure_startup() -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", _PROBE, json.dumps(HEAVY_MODULES)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=0.5,
+        help="maximum median import time of src.main, in seconds",
+    )
+    args = parser.parse_args()
+
+    # the first run warms up the bytecode cache and is not counted
+    measure_startup()
+    runs = [measure_startup() for _ in range(args.runs)]
+    timings = [run["elapsed"] for run in runs]
+    heavy = sorted({module for run in runs for module in run["heavy"]})
+
+    results = dict(
+        runs=args.runs,
+        budget_s=args.budget,
+        median_s=round(statistics.median(timings), 4),
+        min_s=round(min(timings), 4),
+        max_s=round(max(timings), 4),
+        heavy_modules=heavy,
+    )
+    print(json.dumps(results, indent=2))
+
+    if heavy:
+        sys.exit(f"heavy modules imported at startup: {', '.join(heavy)}")
+    if results["median_s"] > args.budget:
+        sys.exit(f"startup regressed: {results['median_s']}s > {args.budget}s budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""Headless batch mode: summarize many topics from a spec file.
+
+    poetry run python -m src.batch topics.yaml --workers 4
+
+The spec is a YAML list, or JSON lines, of items such as
+
+    - topic: python releases
+      platform: twitter
+      keywords: python 3.12
+      number_of_posts: 200
+    - topic: rust
+      platform: reddit
+      accounts: [rust, learnrust]
+
+Every item is loaded, indexed and summarized in a worker process, which
+writes `<output-dir>/<id>/summary.json` with the summary and the metrics
+of the item, or `error.json` when it fails. Items that already have a
+summary are skipped, so a crashed or interrupted run is resumed by
+running the same command again.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from multiprocessing import get_context
+from typing import Any, Dict, List
+
+from dotenv import load_dotenv
+
+from src import logger
+from src.utils.config import (
+    BATCH_MAX_WORKERS,
+    BATCH_NUMBER_OF_POSTS,
+    BATCH_OUTPUT_DIRECTORY,
+    INDEX_DIRECTORY,
+)
+from src.utils.index_store import slugify
+
+PLATFORMS = ["twitter", "reddit"]
+SUMMARY_FILE = "summary.json"
+ERROR_FILE = "error.json"
+
+
+def get_item_id(item: Dict[str, Any]) -> str:
+    """The id given in the spec, or one derived from the search of the item."""
+    if item.get("id"):
+        return str(item["id"])
+    search = {key: item.get(key) for key in ["platform", "keywords", "accounts"]}
+    search["number_of_posts"] = item["number_of_posts"]
+    digest = hashlib.sha256(
+        json.dumps(search, sort_keys=True).encode("utf-8")
+    ).hexdigest()[:8]
+    label = item.get("topic") or item.get("keywords") or "-".join(item["accounts"])
+    return f"{item['platform']}-{slugify(label)}-{digest}"
+
+
+def get_item_collection_name(item: Dict[str, Any]) -> str:
+    """The collection of an item, never shared with another item or session."""
+    digest = hashlib.sha256(item["id"].encode("utf-8")).hexdigest()[:8]
+    return f"batch-{slugify(item['id'], 44)}-{digest}"
+
+
+def load_spec(path: str) -> List[Dict[str, Any]]:
+    """Read and validate the items of a YAML or JSON lines spec."""
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            import yaml
+
+            items = yaml.safe_load(f) or []
+        else:
+            items = [json.loads(line) for line in f if line.strip()]
+
+    if not isinstance(items, list):
+        raise ValueError(f"{path} should be a list of items")
+    ids = set()
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f"item {i} of {path}: should be a mapping")
+        if item.get("platform") not in PLATFORMS:
+            raise ValueError(
+                f"item {i} of {path}: platform should be one of {', '.join(PLATFORMS)}"
+            )
+        if not item.get("keywords") and not item.get("accounts"):
+            raise ValueError(f"item {i} of {path}: set keywords or accounts")
+        if isinstance(item.get("accounts"), str):
+            item["accounts"] = [item["accounts"]]
+        item.setdefault("number_of_posts", BATCH_NUMBER_OF_POSTS)
+        item["id"] = get_item_id(item)
+        if item["id"] in ids:
+            raise ValueError(f"item {i} of {path}: duplicate id {item['id']}")
+        ids.add(item["id"])
+
+    return items
+
+
+def _write_json(path: str, payload: Dict[str, Any]):
+    # a summary file is either complete or missing, even after a crash
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(payload, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+
+def run_item(item: Dict[str, Any], output_directory: str, options: Dict[str, Any]):
+    """Load, index and summarize one item, in a worker process."""
+    # langchain, chromadb and the platform clients are imported in the workers
+    from src.utils import display
+    from src.utils.agent import Agent
+    from src.utils.document_loader import get_loader
+    from src.utils.history import get_history_writer
+
+    item_directory = os.path.join(output_directory, item["id"])
+    os.makedirs(item_directory, exist_ok=True)
+    display.console.quiet = True
+    start = time.perf_counter()
+
+    agent = None
+    try:
+        loader = get_loader(
+            item["platform"],
+            item.get("keywords"),
+            item.get("accounts"),
+            item["number_of_posts"],
+        )
+        agent = Agent(
+            loader,
+            summary_method=options["summary_method"],
+            embedding_backend=options["embedding_backend"],
+            # kept in the shared store only when asked, to be reopened later
+            persist_directory=INDEX_DIRECTORY if options["keep_index"] else None,
+            collection_name=get_item_collection_name(item),
+            # one log per worker, the files are not shared between processes
+            history_writer=get_history_writer(
+                os.path.join(output_directory, f"history-{os.getpid()}.jsonl")
+            ),
+        )
+        agent.console.quiet = True
+        # the metrics of the items are in their summary files
+        agent.metrics_exporters = []
+
+        if options["pipeline"]:
+            agent.load_and_index()
+        else:
+            agent.load_documents()
+            if not agent.loaded_documents:
+                raise ValueError("the search returned no documents")
+            agent.init_docsearch()
+        structured_summary = agent.generate_summary()
+    except Exception as e:
+        _write_json(
+            os.path.join(item_directory, ERROR_FILE),
+            dict(
+                id=item["id"],
+                item=item,
+                error=repr(e),
+                traceback=traceback.format_exc(),
+                failed_at=datetime.now().isoformat(timespec="seconds"),
+            ),
+        )
+        return dict(id=item["id"], status="failed", error=repr(e))
+    finally:
+        # releases the index, workers are reused by the following items
+        if agent is not None:
+            agent.close()
+
+    _write_json(
+        os.path.join(item_directory, SUMMARY_FILE),
+        dict(
+            id=item["id"],
+            item=item,
+            summary=structured_summary,
+            session_id=agent.session_id,
+            num_documents=agent.history.get("num_documents"),
+            num_chunks=len(agent.loaded_documents),
+            elapsed_s=round(time.perf_counter() - start, 3),
+            # recorded by the agent only, whatever else the worker ran
+            metrics=agent.metrics.to_dict(),
+            completed_at=datetime.now().isoformat(timespec="seconds"),
+        ),
+    )
+    error_path = os.path.join(item_directory, ERROR_FILE)
+    if os.path.exists(error_path):
+        os.remove(error_path)
+    return dict(id=item["id"], status="done")
+
+
+def run_batch(
+    items: List[Dict[str, Any]],
+    output_directory: str = BATCH_OUTPUT_DIRECTORY,
+    max_workers: int = BATCH_MAX_WORKERS,
+    options: Dict[str, Any] = None,
+    force: bool = False,
+) -> Dict[str, int]:
+    """Run the items without a summary yet on a pool of processes."""
+    options = options or {}
+    options.setdefault("summary_method", "map_reduce")
+    options.setdefault("embedding_backend", None)
+    options.setdefault("pipeline", False)
+    options.setdefault("keep_index", False)
+
+    pending = [
+        item
+        for item in items
+        if force
+        or not os.path.exists(os.path.join(output_directory, item["id"], SUMMARY_FILE))
+    ]
+    stats = dict(items=len(items), skipped=len(items) - len(pending), done=0, failed=0)
+    logger.info(
+        f"batch: {len(pending)} items to run, {stats['skipped']} already summarized"
+    )
+    os.makedirs(output_directory, exist_ok=True)
+
+    # spawned workers, chromadb and the HTTP pools don't survive a fork
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=get_context("spawn"),
+    ) as executor:
+        futures = {
+            executor.submit(run_item, item, output_directory, options): item
+            for item in pending
+        }
+        for future in as_completed(futures):
+            item = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # e.g. a worker killed by the system, its item is retried next run
+                result = dict(id=item["id"], status="failed", error=repr(e))
+
+            stats[result["status"]] += 1
+            progress = f"[{stats['done'] + stats['failed']}/{len(pending)}]"
+            if result["status"] == "done":
+                logger.info(f"batch {progress}: {result['id']} summarized")
+            else:
+                logger.error(
+                    f"batch {progress}: {result['id']} failed : {result['error']}"
+                )
+
+    logger.info(
+        f"batch: {stats['done']} summarized, {stats['failed']} failed, "
+        f"{stats['skipped']} skipped"
+    )
+    return stats
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("spec", help="YAML or JSON lines file of the topics")
+    parser.add_argument("--output-dir", default=BATCH_OUTPUT_DIRECTORY)
+    parser.add_argument("--workers", type=int, default=BATCH_MAX_WORKERS)
+    parser.add_argument("--summary-method", default="map_reduce")
+    parser.add_argument(
+        "--embedding-backend",
+        default=os.environ.get("MEDIA_AGENT_EMBEDDINGS"),
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="fetch, embed and index as overlapping stages",
+    )
+    parser.add_argument(
+        "--keep-index",
+        action="store_true",
+        help="keep the index of every item in the shared store, to reopen it later",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="run the items that already have a summary again",
+    )
+    args = parser.parse_args()
+
+    stats = run_batch(
+        load_spec(args.spec),
+        output_directory=args.output_dir,
+        max_workers=args.workers,
+        options=dict(
+            summary_method=args.summary_method,
+            embedding_backend=args.embedding_backend,
+            pipeline=args.pipeline,
+            keep_index=args.keep_index,
+        ),
+        force=args.force,
+    )
+    sys.exit(1 if stats["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
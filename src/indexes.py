@@ -0,0 +1,109 @@
+"""Manage the indexes kept by earlier runs.
+
+    poetry run python -m src.indexes list
+    poetry run python -m src.indexes expire --ttl-days 7
+    poetry run python -m src.indexes compact --max-age-days 30
+    poetry run python -m src.indexes delete <name>
+
+Every search is indexed in a collection of its own, named after its
+platform and query. A search run again, from the terminal UI, a batch
+or the server, reopens its collection instead of fetching the posts and
+summarizing them again.
+"""
+import argparse
+from datetime import datetime
+
+from rich.console import Console
+from rich.table import Table
+
+from src.utils.config import INDEX_DIRECTORY
+from src.utils.index_store import IndexStore
+
+DAY = 24 * 60 * 60
+
+
+def _format_time(timestamp) -> str:
+    if timestamp is None:
+        return "-"
+    return f"{datetime.fromtimestamp(timestamp):%Y-%m-%d %H:%M}"
+
+
+def list_indexes(store: IndexStore, console: Console):
+    table = Table(title=f"Indexes in {store.directory}")
+    for column in ["name", "platform", "query", "chunks", "fetched", "opened"]:
+        table.add_column(column)
+    for manifest in store.list():
+        table.add_row(
+            manifest["name"],
+            manifest.get("platform") or "-",
+            ", ".join(f"{k}={v}" for k, v in (manifest.get("query") or {}).items()),
+            str(manifest.get("num_chunks", "-")),
+            _format_time(manifest.get("fetched_at")),
+            _format_time(manifest.get("opened_at")),
+        )
+    console.print(table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--directory", default=INDEX_DIRECTORY)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="list the indexes, most recently opened first")
+    expire = commands.add_parser(
+        "expire", help="delete the indexes that weren't opened for a while"
+    )
+    expire.add_argument("--ttl-days", type=float)
+    compact = commands.add_parser(
+        "compact", help="rewrite indexes without the space left by replaced vectors"
+    )
+    compact.add_argument("names", nargs="*", help="all the indexes when not set")
+    compact.add_argument(
+        "--max-age-days",
+        type=float,
+        help="also drop the chunks indexed longer ago than that",
+    )
+    delete = commands.add_parser("delete", help="delete indexes")
+    delete.add_argument("names", nargs="+")
+    args = parser.parse_args()
+
+    store = IndexStore(args.directory)
+    console = Console()
+
+    if args.command == "list":
+        list_indexes(store, console)
+
+    elif args.command == "expire":
+        expired = store.expire(None if args.ttl_days is None else args.ttl_days * DAY)
+        console.print(f"{len(expired)} indexes expired")
+
+    elif args.command == "compact":
+        names = args.names or [manifest["name"] for manifest in store.list()]
+        for name in names:
+            try:
+                stats = store.compact(
+                    name,
+                    max_age=(
+                        None if args.max_age_days is None else args.max_age_days * DAY
+                    ),
+                )
+            except ValueError as e:
+                console.print(f"{name}: {e}")
+                continue
+            console.print(
+                f"{name}: {stats['chunks_after']}/{stats['chunks_before']} chunks, "
+                f"{stats['bytes_before'] / 1e6:.1f} MB -> "
+                f"{stats['bytes_after'] / 1e6:.1f} MB"
+            )
+
+    elif args.command == "delete":
+        for name in args.names:
+            if store.describe(name) is None:
+                parser.error(f"no index {name}")
+            try:
+                store.delete(name)
+            except ValueError as e:
+                parser.error(str(e))
+
+
+if __name__ == "__main__":
+    main()
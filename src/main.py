@@ -1,14 +1,14 @@
 import os
 from dotenv import load_dotenv
 from rich.prompt import Prompt
+from src import logger
 from src.utils.display import (
     display_intro,
     select_number_of_posts,
+    select_reopen_index,
     select_topic,
     select_search_queries,
 )
-from src.utils.agent import Agent
-from src.utils.document_loader import RedditSubLoader, TwitterTweetLoader
 
 load_dotenv()
 
@@ -19,26 +19,36 @@ def main():
     platform, keywords, accounts = select_search_queries(topic)
     number_of_posts = select_number_of_posts()
 
-    if platform == "reddit":
-        document_loader = RedditSubLoader(
-            number_submissions=number_of_posts,
-            keywords=keywords,
-            subreddits=accounts,
-        )
-    elif platform == "twitter":
-        document_loader = TwitterTweetLoader.from_bearer_token(
-            oauth2_bearer_token=os.environ.get("TWITTER_BEARER_TOKEN"),
-            number_tweets=number_of_posts,
-            twitter_users=accounts,
-            keywords=keywords,
-        )
-    else:
-        raise ValueError(f"Platform {platform} not supported")
-
-    agent = Agent(loader=document_loader)
-
-    agent.load_documents()
-    agent.init_docsearch()
+    # langchain, chromadb and the platform client are only imported from here on,
+    # keeping them out of the startup path
+    from src.utils.agent import Agent
+    from src.utils.document_loader import get_loader
+
+    document_loader = get_loader(platform, keywords, accounts, number_of_posts)
+
+    agent = Agent(
+        loader=document_loader,
+        incremental=os.environ.get("MEDIA_AGENT_INCREMENTAL") == "1",
+        streaming=os.environ.get("MEDIA_AGENT_STREAMING", "1") == "1",
+        embedding_backend=os.environ.get("MEDIA_AGENT_EMBEDDINGS"),
+    )
+
+    # a search indexed by an earlier run is reopened without fetching it again
+    manifest = agent.index_store.describe(agent.collection_name)
+    reopened = False
+    if manifest and manifest.get("num_chunks") and select_reopen_index(manifest):
+        try:
+            agent.reopen()
+            reopened = True
+        except ValueError as e:
+            logger.warning(f"{e}, fetching the posts again")
+
+    if not reopened:
+        if os.environ.get("MEDIA_AGENT_PIPELINE") == "1":
+            agent.load_and_index()
+        else:
+            agent.load_documents()
+            agent.init_docsearch()
     structured_summary = agent.summarize()
 
     while True:
@@ -0,0 +1,364 @@
+"""HTTP server hosting many agent sessions in one process.
+
+    poetry run python -m src.server --port 8000
+
+Every session has its own index and conversation, while the API
+clients, rate limits and caches are shared by all of them. The API is
+JSON over HTTP:
+
+    POST   /sessions                 {"platform", "keywords", "accounts",
+                                      "number_of_posts", "collection",
+                                      "filter", "wait"}
+    GET    /sessions
+    GET    /sessions/<id>
+    POST   /sessions/<id>/ask        {"question"}
+    DELETE /sessions/<id>
+    GET    /indexes
+
+A session is created by loading, indexing and summarizing its posts, or
+by reopening the index named by `collection`, one of `GET /indexes`.
+`filter` restricts the answers to the chunks whose metadata it matches.
+With `"wait": false` the creation returns at once and the session is
+polled until its status is `ready`.
+"""
+import argparse
+import asyncio
+import json
+import re
+import time
+from collections import OrderedDict
+from http import HTTPStatus
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from src import logger
+from src.utils.config import (
+    BATCH_NUMBER_OF_POSTS,
+    SERVER_HOST,
+    SERVER_MAX_BODY_BYTES,
+    SERVER_MAX_SESSIONS,
+    SERVER_PORT,
+)
+from src.utils.index_store import get_index_store
+
+PLATFORMS = ["twitter", "reddit"]
+
+
+class HTTPError(Exception):
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def default_agent_factory(spec: Dict[str, Any]):
+    """A session on the real platforms, indexed in the shared store."""
+    from src.utils.agent import Agent
+    from src.utils.document_loader import get_loader
+
+    if spec.get("collection"):
+        return Agent(
+            None,
+            collection_name=spec["collection"],
+            summary_method=spec.get("summary_method", "map_reduce"),
+            embedding_backend=spec["embedding_backend"],
+            retrieval_filter=spec.get("filter"),
+        )
+
+    loader = get_loader(
+        spec["platform"],
+        spec.get("keywords"),
+        spec.get("accounts"),
+        spec["number_of_posts"],
+    )
+    # concurrent sessions on the same search don't share a collection
+    return Agent(
+        loader,
+        collection_key="session",
+        incremental=spec.get("incremental", False),
+        summary_method=spec.get("summary_method", "map_reduce"),
+        embedding_backend=spec.get("embedding_backend"),
+        retrieval_filter=spec.get("filter"),
+    )
+
+
+class SessionManager(object):
+    """Creates, runs and evicts the sessions of the server.
+
+    `agent_factory` builds the `Agent` of a session from its spec. Above
+    `max_sessions`, the least recently used idle sessions are dropped.
+    """
+
+    def __init__(
+        self,
+        agent_factory: Callable[[Dict[str, Any]], Any] = default_agent_factory,
+        max_sessions: int = SERVER_MAX_SESSIONS,
+    ):
+        self.agent_factory = agent_factory
+        self.max_sessions = max_sessions
+        self.sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def _validate(self, spec: Dict[str, Any]) -> Dict[str, Any]:
+        if spec.get("filter") is not None and not isinstance(spec["filter"], dict):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "filter should be an object")
+        if spec.get("collection"):
+            manifest = get_index_store().describe(spec["collection"])
+            if manifest is None:
+                raise HTTPError(HTTPStatus.NOT_FOUND, f"no index {spec['collection']}")
+            # the questions are embedded like the chunks of the index were
+            spec["embedding_backend"] = manifest["embedding_backend"]
+            spec["platform"] = manifest.get("platform")
+            return spec
+        if spec.get("platform") not in PLATFORMS:
+            raise HTTPError(
+                HTTPStatus.BAD_REQUEST,
+                f"platform should be one of {', '.join(PLATFORMS)}",
+            )
+        if not spec.get("keywords") and not spec.get("accounts"):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "set keywords or accounts")
+        if isinstance(spec.get("accounts"), str):
+            spec["accounts"] = [spec["accounts"]]
+        spec.setdefault("number_of_posts", BATCH_NUMBER_OF_POSTS)
+        return spec
+
+    async def _evict(self):
+        idle = [
+            session_id
+            for session_id, session in self.sessions.items()
+            if session["status"] in ("ready", "failed")
+        ]
+        while len(self.sessions) >= self.max_sessions and idle:
+            session_id = idle.pop(0)
+            await self.sessions.pop(session_id)["agent"].close()
+            logger.info(f"session {session_id} evicted")
+        if len(self.sessions) >= self.max_sessions:
+            raise HTTPError(
+                HTTPStatus.SERVICE_UNAVAILABLE, "too many sessions are loading"
+            )
+
+    async def create(self, spec: Dict[str, Any]) -> Dict[str, Any]:
+        from src.utils.async_agent import AsyncAgent, get_executor
+
+        spec = self._validate(spec)
+        await self._evict()
+        # building an agent opens the caches and may import the platform client
+        loop = asyncio.get_running_loop()
+        agent = AsyncAgent(
+            await loop.run_in_executor(get_executor(), self.agent_factory, spec)
+        )
+        session = dict(
+            agent=agent,
+            spec=spec,
+            status="loading",
+            created_at=time.time(),
+            summary=None,
+            error=None,
+        )
+        self.sessions[agent.session_id] = session
+        session["task"] = asyncio.create_task(self._start(session))
+        return session
+
+    async def _start(self, session: Dict[str, Any]):
+        agent = session["agent"]
+        try:
+            if session["spec"].get("collection"):
+                await agent.reopen()
+            else:
+                await agent.load_documents()
+                if not agent.agent.loaded_documents:
+                    raise ValueError("the search returned no documents")
+                await agent.init_docsearch()
+            session["status"] = "summarizing"
+            session["summary"] = await agent.summarize()
+            session["status"] = "ready"
+        except Exception as e:
+            logger.error(f"session {agent.session_id} failed : {e}")
+            session["status"] = "failed"
+            session["error"] = repr(e)
+
+    def get(self, session_id: str) -> Dict[str, Any]:
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"no session {session_id}")
+        self.sessions.move_to_end(session_id)
+        return session
+
+    async def ask(self, session_id: str, question: str) -> Dict[str, Any]:
+        session = self.get(session_id)
+        if session["status"] != "ready":
+            raise HTTPError(
+                HTTPStatus.CONFLICT, f"session {session_id} is {session['status']}"
+            )
+        response = await session["agent"].ask_the_db(question)
+        return dict(
+            question=response["question"],
+            answer=response["answer"],
+            sources=[
+                dict(document=document, metadata=metadata)
+                for document, metadata in zip(
+                    response["documents"], response["metadatas"]
+                )
+            ],
+            cached=response["cached"],
+        )
+
+    async def delete(self, session_id: str):
+        session = self.get(session_id)
+        del self.sessions[session_id]
+        session["status"] = "closing"
+        # the steps left are cancelled, the running one is waited for since
+        # closing the index under it would leave it writing a closed client
+        session["task"].cancel()
+        await asyncio.gather(session["task"], return_exceptions=True)
+        await session["agent"].close()
+
+
+def _describe(session: Dict[str, Any]) -> Dict[str, Any]:
+    return dict(
+        session_id=session["agent"].session_id,
+        status=session["status"],
+        collection=session["agent"].agent.collection_name,
+        spec=session["spec"],
+        summary=session["summary"],
+        error=session["error"],
+        num_chunks=len(session["agent"].agent.loaded_documents),
+    )
+
+
+class AgentServer(object):
+    """A minimal asyncio HTTP/1.1 server, one JSON request per connection."""
+
+    def __init__(self, manager: Optional[SessionManager] = None):
+        self.manager = manager or SessionManager()
+        self.routes = [
+            ("POST", re.compile(r"^/sessions/?$"), self._create_session),
+            ("GET", re.compile(r"^/sessions/?$"), self._list_sessions),
+            ("GET", re.compile(r"^/sessions/(\w+)$"), self._get_session),
+            ("POST", re.compile(r"^/sessions/(\w+)/ask$"), self._ask),
+            ("DELETE", re.compile(r"^/sessions/(\w+)$"), self._delete_session),
+            ("GET", re.compile(r"^/indexes/?$"), self._list_indexes),
+        ]
+
+    async def _create_session(self, body: Dict[str, Any]):
+        wait = body.pop("wait", True)
+        session = await self.manager.create(body)
+        if not wait:
+            return HTTPStatus.ACCEPTED, _describe(session)
+        # not cancelled with the request, and done when the session is deleted
+        await asyncio.wait([session["task"]])
+        return HTTPStatus.CREATED, _describe(session)
+
+    async def _list_sessions(self, body: Dict[str, Any]):
+        return HTTPStatus.OK, dict(
+            sessions=[
+                dict(session_id=session_id, status=session["status"])
+                for session_id, session in self.manager.sessions.items()
+            ]
+        )
+
+    async def _get_session(self, body: Dict[str, Any], session_id: str):
+        return HTTPStatus.OK, _describe(self.manager.get(session_id))
+
+    async def _ask(self, body: Dict[str, Any], session_id: str):
+        question = body.get("question")
+        if not question:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "question is missing")
+        return HTTPStatus.OK, await self.manager.ask(session_id, question)
+
+    async def _delete_session(self, body: Dict[str, Any], session_id: str):
+        await self.manager.delete(session_id)
+        return HTTPStatus.NO_CONTENT, None
+
+    async def _list_indexes(self, body: Dict[str, Any]):
+        return HTTPStatus.OK, dict(indexes=get_index_store().list())
+
+    async def _read_request(
+        self, reader: asyncio.StreamReader
+    ) -> Tuple[str, str, Dict[str, Any]]:
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) != 3:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "malformed request line")
+        method, path, _ = request_line
+
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length") or 0)
+        if length > SERVER_MAX_BODY_BYTES:
+            raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "body too large")
+        body = {}
+        if length:
+            try:
+                body = json.loads(await reader.readexactly(length))
+            except ValueError:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "body is not valid JSON")
+            if not isinstance(body, dict):
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "body should be an object")
+        return method, path.split("?", 1)[0], body
+
+    async def _dispatch(self, method: str, path: str, body: Dict[str, Any]):
+        allowed = False
+        for route_method, pattern, handler in self.routes:
+            match = pattern.match(path)
+            if match is None:
+                continue
+            allowed = True
+            if route_method == method:
+                return await handler(body, *match.groups())
+        if allowed:
+            raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, f"{method} not allowed")
+        raise HTTPError(HTTPStatus.NOT_FOUND, f"no route for {path}")
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            method, path, body = await self._read_request(reader)
+            status, payload = await self._dispatch(method, path, body)
+        except HTTPError as e:
+            status, payload = e.status, dict(error=e.message)
+        except Exception as e:
+            logger.exception(e)
+            status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, dict(error=repr(e))
+
+        content = b"" if payload is None else json.dumps(payload, default=str).encode()
+        writer.write(
+            (
+                f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(content)}\r\n"
+                "Connection: close\r\n\r\n"
+            ).encode("latin-1")
+            + content
+        )
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self, host: str = SERVER_HOST, port: int = SERVER_PORT):
+        return await asyncio.start_server(self.handle, host, port)
+
+
+async def serve(host: str = SERVER_HOST, port: int = SERVER_PORT):
+    server = await AgentServer().start(host, port)
+    logger.info(f"serving agent sessions on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
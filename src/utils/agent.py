@@ -1,112 +1,585 @@
-import atexit
 import sys
 import json
+import time
+import uuid
+from functools import wraps
+from typing import Any, Dict, Optional
 from rich.console import Console
-from langchain.vectorstores import Chroma
-from langchain.embeddings.openai import OpenAIEmbeddings
-import chromadb
-from chromadb.config import Settings
-import tiktoken
+from langchain.base_language import BaseLanguageModel
+from langchain.docstore.document import Document
 from src import logger
 from src.utils.chains import (
     get_retrieval_qa_chain,
     summarize_tweets,
+    summarize_tweets_map_reduce,
 )
-from src.utils.data_processing import (
-    get_texts_from_documents,
-    get_metadatas_from_documents,
+from src.utils.data_processing import get_texts_from_documents
+from src.utils.answer_cache import SemanticAnswerCache
+from src.utils.display import (
+    display_bot_answer,
+    display_summary_and_questions,
 )
-from src.utils.display import display_bot_answer, display_summary_and_questions
+from src.utils.dedup import NearDuplicateFilter, deduplicate_documents
+from src.utils.embedding_backends import get_embeddings
+from src.utils.embedding_cache import CachedEmbeddings
+from src.utils.config import (
+    COMPLETION_RESERVED_TOKENS,
+    EMBEDDING_BACKEND,
+    INDEX_COLLECTION_KEY,
+    INDEX_DIRECTORY,
+    MAX_CONTEXT_TOKENS,
+    PIPELINE_EMBED_BATCH_SIZE,
+)
+from src.utils.data_processing import batched, split_documents
+from src.utils.history import HistoryWriter, get_history_writer
+from src.utils.index_store import (
+    get_collection_fingerprint,
+    get_collection_name,
+    get_contents_fingerprint,
+    get_index_store,
+    get_query,
+    get_session_collection_name,
+)
+from src.utils.indexing import (
+    assign_chunk_ids,
+    get_index_fingerprint,
+    select_delta,
+    upsert_documents,
+    upsert_embedded,
+)
+from src.utils.metrics import (
+    MetricsRegistry,
+    get_metrics_exporters,
+    get_process_metrics,
+    recording_into,
+    timed,
+)
+from src.utils.pipeline import run_pipeline
+from src.utils.retrieval import PackedRetriever
+from src.utils.source_index import SourceIndex
+from src.utils.streaming import TokenStreamHandler
+from src.utils.tokens import TokenCounter, TokenTextSplitter
 
 from src.utils.prompts import summarization_question_template, summarization_template
 from src.utils.document_loader import DocumentLoader
-from langchain.text_splitter import CharacterTextSplitter
+
+
+def _recorded(method):
+    """Record what a step of an agent does into the registry of its session."""
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with recording_into(self.metrics):
+            return method(self, *args, **kwargs)
+
+    return wrapper
 
 
 class Agent(object):
     def __init__(
         self,
-        loader: DocumentLoader,
+        loader: Optional[DocumentLoader],
         persist_db: bool = True,
+        incremental: bool = False,
+        summary_method: str = "map_reduce",
+        streaming: bool = False,
+        deduplicate: bool = True,
+        embedding_backend: Optional[str] = None,
+        llm: Optional[BaseLanguageModel] = None,
+        persist_directory: Optional[str] = INDEX_DIRECTORY,
+        collection_name: Optional[str] = None,
+        collection_key: str = INDEX_COLLECTION_KEY,
+        retrieval_filter: Optional[Dict[str, Any]] = None,
+        history_writer: Optional[HistoryWriter] = None,
     ):
+        # None when reopening an index by its `collection_name`
         self.loader = loader
         self.loaded_documents = []
-        self.embeddings = OpenAIEmbeddings()
-        self.persist_db = persist_db
+        self.embedding_backend = embedding_backend or EMBEDDING_BACKEND
+        self.embeddings = CachedEmbeddings(get_embeddings(self.embedding_backend))
+        self.session_id = uuid.uuid4().hex
+        # the index is only kept in memory when None
+        self.persist_directory = persist_directory
+        self.persist_db = persist_db and persist_directory is not None
+        self.index_store = get_index_store(persist_directory)
+        # one collection per search, reused by its later runs, or per session
+        if collection_name is None:
+            collection_name = (
+                get_session_collection_name(self.session_id)
+                if collection_key == "session"
+                else get_collection_name(
+                    loader.source,
+                    loader._get_search_params(),
+                    self.embedding_backend,
+                )
+            )
+        self.collection_name = collection_name
+        # Chroma `where` filter on the metadata of the chunks to retrieve
+        self.retrieval_filter = retrieval_filter
+        # without it, the collection is emptied before indexing the documents
+        self.incremental = incremental
+        # cursor of the index the loader resumed from, only newer posts are fetched
+        self.resumed_from = None
+        # used when the documents don't fit in a single prompt
+        self.summary_method = summary_method
+        self.streaming = streaming
+        # collapse copy-pasted posts and crossposts before splitting
+        self.deduplicate = deduplicate
+        # the OpenAI chat model when not set
+        self.llm = llm
+        self.token_counter = TokenCounter()
+        self.answer_cache = SemanticAnswerCache(self.embeddings)
         self.chain = None
-        self.client = None
+        self.docsearch = None
         self.collection = None
+        # held while the session may write its collection
+        self.index_lock = None
+        self.read_only = False
+        # fingerprint of the chunks of the collection, stored with its summary
+        self.index_fingerprint = None
+        # summary stored with a reopened index, reused instead of asking the LLM
+        self.stored_summary = None
+        self.source_index = SourceIndex()
         self.console = Console()
-        self.history = {"history": []}
+        # session metadata, the conversation itself is streamed to the history log
+        self.history = {}
+        # the writer of the default history log when not set
+        self.history_writer = history_writer or get_history_writer()
+        # what this session records, also recorded in the process-wide registry
+        self.metrics = MetricsRegistry(parent=get_process_metrics())
+        self.metrics_exporters = get_metrics_exporters()
 
-        def save_history():
-            self.console.log(
-                "Saving conversation history with sources and metadata ..."
-            )
-            with open("outputs/history.json", "w") as f:
-                json.dump(self.history, f)
+    def _fits_in_context(self):
+        # the stuff prompt leaves room for the completion, as packing does
+        return not self.token_counter.exceeds(
+            self.loaded_documents,
+            MAX_CONTEXT_TOKENS - COMPLETION_RESERVED_TOKENS,
+            template=summarization_template,
+        )
+
+    def _export_metrics(self):
+        for exporter in self.metrics_exporters:
+            try:
+                exporter.export(self.metrics.parent)
+            except Exception as e:
+                logger.error(f"could not export metrics : {e}")
 
-        atexit.register(save_history)
+    def _resume_loader(self):
+        """Point the loader at the posts newer than the indexed ones, when incremental."""
+        if not self.incremental:
+            return
+        manifest = self.index_store.describe(self.collection_name) or {}
+        if manifest.get("cursor"):
+            self.loader.resume(manifest["cursor"])
+            self.resumed_from = manifest["cursor"]
+            self.history["resumed_from"] = self.resumed_from
 
-    def _get_number_of_tokens(self):
-        encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
-        texts = [doc.page_content for doc in self.loaded_documents]
-        text = "\n".join(texts)
-        formatted_summary_template = summarization_template.format(text=text)
-        num_tokens = len(encoding.encode(formatted_summary_template))
-        return num_tokens
+    def _read_back(self) -> Dict[str, Any]:
+        """Make the chunks of the whole collection the documents of the session."""
+        with self.metrics.timer("chroma_seconds", operation="get"):
+            contents = self.docsearch._collection.get(
+                include=["documents", "metadatas"]
+            )
+        self.loaded_documents = [
+            Document(page_content=text, metadata=metadata or {})
+            for text, metadata in zip(contents["documents"], contents["metadatas"])
+        ]
+        self.source_index.add(self.loaded_documents)
+        return contents
 
+    @_recorded
+    @timed("stage_seconds", stage="load_documents")
     def load_documents(self):
-        text_splitter = CharacterTextSplitter(chunk_size=2000)
+        text_splitter = TokenTextSplitter(counter=self.token_counter)
+        self._resume_loader()
+        documents = self.loader.load(console=self.console, history=self.history)
 
-        self.loaded_documents = text_splitter.split_documents(
-            self.loader.load(console=self.console, history=self.history)
+        if self.deduplicate:
+            deduplication_stats = {}
+            documents = deduplicate_documents(documents, deduplication_stats)
+            logger.info(
+                f"deduplication: {len(documents)} documents kept out of "
+                f"{deduplication_stats['documents']}"
+            )
+            self.history["deduplication"] = deduplication_stats
+
+        self.loaded_documents = split_documents(text_splitter, documents)
+
+    @_recorded
+    @timed("stage_seconds", stage="load_and_index")
+    def load_and_index(self):
+        """Fetch, split, embed and index documents as overlapping stages.
+
+        Replaces `load_documents` followed by `init_docsearch`: chunks are
+        embedded and upserted while the loader is still fetching, so the
+        wall-clock time is close to the one of the slowest stage. Raises a
+        `ValueError` when the search returned no documents.
+        """
+        text_splitter = TokenTextSplitter(counter=self.token_counter)
+        self.embeddings.reset_stats()
+        self.docsearch = self._open_for_indexing()
+        self._resume_loader()
+        collection = self.docsearch._collection
+        indexing_stats = dict(new=0, changed=0, unchanged=0, deleted=0)
+        self.loaded_documents = []
+        # sources of late duplicates are merged into documents that may already
+        # be indexed, they are then only kept in memory
+        duplicate_filter = NearDuplicateFilter()
+
+        def dedup(documents):
+            if not self.deduplicate:
+                return documents
+            return duplicate_filter.filter(documents)
+
+        def split(documents):
+            for document in documents:
+                yield from split_documents(text_splitter, [document])
+
+        def embed(chunks):
+            for batch in batched(chunks, PIPELINE_EMBED_BATCH_SIZE):
+                self.loaded_documents.extend(batch)
+                self.source_index.add(batch)
+                ids, delta = select_delta(
+                    collection,
+                    assign_chunk_ids(batch),
+                    batch,
+                    indexing_stats,
+                )
+                vectors = self.embeddings.embed_documents(
+                    get_texts_from_documents(delta)
+                )
+                yield ids, delta, vectors
+
+        def index(batches):
+            for ids, delta, vectors in batches:
+                upsert_embedded(collection, ids, delta, vectors)
+                yield from ids
+
+        with self.console.status(
+            "Loading and indexing documents ... ⌛ \n",
+            spinner="aesthetic",
+            speed=1.5,
+            spinner_style="red",
+        ):
+            pipeline_stats = run_pipeline(
+                ("fetch", self.loader.lazy_load()),
+                [
+                    ("dedup", dedup),
+                    ("split", split),
+                    ("embed", embed),
+                    ("index", index),
+                ],
+            )
+
+        for stage, stage_stats in pipeline_stats.items():
+            logger.info(
+                f"{stage}: {stage_stats['items_out']} items in "
+                f"{stage_stats['elapsed_s']}s ({stage_stats['throughput']}/s), "
+                f"blocked {stage_stats['blocked_s']}s by downstream stages"
+            )
+
+        self.history["search_params"] = self.loader._get_search_params()
+        self.history["num_documents"] = pipeline_stats["fetch"]["items_out"]
+        self.history["source"] = self.loader.source
+        self.history["pipeline"] = pipeline_stats
+        if self.deduplicate:
+            self.history["deduplication"] = duplicate_filter.stats
+        self.history["indexing"] = indexing_stats
+        self.history["embedding_cache"] = dict(
+            hits=self.embeddings.hits,
+            misses=self.embeddings.misses,
         )
+        if self.resumed_from:
+            # the summary covers the posts of the earlier runs as well
+            self._read_back()
+        if not self.loaded_documents:
+            raise ValueError("the search returned no documents")
+
+        self._persist()
+        self._init_chain()
 
+    @_recorded
+    @timed("stage_seconds", stage="init_docsearch")
     def init_docsearch(self):
-        texts = get_texts_from_documents(self.loaded_documents)
-        metadatas = get_metadatas_from_documents(self.loaded_documents)
+        self.embeddings.reset_stats()
+        self.docsearch = self._open_for_indexing()
+        indexing_stats = upsert_documents(
+            self.docsearch._collection,
+            self.embeddings,
+            self.loaded_documents,
+        )
+        logger.info(
+            f"indexing {self.collection_name}: {indexing_stats['new']} new, "
+            f"{indexing_stats['changed']} changed, "
+            f"{indexing_stats['unchanged']} unchanged, "
+            f"{indexing_stats['deleted']} deleted chunks"
+        )
+        self.history["indexing"] = indexing_stats
+
+        logger.info(
+            f"embedding cache: {self.embeddings.hits} hits, "
+            f"{self.embeddings.misses} misses"
+        )
+        self.history["embedding_cache"] = dict(
+            hits=self.embeddings.hits,
+            misses=self.embeddings.misses,
+        )
+
+        if self.resumed_from:
+            self._read_back()
+        self.source_index.add(self.loaded_documents)
 
-        self.docsearch = Chroma.from_texts(
-            texts,
+        self._persist()
+        self._init_chain()
+
+    def _open_for_indexing(self):
+        """Open the collection to index into, locked until `close`."""
+        self.index_lock = self.index_store.lock(self.collection_name)
+        if self.index_lock is None:
+            # another session writes the same search, this one gets its own
+            logger.warning(
+                f"index {self.collection_name} is open in another session, "
+                "indexing into a collection of this session"
+            )
+            self.collection_name = get_session_collection_name(self.session_id)
+            self.index_lock = self.index_store.lock(self.collection_name)
+        return self.index_store.open(
+            self.collection_name,
             self.embeddings,
-            metadatas=metadatas,
-            persist_directory="db",
+            reset=not self.incremental,
+        )
+
+    def _persist(self):
+        if not self.persist_db:
+            return
+        self.docsearch.persist()
+        self.index_fingerprint = get_collection_fingerprint(self.docsearch._collection)
+        manifest = self.index_store.describe(self.collection_name) or {}
+        # the summary of the previous run still holds when nothing changed
+        unchanged = manifest.get("fingerprint") == self.index_fingerprint
+        if unchanged and manifest.get("summary_fingerprint") == self.index_fingerprint:
+            self.stored_summary = manifest.get("summary")
+        now = time.time()
+        self.index_store.record(
+            self.collection_name,
+            platform=self.loader.source,
+            query=get_query(self.loader._get_search_params()),
+            embedding_backend=self.embedding_backend,
+            session_id=self.session_id,
+            fetched_at=now,
+            opened_at=now,
+            num_documents=self.history.get("num_documents"),
+            num_chunks=self.docsearch._collection.count(),
+            fingerprint=self.index_fingerprint,
+            # a later incremental run only fetches the posts after it
+            cursor=self.loader.cursor,
+            # summarizing the new contents replaces it
+            summary=manifest.get("summary") if unchanged else None,
+            summary_fingerprint=(
+                manifest.get("summary_fingerprint") if unchanged else None
+            ),
+        )
+
+    def _record(self, **tags):
+        """Update the manifest of the collection, under its lock.
+
+        A session that doesn't hold the lock, e.g. a reopened one, takes it
+        for the write, and leaves the manifest as is when another session
+        writes the collection or it was deleted meanwhile.
+        """
+        lock = self.index_lock or self.index_store.lock(self.collection_name)
+        if lock is None:
+            logger.info(
+                f"index {self.collection_name} is written by another session, "
+                "its manifest is left as is"
+            )
+            return
+        try:
+            if self.index_store.describe(self.collection_name) is not None:
+                self.index_store.record(self.collection_name, **tags)
+        finally:
+            if lock is not self.index_lock:
+                self.index_store.unlock(lock)
+
+    @_recorded
+    @timed("stage_seconds", stage="reopen")
+    def reopen(self):
+        """Open the index of a previous run instead of fetching and indexing.
+
+        The chunks are read back from the collection, and its stored
+        summary, if any, is reused by `generate_summary` when it was made
+        from the same chunks. The session never writes the collection.
+        """
+        manifest = self.index_store.describe(self.collection_name)
+        if manifest is None or not manifest.get("num_chunks"):
+            raise ValueError(f"there is no index {self.collection_name} to reopen")
+        if manifest.get("embedding_backend", self.embedding_backend) != (
+            self.embedding_backend
+        ):
+            raise ValueError(
+                f"index {self.collection_name} was embedded with "
+                f"{manifest['embedding_backend']}, not {self.embedding_backend}"
+            )
+
+        # the directory isn't read while another session writes it
+        lock = self.index_store.lock(self.collection_name, shared=True)
+        if lock is None:
+            raise ValueError(
+                f"index {self.collection_name} is being written by another session"
+            )
+        try:
+            self.docsearch = self.index_store.open(
+                self.collection_name, self.embeddings, read_only=True
+            )
+            contents = self._read_back()
+        finally:
+            self.index_store.unlock(lock)
+        self.read_only = True
+
+        self.index_fingerprint = get_contents_fingerprint(
+            contents["ids"], contents["metadatas"]
         )
+        if manifest.get("fingerprint") != self.index_fingerprint:
+            logger.warning(
+                f"index {self.collection_name} changed since its manifest was "
+                "written, its summary is made again"
+            )
+            self._record(
+                num_chunks=len(self.loaded_documents),
+                fingerprint=self.index_fingerprint,
+            )
+        if manifest.get("summary_fingerprint") == self.index_fingerprint:
+            self.stored_summary = manifest.get("summary")
 
-        if self.persist_db:
-            self.docsearch.persist()
-        self.chain = get_retrieval_qa_chain(self.docsearch.as_retriever())
-        self.client = chromadb.Client(
-            Settings(
-                chroma_db_impl="duckdb+parquet",
-                persist_directory="db",
+        self.history["source"] = manifest.get("platform")
+        self.history["search_params"] = manifest.get("query")
+        self.history["num_documents"] = manifest.get("num_documents")
+        self.history["reopened"] = dict(
+            collection=self.collection_name,
+            fetched_at=manifest.get("fetched_at"),
+        )
+        self._record(opened_at=time.time())
+        logger.info(
+            f"index {self.collection_name} reopened with "
+            f"{len(self.loaded_documents)} chunks"
+        )
+        self._init_chain()
+
+    def close(self):
+        """Release the index, e.g. when a server drops the session."""
+        if self.docsearch is not None:
+            self.index_store.close(
+                self.docsearch, persist=self.persist_db and not self.read_only
             )
+            self.docsearch = None
+        self.index_store.unlock(self.index_lock)
+        self.index_lock = None
+
+    def _init_chain(self):
+        # cached answers are only valid for the current index contents
+        self.answer_cache.set_scope(
+            get_index_fingerprint(self.docsearch._collection, self.loaded_documents)
+            + json.dumps(self.retrieval_filter, sort_keys=True)
+        )
+        self.chain = get_retrieval_qa_chain(
+            PackedRetriever(
+                self.docsearch,
+                counter=self.token_counter,
+                filter=self.retrieval_filter,
+            ),
+            streaming=self.streaming,
+            llm=self.llm,
         )
-        self.collection = self.client.get_collection("langchain")
+        self.collection = self.docsearch._collection
+
+    def _get_sources(self, sources):
+        """Resolve the sources of an answer to the documents and metadatas.
+
+        Sources indexed in this session are resolved in memory. Only unknown
+        ones, e.g. chunks from previous incremental runs, hit the collection.
+        """
+        documents, metadatas, missing = self.source_index.resolve(sources)
+
+        if missing:
+            conditions = [{"source": source} for source in missing]
+            # tweet ids are stored as integers
+            conditions += [
+                {"source": int(source)} for source in missing if source.isdigit()
+            ]
+            output = self.collection.get(
+                where=conditions[0] if len(conditions) == 1 else {"$or": conditions},
+                include=["metadatas", "documents"],
+            )
+            documents += output["documents"]
+            metadatas += output["metadatas"]
+
+        return documents, metadatas
 
     def summarize(self):
-        if self.loaded_documents is not None:
-            num_tokens = self._get_number_of_tokens()
-            if num_tokens <= 4097:
+        try:
+            structured_summary = self.generate_summary()
+        except ValueError as e:
+            logger.error(str(e))
+            sys.exit()
+
+        display_summary_and_questions(
+            structured_summary.get("summary"),
+            structured_summary.get("q1"),
+            structured_summary.get("q2"),
+            structured_summary.get("q3"),
+        )
+        return structured_summary
+
+    @_recorded
+    @timed("stage_seconds", stage="summarize")
+    def generate_summary(self):
+        """Summarize the loaded documents without any display nor prompt.
+
+        Raises a `ValueError` when the model doesn't answer with the
+        expected JSON, leaving the caller to decide what to do.
+        """
+        if self.stored_summary is not None:
+            # the index didn't change since it was summarized
+            summary = json.dumps(self.stored_summary)
+
+        elif self.loaded_documents is not None:
+            if self._fits_in_context():
                 method = "stuff"
             else:
-                method = "chromadb"
+                method = self.summary_method
 
             with self.console.status(
                 "Generating a summary of the loaded tweets ... ⌛ \n",
                 spinner="aesthetic",
                 speed=1.5,
                 spinner_style="red",
-            ):
+            ) as status:
+                callbacks = None
+                if self.streaming:
+                    callbacks = [
+                        TokenStreamHandler(status=status, style="dim", transient=True)
+                    ]
+
                 if method == "stuff":
-                    summary = summarize_tweets(self.loaded_documents)
+                    summary = summarize_tweets(
+                        self.loaded_documents,
+                        callbacks=callbacks,
+                        llm=self.llm,
+                    )
+
+                elif method == "map_reduce":
+                    summary = summarize_tweets_map_reduce(
+                        self.loaded_documents,
+                        callbacks=callbacks,
+                        llm=self.llm,
+                    )
 
                 elif method == "chromadb":
                     response = self.chain(
                         {
                             "question": summarization_question_template,
                         },
+                        callbacks=callbacks,
                     )
                     summary = response["answer"]
 
@@ -115,20 +588,26 @@ class Agent(object):
 
         try:
             structured_summary = json.loads(summary)
-        except Exception as e:
-            logger.error(str(e))
-            sys.exit()
+        except json.JSONDecodeError as e:
+            raise ValueError(f"the summary is not valid JSON : {e}") from e
 
         summary = structured_summary.get("summary")
         q1 = structured_summary.get("q1")
         q2 = structured_summary.get("q2")
         q3 = structured_summary.get("q3")
-        display_summary_and_questions(summary, q1, q2, q3)
         self.history["summary_metadata"] = {}
         self.history["summary_metadata"]["summary"] = summary
         self.history["summary_metadata"]["q1"] = q1
         self.history["summary_metadata"]["q2"] = q2
         self.history["summary_metadata"]["q3"] = q3
+        if self.persist_db and self.stored_summary is None:
+            self._record(
+                summary=structured_summary,
+                summary_fingerprint=self.index_fingerprint,
+            )
+        self.history["metrics"] = self.metrics.to_dict()
+        self.history_writer.write("session", self.session_id, self.history)
+        self._export_metrics()
         return structured_summary
 
     def ask_the_db(self, user_input, structured_summary):
@@ -145,14 +624,61 @@ class Agent(object):
             spinner="aesthetic",
             speed=1.5,
             spinner_style="red",
-        ):
+        ) as status:
+            callbacks = None
+            if self.streaming:
+                # sources are resolved and printed once the answer is complete
+                callbacks = [
+                    TokenStreamHandler(
+                        title="Answer :",
+                        status=status,
+                        stop_marker="SOURCES:",
+                    )
+                ]
+            response = self.answer(user_input, callbacks=callbacks)
+
+        display_bot_answer(
+            response,
+            response["documents"],
+            response["metadatas"],
+            print_answer=not self.streaming or response["cached"],
+        )
+
+    @_recorded
+    @timed("stage_seconds", stage="ask_the_db")
+    def answer(self, question, callbacks=None):
+        """Answer a question from the index, without any display nor prompt.
+
+        Returns the answer and sources of the chain, the documents and
+        metadatas of the sources, and whether it came from the answer cache.
+        """
+        metrics_start = self.metrics.snapshot()
+
+        result = self.answer_cache.get_exact(question)
+        if result is None:
+            question_embedding = self.answer_cache.embed(question)
+            result = self.answer_cache.get(question, question_embedding)
+
+        cached = result is not None
+        if cached:
+            logger.info("answer served from the answer cache")
+            self.metrics.increment("answer_cache_hits_total")
+        else:
             result = self.chain(
-                {"question": user_input},
+                {"question": question},
                 return_only_outputs=True,
+                callbacks=callbacks,
             )
-        display_bot_answer(
+            self.answer_cache.put(question, question_embedding, result)
+
+        documents, metadatas = self._get_sources(result["sources"])
+        self.history_writer.write_turn(
+            self.session_id,
+            question,
             result,
-            self.collection,
-            self.history,
-            user_input,
+            documents,
+            metadatas,
+            metrics=self.metrics.to_dict(since=metrics_start),
         )
+        self._export_metrics()
+        return dict(result, documents=documents, metadatas=metadatas, cached=cached)
@@ -0,0 +1,87 @@
+"""Semantic cache of the answers given by the retrieval chain."""
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from src.utils.config import ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_THRESHOLD
+
+
+class SemanticAnswerCache(object):
+    """Answers keyed by the embedding of their question.
+
+    A question whose cosine similarity with a cached one is above
+    `threshold` gets the cached answer back. Entries belong to a scope,
+    a fingerprint of the index contents, and are dropped when it changes.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+    ):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.scope = None
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set_scope(self, scope: str):
+        with self._lock:
+            if scope != self.scope:
+                self._entries.clear()
+                self.scope = scope
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def embed(self, question: str) -> List[float]:
+        return self.embeddings.embed_query(question)
+
+    def get_exact(self, question: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(question)
+            if entry is None:
+                return None
+            self._entries.move_to_end(question)
+            return dict(entry["result"])
+
+    def get(self, question: str, vector: List[float]) -> Optional[Dict[str, Any]]:
+        result = self.get_exact(question)
+        if result is not None:
+            return result
+
+        with self._lock:
+            if not self._entries:
+                return None
+
+            questions = list(self._entries)
+            matrix = np.array([self._entries[q]["vector"] for q in questions])
+            similarities = matrix @ _normalize(vector)
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+
+            self._entries.move_to_end(questions[best])
+            return dict(self._entries[questions[best]]["result"])
+
+    def put(self, question: str, vector: List[float], result: Dict[str, Any]):
+        with self._lock:
+            self._entries[question] = dict(
+                vector=_normalize(vector),
+                result=dict(result),
+            )
+            self._entries.move_to_end(question)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def _normalize(vector: List[float]) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
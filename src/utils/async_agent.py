@@ -0,0 +1,76 @@
+"""Awaitable version of the agent, for serving many sessions from one process."""
+import asyncio
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import lru_cache, partial
+from typing import Any, Dict, Optional
+
+from src.utils.agent import Agent
+from src.utils.config import SERVER_MAX_WORKERS
+
+
+@lru_cache(maxsize=None)
+def get_executor(max_workers: int = SERVER_MAX_WORKERS) -> Executor:
+    """Threads running the blocking steps of every session of the process."""
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent")
+
+
+class AsyncAgent(object):
+    """Runs the steps of an `Agent` on a thread pool, without blocking the loop.
+
+    Fetching, indexing (Chroma) and the chains are blocking calls, they
+    run on threads shared by all the sessions so the event loop keeps
+    serving the others. The steps of one session are run one at a time,
+    a cancelled step still runs to its end before the next one starts.
+    Clients, rate limits, the response and embedding caches and the
+    history log are process-wide, so every session shares them.
+    """
+
+    def __init__(self, agent: Agent, executor: Optional[Executor] = None):
+        self.agent = agent
+        self.executor = executor or get_executor()
+        self.structured_summary: Optional[Dict[str, Any]] = None
+        self._lock = asyncio.Lock()
+        # no terminal in front of a session
+        self.agent.console.quiet = True
+
+    @property
+    def session_id(self) -> str:
+        return self.agent.session_id
+
+    async def _run(self, fn, *args, **kwargs):
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor, partial(fn, *args, **kwargs))
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # a thread can't be interrupted, the step holds the lock until
+                # it returns so that the next one, e.g. `close`, runs after it
+                await asyncio.wait([future])
+                raise
+
+    async def load_documents(self):
+        await self._run(self.agent.load_documents)
+
+    async def init_docsearch(self):
+        await self._run(self.agent.init_docsearch)
+
+    async def load_and_index(self):
+        await self._run(self.agent.load_and_index)
+
+    async def reopen(self):
+        await self._run(self.agent.reopen)
+
+    async def close(self):
+        await self._run(self.agent.close)
+
+    async def summarize(self) -> Dict[str, Any]:
+        self.structured_summary = await self._run(self.agent.generate_summary)
+        return self.structured_summary
+
+    async def ask_the_db(self, question: str) -> Dict[str, Any]:
+        """Answer a question, `q1`, `q2` and `q3` being the suggested ones."""
+        if self.structured_summary and question in self.structured_summary:
+            question = self.structured_summary[question]
+        response = await self._run(self.agent.answer, question)
+        return dict(response, question=question)
@@ -1,15 +1,127 @@
+import time
+from langchain.callbacks.base import BaseCallbackHandler
 from langchain.chains import RetrievalQAWithSourcesChain
+from langchain.chains.qa_with_sources.stuff_prompt import EXAMPLE_PROMPT, PROMPT
 from langchain.chat_models import ChatOpenAI
 from langchain.chains.summarize import load_summarize_chain
 from langchain.prompts import PromptTemplate
-from src.utils.prompts import summarization_template
+from langchain.docstore.document import Document
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+from src import logger
+from src.utils.config import (
+    COMPLETION_RESERVED_TOKENS,
+    MAX_CONTEXT_TOKENS,
+    SUMMARY_MAX_WORKERS,
+)
+from src.utils.metrics import MetricsRegistry, get_metrics, propagate_metrics
+from src.utils.prompts import (
+    combine_summary_template,
+    map_summary_template,
+    reduce_summary_template,
+    summarization_template,
+)
+from src.utils.tokens import (
+    TokenCounter,
+    count_tokens,
+    group_documents_by_tokens,
+    pack_documents,
+    truncate_document,
+)
 
 
-def get_retrieval_qa_chain(retriever):
+class LLMMetricsHandler(BaseCallbackHandler):
+    """Records the calls, latency and tokens of an LLM.
+
+    Token counts come from the usage returned by the API. Streamed
+    completions report no usage, their tokens are counted locally.
+    """
+
+    def __init__(self, chain: str, registry: Optional[MetricsRegistry] = None):
+        self.chain = chain
+        # the registry of the session making the call when not set
+        self._registry = registry
+        self._runs: Dict[UUID, Dict[str, Any]] = {}
+
+    @property
+    def registry(self) -> MetricsRegistry:
+        return self._registry or get_metrics()
+
+    def on_llm_start(
+        self,
+        serialized: Dict[str, Any],
+        prompts: List[str],
+        *,
+        run_id: UUID,
+        **kwargs: Any,
+    ) -> None:
+        self._runs[run_id] = dict(
+            start=time.perf_counter(),
+            prompts=prompts,
+            streamed_tokens=0,
+        )
+        self.registry.increment("llm_requests_total", chain=self.chain)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        if run_id in self._runs:
+            self._runs[run_id]["streamed_tokens"] += 1
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        self.registry.observe(
+            "llm_seconds",
+            time.perf_counter() - run["start"],
+            chain=self.chain,
+        )
+
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage:
+            prompt_tokens = usage.get("prompt_tokens", 0)
+            completion_tokens = usage.get("completion_tokens", 0)
+        else:
+            prompt_tokens = sum(count_tokens(prompt) for prompt in run["prompts"])
+            completion_tokens = run["streamed_tokens"] or sum(
+                count_tokens(generation.text)
+                for generations in response.generations
+                for generation in generations
+            )
+
+        self.registry.increment(
+            "llm_prompt_tokens_total", prompt_tokens, chain=self.chain
+        )
+        self.registry.increment(
+            "llm_completion_tokens_total", completion_tokens, chain=self.chain
+        )
+
+    def on_llm_error(
+        self, error: BaseException, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._runs.pop(run_id, None)
+        self.registry.increment("llm_errors_total", chain=self.chain)
+
+
+def get_llm(streaming=False, llm=None, chain="chain"):
+    """The chat model of the chains, unless another `llm` is given."""
+    if llm is not None:
+        return llm
+    return ChatOpenAI(
+        temperature=0,
+        streaming=streaming,
+        callbacks=[LLMMetricsHandler(chain)],
+    )
+
+
+def get_retrieval_qa_chain(retriever, streaming=False, llm=None):
     chain = RetrievalQAWithSourcesChain.from_chain_type(
-        ChatOpenAI(temperature=0),
+        get_llm(streaming, llm, chain="retrieval_qa"),
         chain_type="stuff",
         retriever=retriever,
+        # the prompts the retriever packs the documents for
+        chain_type_kwargs=dict(prompt=PROMPT, document_prompt=EXAMPLE_PROMPT),
     )
     return chain
 
@@ -17,18 +129,95 @@ def get_retrieval_qa_chain(retriever):
 ### Summarization
 
 
-def get_summarization_chain(prompt):
-    llm = ChatOpenAI(temperature=0)
+def get_summarization_chain(prompt, streaming=False, llm=None):
     chain = load_summarize_chain(
-        llm,
+        get_llm(streaming, llm, chain="summarization"),
         chain_type="stuff",
         prompt=prompt,
     )
     return chain
 
 
-def summarize_tweets(docs):
+def summarize_tweets(docs, callbacks=None, llm=None):
+    """Summarize the documents that fit in a single prompt, in their order."""
+    counter = TokenCounter()
     prompt = PromptTemplate(template=summarization_template, input_variables=["text"])
-    chain = get_summarization_chain(prompt)
-    summary = chain.run(docs)
+    token_budget = (
+        MAX_CONTEXT_TOKENS
+        - COMPLETION_RESERVED_TOKENS
+        - counter.count_text(summarization_template.format(text=""))
+    )
+    packed = pack_documents(docs, token_budget, counter)
+    if len(packed) < len(docs):
+        logger.info(
+            f"summarizing the {len(packed)} documents out of {len(docs)} that fit"
+        )
+    chain = get_summarization_chain(prompt, streaming=callbacks is not None, llm=llm)
+    summary = chain.run(packed, callbacks=callbacks)
     return summary
+
+
+def _run_summarization_chain(template, docs, callbacks=None, llm=None):
+    prompt = PromptTemplate(template=template, input_variables=["text"])
+    chain = get_summarization_chain(prompt, streaming=callbacks is not None, llm=llm)
+    return chain.run(docs, callbacks=callbacks)
+
+
+def summarize_tweets_map_reduce(
+    docs: List[Document],
+    max_workers: int = SUMMARY_MAX_WORKERS,
+    callbacks=None,
+    llm=None,
+):
+    """Summarize a corpus larger than the context window.
+
+    Documents are packed into token-budgeted groups that are summarized
+    concurrently, then the partial summaries are packed and merged again
+    until they fit in a single prompt that produces the JSON summary.
+    When no partial summaries can be merged anymore, they are truncated to
+    be merged in pairs, so no document is left out of the final summary. Latency grows with the depth of this tree, not with the
+    number of docs.
+    `callbacks` only receive the final reduce call.
+    """
+    counter = TokenCounter()
+
+    def token_budget(template):
+        overhead = counter.count_text(template.format(text=""))
+        return MAX_CONTEXT_TOKENS - COMPLETION_RESERVED_TOKENS - overhead
+
+    level = docs
+    template = map_summary_template
+    depth = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # the raw documents always go through at least one map level
+        while depth == 0 or counter.exceeds(
+            level,
+            token_budget(reduce_summary_template),
+        ):
+            groups = group_documents_by_tokens(level, token_budget(template), counter)
+            if depth > 0 and len(groups) >= len(level):
+                # partial summaries don't shrink anymore, they are cut to be merged
+                # at least in pairs
+                logger.warning(
+                    f"map-reduce level {depth + 1}: truncating {len(level)} partial "
+                    "summaries too long to be merged"
+                )
+                level = [
+                    truncate_document(summary, token_budget(template) // 2 - 1, counter)
+                    for summary in level
+                ]
+                groups = group_documents_by_tokens(
+                    level, token_budget(template), counter
+                )
+
+            depth += 1
+            logger.info(f"map-reduce level {depth}: summarizing {len(groups)} groups")
+            summaries = executor.map(
+                propagate_metrics(partial(_run_summarization_chain, template, llm=llm)),
+                groups,
+            )
+            level = [Document(page_content=summary) for summary in summaries]
+            template = combine_summary_template
+
+    return _run_summarization_chain(reduce_summary_template, level, callbacks, llm)
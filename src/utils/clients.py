@@ -0,0 +1,240 @@
+"""Registry of the Twitter and Reddit clients of every set of credentials."""
+from __future__ import annotations
+
+import hashlib
+import itertools
+import os
+import threading
+from contextlib import contextmanager
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.utils.config import CLIENT_POOL_SIZE
+from src.utils.metrics import instrument_session
+from src.utils.rate_limit import throttle_on_rate_limit
+
+if TYPE_CHECKING:
+    import tweepy
+    from tweepy import OAuth2BearerHandler, OAuthHandler
+
+
+class KeepAliveSession(requests.Session):
+    """A session whose connections outlive `close`.
+
+    `tweepy.API` closes its session after every request, which drops the
+    pooled connections and pays a new TLS handshake per call. The pool is
+    only released by `shutdown`.
+    """
+
+    def close(self):
+        pass
+
+    def shutdown(self):
+        super().close()
+
+
+class ClientPool(object):
+    """Clients used by one thread at a time, built by `build` when all are busy.
+
+    With a `size`, at most that many clients are built and `checkout`
+    waits for one of them to be returned.
+    """
+
+    def __init__(self, build: Callable[[], Any], size: Optional[int] = None):
+        self._build = build
+        self._idle: List[Any] = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size) if size else None
+
+    @contextmanager
+    def checkout(self) -> Iterator[Any]:
+        if self._slots is not None:
+            self._slots.acquire()
+        try:
+            with self._lock:
+                client = self._idle.pop() if self._idle else None
+            if client is None:
+                client = self._build()
+            try:
+                yield client
+            finally:
+                with self._lock:
+                    self._idle.append(client)
+        finally:
+            if self._slots is not None:
+                self._slots.release()
+
+
+class ClientRegistry(object):
+    """Hands out the clients and pooled, keep-alive sessions of credentials.
+
+    Every search and loader path asks the registry for its client, so the
+    connections are reused across calls and threads. A Twitter client is
+    shared by the threads. PRAW objects aren't thread-safe, so Reddit
+    clients are checked out of a pool of at most `pool_size` instead, each
+    with its own session.
+    Rate limits are accounted per endpoint by `src.utils.rate_limit`,
+    whatever the client.
+    """
+
+    def __init__(self, pool_size: int = CLIENT_POOL_SIZE):
+        self.pool_size = pool_size
+        self._sessions: Dict[Tuple[str, str, int], KeepAliveSession] = {}
+        self._clients: Dict[Tuple[str, str], Any] = {}
+        self._lock = threading.Lock()
+
+    def session(
+        self,
+        platform: str,
+        credentials: Tuple[Any, ...],
+        index: int = 0,
+    ) -> requests.Session:
+        """The `index`-th session of the credentials."""
+        key = (platform, _fingerprint(credentials), index)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = KeepAliveSession()
+                adapter = HTTPAdapter(
+                    pool_connections=self.pool_size,
+                    pool_maxsize=self.pool_size,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                instrument_session(session, platform)
+                throttle_on_rate_limit(session, _ENDPOINTS_OF[platform])
+                self._sessions[key] = session
+            return session
+
+    def _client(self, platform: str, credentials: Tuple[Any, ...], build):
+        key = (platform, _fingerprint(credentials))
+        with self._lock:
+            client = self._clients.get(key)
+        if client is not None:
+            return client
+
+        client = build(self.session(platform, credentials))
+        with self._lock:
+            # another thread may have built it meanwhile
+            return self._clients.setdefault(key, client)
+
+    def twitter(
+        self,
+        auth: Optional[Union[OAuthHandler, OAuth2BearerHandler]] = None,
+    ) -> tweepy.API:
+        """The API client of `auth`, the bearer token of the environment by default."""
+        import tweepy
+
+        if auth is None:
+            auth = tweepy.OAuth2BearerHandler(os.environ.get("TWITTER_BEARER_TOKEN"))
+
+        def build(session):
+            # a 429 is waited out by tweepy instead of raised to the loader
+            api = tweepy.API(
+                auth,
+                parser=tweepy.parsers.JSONParser(),
+                wait_on_rate_limit=True,
+            )
+            api.session = session
+            return api
+
+        return self._client("twitter", _twitter_credentials(auth), build)
+
+    def reddit_pool(
+        self,
+        client_id: Optional[str] = None,
+        client_secret: Optional[str] = None,
+        user_agent: Optional[str] = None,
+    ) -> ClientPool:
+        """The Reddit clients of the credentials, those of the environment by default."""
+        import praw
+
+        client_id = client_id or os.environ.get("REDDIT_API_CLIENT_ID")
+        client_secret = client_secret or os.environ.get("REDDIT_API_SECRET")
+        user_agent = user_agent or os.environ.get("REDDIT_USER_AGENT")
+        credentials = (client_id, client_secret, user_agent)
+        indexes = itertools.count()
+
+        def build_reddit() -> praw.Reddit:
+            return praw.Reddit(
+                client_id=client_id,
+                client_secret=client_secret,
+                user_agent=user_agent,
+                requestor_kwargs={
+                    "session": self.session("reddit", credentials, next(indexes))
+                },
+            )
+
+        with self._lock:
+            return self._clients.setdefault(
+                ("reddit", _fingerprint(credentials)),
+                ClientPool(build_reddit, size=self.pool_size),
+            )
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.shutdown()
+            self._sessions.clear()
+            self._clients.clear()
+
+
+def _fingerprint(credentials: Tuple[Any, ...]) -> str:
+    # secrets are not kept in the registry keys
+    return hashlib.sha256(repr(credentials).encode("utf-8")).hexdigest()
+
+
+def _twitter_credentials(auth) -> Tuple[Any, ...]:
+    bearer_token = getattr(auth, "bearer_token", None)
+    if bearer_token is not None:
+        return ("bearer", bearer_token)
+    return (
+        "oauth1",
+        getattr(auth, "consumer_key", None),
+        getattr(auth, "consumer_secret", None),
+        getattr(auth, "access_token", None),
+        getattr(auth, "access_token_secret", None),
+    )
+
+
+# endpoints of RATE_LIMITS by path of the Twitter API v1.1
+_TWITTER_ENDPOINTS = {
+    "/statuses/user_timeline.json": "twitter.user_timeline",
+    "/search/tweets.json": "twitter.search_tweets",
+    "/users/search.json": "twitter.search_users",
+}
+
+
+def _twitter_endpoint(url: str) -> Optional[str]:
+    path = urlsplit(url).path
+    for suffix, endpoint in _TWITTER_ENDPOINTS.items():
+        if path.endswith(suffix):
+            return endpoint
+    return None
+
+
+_ENDPOINTS_OF = {
+    "twitter": _twitter_endpoint,
+    # one quota for the whole Reddit API
+    "reddit": lambda url: "reddit",
+}
+
+_registry = ClientRegistry()
+
+
+def get_clients() -> ClientRegistry:
+    """Return the process-wide client registry."""
+    return _registry
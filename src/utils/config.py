@@ -5,3 +5,122 @@ SEARCH_FILTERS = [
 ]
 
 BLACKLIST = ["bot", "bots"]
+
+# named Chroma collections, one directory each
+INDEX_DIRECTORY = "db"
+# "topic" reuses the collection of the same search, "session" gives every
+# session a collection of its own
+INDEX_COLLECTION_KEY = "topic"
+# collections not opened for this many seconds are deleted by `src.indexes expire`
+INDEX_TTL = 7 * 24 * 60 * 60
+
+EMBEDDING_CACHE_PATH = "cache/embeddings.sqlite"
+EMBEDDING_CACHE_MAX_ENTRIES = 200_000
+
+# "openai", or "hashing" to embed locally without any network round trip
+EMBEDDING_BACKEND = "openai"
+# dimension and word n-gram range of the hashing backend
+HASHING_EMBEDDING_DIM = 1024
+HASHING_NGRAM_RANGE = (1, 2)
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+EMBEDDING_CONTEXT_LENGTH = 8191
+EMBEDDING_BATCH_TOKENS = 50_000
+EMBEDDING_BATCH_SIZE = 512
+EMBEDDING_MAX_WORKERS = 4
+EMBEDDING_MAX_RETRIES = 6
+
+# (requests, period in seconds, burst) per API endpoint
+RATE_LIMITS = {
+    # Reddit allows 1000 requests per 10 minutes window for OAuth clients
+    "reddit": (1000, 600, 100),
+    # app-only (bearer token) quota of statuses/user_timeline
+    "twitter.user_timeline": (1500, 900, 50),
+    "twitter.search_tweets": (450, 900, 20),
+    "twitter.search_users": (900, 900, 20),
+}
+# buckets are shared by the processes through files in this directory,
+# an empty path keeps them per process
+RATE_LIMIT_STATE_DIRECTORY = "cache/rate_limits"
+# share of the burst that bulk fetches leave to interactive searches
+RATE_LIMIT_INTERACTIVE_RESERVE = 0.2
+
+# API responses reused by later runs, an empty path disables the cache
+RESPONSE_CACHE_PATH = "cache/responses.sqlite"
+RESPONSE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# seconds a response is reused per endpoint, endpoints not listed are not cached
+RESPONSE_CACHE_TTLS = {
+    "twitter.user_timeline": 15 * 60,
+    "twitter.search_tweets": 15 * 60,
+    "reddit.listing": 30 * 60,
+    # comment threads of older submissions barely change
+    "reddit.comments": 2 * 60 * 60,
+}
+
+REDDIT_MAX_WORKERS = 8
+TWITTER_MAX_WORKERS = 8
+# keep-alive connections per API client, enough for all the fetch workers
+CLIENT_POOL_SIZE = 16
+
+# maximum page sizes allowed by the APIs
+TWITTER_SEARCH_PAGE_SIZE = 100
+TWITTER_TIMELINE_PAGE_SIZE = 200
+REDDIT_PAGE_SIZE = 100
+
+# bounded queues between the fetch, dedup, split, embed and index stages
+PIPELINE_QUEUE_SIZE = [512, 512, 512, 4]
+PIPELINE_EMBED_BATCH_SIZE = 256
+
+# estimated Jaccard similarity of word shingles above which posts are duplicates,
+# replacing one word in the middle of a 15 words tweet keeps 12 of its 16
+# distinct 2-word shingles (0.75), of a 8 words one 5 of 9 (~0.56). Short posts
+# sharing most of their words are often distinct, so edits of posts under ~15
+# words are kept, exact copies and crossposts are collapsed whatever their length
+DEDUP_THRESHOLD = 0.7
+DEDUP_NUM_PERM = 128
+# 32 bands of 4 rows, pairs are compared with a ~87% probability at 0.5,
+# >98% from 0.6 and >99.9% from 0.7
+DEDUP_LSH_BANDS = 32
+DEDUP_SHINGLE_SIZE = 2
+
+LLM_MODEL = "gpt-3.5-turbo"
+MAX_CONTEXT_TOKENS = 4097
+
+# chunks are measured in tokens of LLM_MODEL, long Reddit threads are split
+# into several chunks that can be packed into a prompt
+CHUNK_TOKENS = 400
+CHUNK_OVERLAP_TOKENS = 40
+# chunks fetched from the index before packing the best ones into the prompt
+RETRIEVAL_CANDIDATES = 20
+
+# tokens left for the completion when packing documents into a prompt
+COMPLETION_RESERVED_TOKENS = 1000
+SUMMARY_MAX_WORKERS = 8
+
+# cosine similarity above which a question reuses a cached answer
+ANSWER_CACHE_THRESHOLD = 0.95
+ANSWER_CACHE_MAX_ENTRIES = 256
+
+HISTORY_PATH = "outputs/history.jsonl"
+HISTORY_MAX_BYTES = 10 * 1024 * 1024
+HISTORY_BACKUP_COUNT = 5
+# ids of the sources remembered as already in the log, least recently
+# referenced ones are forgotten and written again when referenced
+HISTORY_MAX_SOURCES = 10_000
+
+# Prometheus text file of the metrics, for the node exporter textfile collector
+METRICS_TEXTFILE_PATH = "outputs/metrics.prom"
+METRICS_PREFIX = "media_agent"
+
+# headless runs of `src.batch`, one summary per topic in this directory
+BATCH_OUTPUT_DIRECTORY = "outputs/batch"
+BATCH_MAX_WORKERS = 4
+BATCH_NUMBER_OF_POSTS = 100
+
+# `src.server`, sessions are evicted least recently used first
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8000
+SERVER_MAX_SESSIONS = 32
+# threads running the fetches, indexing and chains of all the sessions
+SERVER_MAX_WORKERS = 16
+SERVER_MAX_BODY_BYTES = 1024 * 1024
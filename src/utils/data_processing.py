@@ -1,3 +1,8 @@
+from itertools import islice
+
+from src.utils.metrics import get_metrics
+
+
 def get_document_text(doc):
     document_text = doc.page_content
     return document_text
@@ -11,3 +16,32 @@ def get_metadatas_from_documents(documents):
 def get_texts_from_documents(documents):
     texts = [get_document_text(document) for document in documents]
     return texts
+
+
+def batched(iterable, size):
+    """Split an iterable into lists of `size` items, lazily."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def split_documents(text_splitter, documents):
+    """Split documents one by one and tag each chunk with its ordinal.
+
+    Chunks also carry the number of chunks of their document, the ones left
+    above it by an earlier, longer version of the post are deleted on upsert.
+    """
+    metrics = get_metrics()
+    chunks = []
+    with metrics.timer("split_seconds"):
+        for document in documents:
+            document_chunks = text_splitter.split_documents([document])
+            for ordinal, chunk in enumerate(document_chunks):
+                chunk.metadata["chunk"] = ordinal
+                chunk.metadata["num_chunks"] = len(document_chunks)
+                chunks.append(chunk)
+    metrics.increment("chunks_total", len(chunks))
+    return chunks
@@ -0,0 +1,173 @@
+"""Collapse exact and near-duplicate posts before they are split and embedded."""
+import hashlib
+import re
+import zlib
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+from langchain.docstore.document import Document
+
+from src.utils.config import (
+    DEDUP_LSH_BANDS,
+    DEDUP_NUM_PERM,
+    DEDUP_SHINGLE_SIZE,
+    DEDUP_THRESHOLD,
+)
+from src.utils.metrics import get_metrics
+
+DUPLICATE_SOURCES_KEY = "duplicate_sources"
+NUM_DUPLICATES_KEY = "num_duplicates"
+
+# smallest prime above 2**32, (a * x + b) of 32-bit values fits in 64 bits
+_PRIME = np.uint64(4_294_967_311)
+_URL = re.compile(r"https?://\S+")
+_RETWEET_PREFIX = re.compile(r"^rt @\w+:\s*")
+_WORD = re.compile(r"\w+")
+
+
+def _tokens(text: str) -> List[str]:
+    text = _RETWEET_PREFIX.sub("", text.lower())
+    return _WORD.findall(_URL.sub(" ", text))
+
+
+class NearDuplicateFilter(object):
+    """MinHash signatures of word shingles, looked up in an LSH index.
+
+    Documents are compared with the ones kept so far: a document with the
+    same normalized text or URL, or whose estimated Jaccard similarity
+    with a kept one is above `threshold`, is dropped. Its source is added
+    to the `duplicate_sources` metadata of the kept document, as a comma
+    separated string since Chroma metadata values are scalars.
+
+    Signatures are split into `bands`, documents sharing a band are the
+    only candidates compared, so the cost per document does not grow with
+    the corpus.
+    """
+
+    def __init__(
+        self,
+        threshold: float = DEDUP_THRESHOLD,
+        num_perm: int = DEDUP_NUM_PERM,
+        bands: int = DEDUP_LSH_BANDS,
+        shingle_size: int = DEDUP_SHINGLE_SIZE,
+        seed: int = 1,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm should be a multiple of bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 2**32, size=(num_perm, 1), dtype=np.uint64)
+        self._b = rng.randint(0, 2**32, size=(num_perm, 1), dtype=np.uint64)
+        # hash the rows of every band into one integer, distinct across bands
+        self._band_weights = rng.randint(1, 2**32, size=self.rows, dtype=np.uint64)
+        self._band_offsets = rng.randint(0, 2**32, size=bands, dtype=np.uint64)
+
+        self._kept: List[Document] = []
+        self._signatures: List[np.ndarray] = []
+        self._exact: Dict[str, int] = {}
+        self._buckets: Dict[int, List[int]] = defaultdict(list)
+        self.stats = dict(documents=0, exact_duplicates=0, near_duplicates=0)
+
+    def signature(self, tokens: List[str]) -> Optional[np.ndarray]:
+        if not tokens:
+            return None
+        size = min(self.shingle_size, len(tokens))
+        shingles = {
+            " ".join(tokens[i : i + size]) for i in range(len(tokens) - size + 1)
+        }
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+            dtype=np.uint64,
+            count=len(shingles),
+        )
+        return ((self._a * hashes + self._b) % _PRIME).min(axis=1)
+
+    def _exact_keys(self, document: Document, tokens: List[str]) -> List[str]:
+        text = " ".join(tokens)
+        keys = [hashlib.sha256(text.encode("utf-8")).hexdigest()]
+        # crossposts of a link share its URL
+        url = document.metadata.get("url")
+        if url:
+            keys.append(f"url:{url}")
+        return keys
+
+    def _band_keys(self, signature: np.ndarray) -> List[int]:
+        bands = signature.reshape(self.bands, self.rows)
+        return ((bands * self._band_weights).sum(axis=1) ^ self._band_offsets).tolist()
+
+    def _find_near_duplicate(self, signature: np.ndarray, band_keys) -> Optional[int]:
+        candidates = {
+            index for key in band_keys for index in self._buckets.get(key, ())
+        }
+        best, best_similarity = None, self.threshold
+        for index in candidates:
+            similarity = np.mean(self._signatures[index] == signature)
+            if similarity >= best_similarity:
+                best, best_similarity = index, similarity
+        return best
+
+    def _merge(self, index: int, duplicate: Document):
+        metadata = self._kept[index].metadata
+        source = duplicate.metadata.get("source")
+        if source is not None:
+            sources = metadata.get(DUPLICATE_SOURCES_KEY)
+            metadata[DUPLICATE_SOURCES_KEY] = (
+                f"{sources},{source}" if sources else str(source)
+            )
+        metadata[NUM_DUPLICATES_KEY] = metadata.get(NUM_DUPLICATES_KEY, 0) + 1
+
+    def add(self, document: Document) -> bool:
+        """Whether `document` is kept, i.e. is not a duplicate of a kept one."""
+        self.stats["documents"] += 1
+
+        tokens = _tokens(document.page_content)
+        exact_keys = self._exact_keys(document, tokens)
+        for key in exact_keys:
+            if key in self._exact:
+                self._merge(self._exact[key], document)
+                self.stats["exact_duplicates"] += 1
+                get_metrics().increment("duplicates_total", kind="exact")
+                return False
+
+        signature = self.signature(tokens)
+        band_keys = self._band_keys(signature) if signature is not None else []
+        if signature is not None:
+            index = self._find_near_duplicate(signature, band_keys)
+            if index is not None:
+                self._merge(index, document)
+                self.stats["near_duplicates"] += 1
+                get_metrics().increment("duplicates_total", kind="near")
+                return False
+
+        index = len(self._kept)
+        self._kept.append(document)
+        self._signatures.append(signature)
+        for key in exact_keys:
+            self._exact[key] = index
+        for key in band_keys:
+            self._buckets[key].append(index)
+        return True
+
+    def filter(self, documents: Iterable[Document]) -> Iterator[Document]:
+        """Yield the documents that are not duplicates, lazily."""
+        for document in documents:
+            if self.add(document):
+                yield document
+
+
+def deduplicate_documents(
+    documents: Iterable[Document],
+    stats: Optional[Dict[str, int]] = None,
+) -> List[Document]:
+    """Drop exact and near duplicates, merging their sources into the kept ones."""
+    duplicate_filter = NearDuplicateFilter()
+    kept = list(duplicate_filter.filter(documents))
+    if stats is not None:
+        stats.update(duplicate_filter.stats)
+    return kept
@@ -1,3 +1,4 @@
+from datetime import datetime
 from rich.console import Console
 from rich.prompt import Prompt
 from simple_term_menu import TerminalMenu
@@ -49,29 +50,17 @@ Let's start :rocket:
     )
 
 
-def display_bot_answer(result, collection, history, user_input):
-    console.print("Answer :", style="red bold underline")
-    console.print(result["answer"], style="yellow")
-
-    sources = result["sources"]
-
-    sources = sources.split(",")
-    sources = [source.strip() for source in sources]
-
-    if len(sources) == 1:
-        output = collection.get(
-            where={"source": sources[0]},
-            include=["metadatas", "documents"],
-        )
-    else:
-        output = collection.get(
-            where={"$or": [{"source": {"$eq": source}} for source in sources]},
-            include=["metadatas", "documents"],
-        )
+def display_bot_answer(
+    result,
+    documents,
+    metadatas,
+    print_answer=True,
+):
+    if print_answer:
+        console.print("Answer :", style="red bold underline")
+        console.print(result["answer"], style="yellow")
 
     console.print("These are sources I used to create my answer:")
-    metadatas = output["metadatas"]
-    documents = output["documents"]
 
     if len(metadatas) == 0 or len(documents) == 0:
         console.print(
@@ -87,17 +76,6 @@ def display_bot_answer(result, collection, history, user_input):
             console.print(metadata)
             console.print(f"\n {'-'*50} \n")
 
-    history["history"].append(
-        {
-            "question": user_input,
-            "answer": result,
-            "sources": [
-                {"document": document, "metadata": metadata}
-                for document, metadata in zip(documents, metadatas)
-            ],
-        }
-    )
-
 
 def select_topic() -> str:
     topic = Prompt.ask(
@@ -223,6 +201,17 @@ def select_number_of_posts():
     return number_of_tweets
 
 
+def select_reopen_index(manifest) -> bool:
+    fetched_at = datetime.fromtimestamp(manifest["fetched_at"])
+    answer = Prompt.ask(
+        f"This search was indexed on {fetched_at:%Y-%m-%d %H:%M} "
+        f"({manifest['num_chunks']} chunks), reopen it instead of fetching the posts again?",
+        choices=["yes", "no"],
+        default="yes",
+    )
+    return answer == "yes"
+
+
 def display_summary_and_questions(summary, q1, q2, q3):
     console.print("Summary 📝 \n", style="red bold underline")
     console.print(summary + "\n ")
@@ -2,22 +2,38 @@
 from __future__ import annotations
 import os
 from abc import ABC, abstractmethod
-from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Sequence, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Union,
+)
 
-from praw import Reddit
-from praw.models import Submission, MoreComments
 from rich.console import Console
 from contextlib import nullcontext
 
 from langchain.docstore.document import Document
 
+from src.utils.config import REDDIT_MAX_WORKERS, REDDIT_PAGE_SIZE, TWITTER_MAX_WORKERS
+from src.utils.clients import ClientPool, get_clients
+from src.utils.metrics import get_metrics, propagate_metrics
+from src.utils.rate_limit import get_rate_limiter
+from src.utils.response_cache import cached_fetch
 from src.utils.search import (
-    search_tweets_by_keywords,
-    search_tweets_by_usernames,
+    iter_tweets_by_keywords,
+    iter_tweets_by_usernames,
 )
 
 if TYPE_CHECKING:
+    import praw
     import tweepy
+    from praw.models import Submission
     from tweepy import OAuth2BearerHandler, OAuthHandler
 
 
@@ -31,6 +47,29 @@ def _dependable_tweepy_import() -> tweepy:
     return tweepy
 
 
+def _dependable_praw_import() -> praw:
+    try:
+        import praw
+    except ImportError:
+        raise ValueError(
+            "praw package not found, please install it with `pip install praw`"
+        )
+    return praw
+
+
+def _submission_to_dict(sub: Submission) -> Dict[str, Any]:
+    # PRAW models fetch lazily, only plain values are cached
+    return dict(
+        id=sub.id,
+        fullname=sub.fullname,
+        title=sub.title,
+        selftext=sub.selftext,
+        url=sub.url,
+        created_utc=sub.created_utc,
+        subreddit=sub.subreddit.display_name,
+    )
+
+
 class DocumentLoader(ABC):
     @property
     @abstractmethod
@@ -38,13 +77,26 @@ class DocumentLoader(ABC):
         pass
 
     @abstractmethod
-    def _load(self) -> List[Document]:
+    def lazy_load(self) -> Iterator[Document]:
+        """Yield documents page by page, as they are fetched."""
         pass
 
+    def _load(self) -> List[Document]:
+        return list(self.lazy_load())
+
     @abstractmethod
     def _get_search_params(self) -> Dict[str, Any]:
         pass
 
+    @property
+    def cursor(self) -> Dict[str, Any]:
+        """Paging params of the posts newer than the loaded ones, kept with the index."""
+        return {}
+
+    def resume(self, cursor: Dict[str, Any]):
+        """Only load the posts newer than the ones of an earlier load."""
+        pass
+
     def load(
         self,
         console: Optional[Console] = None,
@@ -53,7 +105,7 @@ class DocumentLoader(ABC):
         """Load documents."""
 
         context = (
-            nullcontext
+            nullcontext()
             if console is None
             else console.status(
                 "Loading Documents",
@@ -66,7 +118,7 @@ class DocumentLoader(ABC):
         with context:
             documents = self._load()
 
-        if history:
+        if history is not None:
             history["search_params"] = self._get_search_params()
             history["num_documents"] = len(documents)
             history["source"] = self.source
@@ -90,11 +142,19 @@ class TwitterTweetLoader(DocumentLoader):
         twitter_users: Union[Sequence[str], None],
         keywords: Union[str, None],
         number_tweets: int,
+        max_workers: int = TWITTER_MAX_WORKERS,
+        since_id: Optional[int] = None,
+        api: Optional[tweepy.API] = None,
     ):
         self.auth = auth_handler
+        # built from `auth_handler` when not given
+        self.api = api
         self.twitter_users = twitter_users
         self.number_tweets = number_tweets
         self.keywords = keywords
+        self.max_workers = max_workers
+        self.since_id = since_id
+        self.newest_id = since_id
 
         if self.keywords is None and self.twitter_users is None:
             raise ValueError("You should set keywords or twitter_users, not both.")
@@ -107,28 +167,51 @@ class TwitterTweetLoader(DocumentLoader):
     def source(self) -> str:
         return "twitter"
 
-    def _load(self):
-        """Load tweets."""
-        tweepy = _dependable_tweepy_import()
-        api = tweepy.API(self.auth, parser=tweepy.parsers.JSONParser())
-
-        results: List[Document] = []
+    def lazy_load(self) -> Iterator[Document]:
+        """Load tweets, one page (or one account) at a time."""
+        api = self.api
+        if api is None:
+            _dependable_tweepy_import()
+            api = get_clients().twitter(self.auth)
 
         if self.search_mode == "twitter_users":
-            tweets = search_tweets_by_usernames(
-                api,
-                self.twitter_users,
-                self.number_tweets,
+            pages = (
+                tweets
+                for _, tweets in iter_tweets_by_usernames(
+                    api,
+                    self.twitter_users,
+                    self.number_tweets,
+                    max_workers=self.max_workers,
+                    since_id=self.since_id,
+                )
             )
         elif self.search_mode == "keywords":
-            tweets = search_tweets_by_keywords(
+            pages = iter_tweets_by_keywords(
                 api,
                 self.keywords,
                 self.number_tweets,
+                since_id=self.since_id,
             )
 
-        results = self._format_tweets(tweets)
-        return results
+        for tweets in pages:
+            if tweets:
+                # cursor to only fetch newer tweets on the next run
+                self.newest_id = max(
+                    [tweet["id"] for tweet in tweets] + [self.newest_id or 0]
+                )
+            get_metrics().increment(
+                "documents_fetched_total", len(tweets), source=self.source
+            )
+            yield from self._format_tweets(tweets)
+
+    @property
+    def cursor(self) -> Dict[str, Any]:
+        return {"since_id": self.newest_id} if self.newest_id is not None else {}
+
+    def resume(self, cursor: Dict[str, Any]):
+        # an explicit `since_id` wins over the one of the index
+        if self.since_id is None and cursor.get("since_id") is not None:
+            self.since_id = self.newest_id = cursor["since_id"]
 
     def _get_search_params(self) -> Dict[str, Any]:
         ret = dict(
@@ -141,6 +224,9 @@ class TwitterTweetLoader(DocumentLoader):
         else:
             ret["keywords"] = self.keywords
 
+        if self.since_id is not None:
+            ret["since_id"] = self.since_id
+
         return ret
 
     def _format_tweets(self, tweets: List[Dict[str, Any]]):
@@ -211,16 +297,26 @@ class RedditSubLoader(DocumentLoader):
         number_submissions: int,
         subreddits: Optional[List[str]] = None,
         keywords: Optional[List[str]] = None,
+        max_workers: int = REDDIT_MAX_WORKERS,
+        after: Optional[str] = None,
+        reddit: Optional[praw.Reddit] = None,
+        reddit_pool: Optional[ClientPool] = None,
     ):
-        self.reddit = Reddit(
-            client_id=os.environ.get("REDDIT_API_CLIENT_ID"),
-            client_secret=os.environ.get("REDDIT_API_SECRET"),
-            user_agent=os.environ.get("REDDIT_USER_AGENT"),
-        )
+        if reddit_pool is None and reddit is not None:
+            # a single client is only used by one thread at a time
+            reddit_pool = ClientPool(lambda: reddit, size=1)
+        if reddit_pool is None:
+            _dependable_praw_import()
+            reddit_pool = get_clients().reddit_pool()
+        self.reddit_pool = reddit_pool
 
         self.subreddits = subreddits
         self.keywords = keywords
         self.number_submissions = number_submissions
+        self.max_workers = max_workers
+        # the listing starts after it, and the next load can resume from `last_after`
+        self.after = after
+        self.last_after = after
 
         if self.keywords is None and self.subreddits is None:
             raise ValueError("You should at least one of keywords or subreddits")
@@ -233,55 +329,110 @@ class RedditSubLoader(DocumentLoader):
     def source(self) -> str:
         return "reddit"
 
-    def _load(self) -> List[Document]:
-        """Load submissions."""
+    def lazy_load(self) -> Iterator[Document]:
+        """Load submissions, one listing page at a time."""
+        remaining = self.number_submissions
+        self.last_after = self.after
 
-        if self.search_mode == "subreddits":
-            submissions = self._search_subreddits()
-        elif self.search_mode == "keywords":
-            submissions = self._search_keywords()
+        while remaining > 0:
+            page = self._fetch_listing_page(min(REDDIT_PAGE_SIZE, remaining))
+            if not page:
+                break
 
-        documents = self._format_submissions(submissions)
-        return documents
+            get_metrics().increment(
+                "documents_fetched_total", len(page), source=self.source
+            )
+            yield from self._format_submissions(page)
+            # listing cursor to resume after the last yielded submission
+            self.last_after = page[-1]["fullname"]
+            remaining -= len(page)
+
+    def _fetch_listing_page(self, limit: int) -> List[Dict[str, Any]]:
+        """Fetch one page of the listing after `self.last_after`, as plain dicts."""
+        params = dict(
+            search_mode=self.search_mode,
+            subreddits=sorted(self.subreddits) if self.subreddits else None,
+            keywords=self.keywords,
+            limit=limit,
+            after=self.last_after,
+        )
 
-    def _format_submissions(self, submissions: List[Submission]) -> List[Document]:
-        N_LIMIT_COMMENTS = 10
+        def fetch():
+            get_rate_limiter("reddit").acquire()
+            with self.reddit_pool.checkout() as reddit:
+                if self.search_mode == "subreddits":
+                    submissions = self._search_subreddits(reddit, limit)
+                else:
+                    submissions = self._search_keywords(reddit, limit)
+                return [_submission_to_dict(sub) for sub in submissions]
 
-        ret = []
+        return cached_fetch("reddit.listing", params, fetch)
+
+    def _fetch_comments(self, sub: Dict[str, Any]) -> List[str]:
+        """Fetch the top-level comments of a submission, one request each."""
+
+        def fetch():
+            from praw.models import MoreComments
 
-        for sub in submissions:
+            N_LIMIT_COMMENTS = 10
+
+            get_rate_limiter("reddit").acquire()
             comments = []
 
-            for top_level_comment in sub.comments:
-                if isinstance(top_level_comment, MoreComments):
-                    continue
-                comments.append(top_level_comment.body)
-                if len(comments) > N_LIMIT_COMMENTS:
-                    break
-
-            doc = Document(
-                page_content=" ".join([sub.title, sub.selftext, *comments]),
-                metadata=dict(
-                    title=sub.title,
-                    subreddit=sub.subreddit.display_name,
-                    id=sub.id,
-                    source=sub.url,
-                    url=sub.url,
-                    created_utc=sub.created_utc,
-                ),
+            with self.reddit_pool.checkout() as reddit:
+                for top_level_comment in reddit.submission(id=sub["id"]).comments:
+                    if isinstance(top_level_comment, MoreComments):
+                        continue
+                    comments.append(top_level_comment.body)
+                    if len(comments) > N_LIMIT_COMMENTS:
+                        break
+
+            return comments
+
+        return cached_fetch("reddit.comments", dict(id=sub["id"]), fetch)
+
+    def _format_submissions(self, submissions: List[Dict[str, Any]]) -> List[Document]:
+        ret = []
+
+        # comment forests are fetched concurrently, `map` keeps submissions order
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            all_comments = executor.map(
+                propagate_metrics(self._fetch_comments), submissions
             )
 
-            ret.append(doc)
+            for sub, comments in zip(submissions, all_comments):
+                doc = Document(
+                    page_content=" ".join([sub["title"], sub["selftext"], *comments]),
+                    metadata=dict(
+                        title=sub["title"],
+                        subreddit=sub["subreddit"],
+                        id=sub["id"],
+                        source=sub["url"],
+                        url=sub["url"],
+                        created_utc=sub["created_utc"],
+                    ),
+                )
+
+                ret.append(doc)
 
         return ret
 
-    def _search_subreddits(self) -> List[Submission]:
-        subreddit = self.reddit.subreddit("+".join(self.subreddits))
-        return list(subreddit.top(limit=self.number_submissions))
-
-    def _search_keywords(self) -> List[Submission]:
-        subreddit = self.reddit.subreddit("all")
-        return list(subreddit.search(self.keywords, limit=self.number_submissions))
+    def _listing_params(self) -> Dict[str, str]:
+        return {"after": self.last_after} if self.last_after is not None else {}
+
+    def _search_subreddits(
+        self, reddit: praw.Reddit, limit: int
+    ) -> Iterator[Submission]:
+        subreddit = reddit.subreddit("+".join(self.subreddits))
+        return subreddit.top(limit=limit, params=self._listing_params())
+
+    def _search_keywords(self, reddit: praw.Reddit, limit: int) -> Iterator[Submission]:
+        subreddit = reddit.subreddit("all")
+        return subreddit.search(
+            self.keywords,
+            limit=limit,
+            params=self._listing_params(),
+        )
 
     def _get_search_params(self) -> Dict[str, Any]:
         ret = dict(
@@ -294,4 +445,30 @@ class RedditSubLoader(DocumentLoader):
         else:
             ret["keywords"] = self.keywords
 
+        if self.after is not None:
+            ret["after"] = self.after
+
         return ret
+
+
+def get_loader(
+    platform: str,
+    keywords: Optional[str],
+    accounts: Optional[List[str]],
+    number_of_posts: int,
+) -> DocumentLoader:
+    """The loader of a platform, with the credentials of the environment."""
+    if platform == "reddit":
+        return RedditSubLoader(
+            number_submissions=number_of_posts,
+            keywords=keywords,
+            subreddits=accounts,
+        )
+    elif platform == "twitter":
+        return TwitterTweetLoader.from_bearer_token(
+            oauth2_bearer_token=os.environ.get("TWITTER_BEARER_TOKEN"),
+            number_tweets=number_of_posts,
+            twitter_users=accounts,
+            keywords=keywords,
+        )
+    raise ValueError(f"Platform {platform} not supported")
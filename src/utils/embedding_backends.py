@@ -0,0 +1,123 @@
+"""Embedding backends selectable by configuration."""
+import re
+import zlib
+from functools import lru_cache
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from src.utils.config import (
+    EMBEDDING_BACKEND,
+    EMBEDDING_BATCH_SIZE,
+    HASHING_EMBEDDING_DIM,
+    HASHING_NGRAM_RANGE,
+)
+from src.utils.metrics import get_metrics
+
+_TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+_HASH_MULTIPLIER = np.uint64(1_000_003)
+_HASH_MASK = np.uint64(0xFFFFFFFF)
+
+
+@lru_cache(maxsize=1_000_000)
+def _hash_token(token: str) -> int:
+    # crc32 is stable across processes, unlike `hash`
+    return zlib.crc32(token.encode("utf-8"))
+
+
+class HashingEmbeddings(Embeddings):
+    """CPU-only embeddings of hashed word n-grams.
+
+    Each n-gram is hashed to one of `dim` buckets with a sign, like
+    scikit-learn's `HashingVectorizer`, and the vectors are L2-normalized.
+    There is no model to download nor API to call, texts are encoded by
+    batches of `batch_size` with NumPy. Similarity is lexical, which is
+    enough to pre-index archives or benchmark the indexing path.
+    """
+
+    def __init__(
+        self,
+        dim: int = HASHING_EMBEDDING_DIM,
+        ngram_range: Tuple[int, int] = HASHING_NGRAM_RANGE,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+    ):
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self.batch_size = batch_size
+        # names the vectors in the embedding cache
+        self.model = f"hashing-{dim}-{ngram_range[0]}-{ngram_range[1]}"
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        lengths = []
+        token_hashes = []
+        for text in texts:
+            tokens = _TOKEN_PATTERN.findall(text.lower())
+            lengths.append(len(tokens))
+            token_hashes.extend(map(_hash_token, tokens))
+
+        token_hashes = np.asarray(token_hashes, dtype=np.uint64)
+        token_rows = np.repeat(np.arange(len(texts)), lengths)
+
+        # n-gram hashes are chained from the token hashes, without building strings
+        rows = []
+        hashes = []
+        low, high = self.ngram_range
+        ngram_hashes = token_hashes
+        for n in range(1, high + 1):
+            if n > 1:
+                ngram_hashes = (
+                    ngram_hashes[:-1] * _HASH_MULTIPLIER ^ token_hashes[n - 1 :]
+                ) & _HASH_MASK
+            if n >= low:
+                # n-grams must not span two texts
+                same_text = token_rows[: len(ngram_hashes)] == token_rows[n - 1 :]
+                rows.append(token_rows[: len(ngram_hashes)][same_text])
+                hashes.append(ngram_hashes[same_text])
+
+        rows = np.concatenate(rows)
+        hashes = np.concatenate(hashes)
+        columns = (hashes % self.dim).astype(np.int64)
+        # the sign halves the bias of colliding features
+        signs = np.where(hashes & 0x80000000, -1.0, 1.0)
+
+        matrix = np.bincount(
+            rows * self.dim + columns,
+            weights=signs,
+            minlength=len(texts) * self.dim,
+        ).reshape(len(texts), self.dim)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return (matrix / np.where(norms == 0, 1.0, norms)).astype(np.float32)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        embeddings = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start : start + self.batch_size]
+            with get_metrics().timer("embedding_request_seconds", model=self.model):
+                embeddings.extend(self._encode_batch(batch).tolist())
+        return embeddings
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode_batch([text])[0].tolist()
+
+
+def _openai_embeddings() -> Embeddings:
+    # imported on demand, the OpenAI backend pulls in openai and tiktoken
+    from src.utils.embedding_engine import BatchedEmbeddings
+
+    return BatchedEmbeddings()
+
+
+EMBEDDING_BACKENDS: Dict[str, Callable[[], Embeddings]] = {
+    "openai": _openai_embeddings,
+    "hashing": HashingEmbeddings,
+}
+
+
+def get_embeddings(backend: str = EMBEDDING_BACKEND) -> Embeddings:
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(
+            f"Embedding backend {backend} not supported, "
+            f"choose one of {', '.join(EMBEDDING_BACKENDS)}"
+        )
+    return EMBEDDING_BACKENDS[backend]()
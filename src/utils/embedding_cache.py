@@ -0,0 +1,192 @@
+"""Persistent, content-addressed cache for embeddings."""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from functools import lru_cache
+from typing import List, Optional
+
+from langchain.embeddings.base import Embeddings
+
+from src import logger
+from src.utils.config import EMBEDDING_CACHE_MAX_ENTRIES, EMBEDDING_CACHE_PATH
+from src.utils.metrics import get_metrics
+
+
+def get_embedding_key(text: str, model: str) -> str:
+    return hashlib.sha256(f"{model}\x00{text}".encode("utf-8")).hexdigest()
+
+
+def _as_stored(vector: List[float]) -> List[float]:
+    """The vector as read back from the cache, which stores 32-bit floats."""
+    return array("f", vector).tolist()
+
+
+class EmbeddingCache(object):
+    """SQLite-backed embedding store with size-bounded LRU eviction.
+
+    Vectors are keyed by a hash of the embedding model name and the text,
+    so the same chunk is never embedded twice by the same model.
+    """
+
+    def __init__(
+        self,
+        path: str = EMBEDDING_CACHE_PATH,
+        max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # shared by the worker processes of a batch run
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_access "
+            "ON embeddings (last_access)"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys: List[str]) -> List[Optional[List[float]]]:
+        found = {}
+        with self._lock:
+            # SQLite caps the number of bound parameters per statement
+            for start in range(0, len(keys), 500):
+                chunk = keys[start : start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    chunk,
+                ).fetchall()
+                found.update(rows)
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self._conn.commit()
+
+        return [
+            array("f", found[key]).tolist() if key in found else None for key in keys
+        ]
+
+    def put_many(self, keys: List[str], vectors: List[List[float]]):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_access) "
+                "VALUES (?, ?, ?)",
+                [
+                    (key, array("f", vector).tobytes(), now)
+                    for key, vector in zip(keys, vectors)
+                ],
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN ("
+                "SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                (overflow,),
+            )
+            logger.info(f"evicted {overflow} embeddings from the cache")
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        return count
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+@lru_cache(maxsize=None)
+def get_embedding_cache(path: str = EMBEDDING_CACHE_PATH) -> EmbeddingCache:
+    """The cache shared by every agent of the process."""
+    return EmbeddingCache(path)
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embedding model and only embeds texts missing from the cache.
+
+    Embedded vectors are rounded to 32-bit floats as the cached ones are, so
+    a text gets the same vector whether it was cached or not.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        cache: Optional[EmbeddingCache] = None,
+        model: Optional[str] = None,
+    ):
+        self.embeddings = embeddings
+        self.cache = cache if cache is not None else get_embedding_cache()
+        self.model = model or getattr(embeddings, "model", type(embeddings).__name__)
+        self.hits = 0
+        self.misses = 0
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [get_embedding_key(text, self.model) for text in texts]
+        vectors = self.cache.get_many(keys)
+
+        # identical texts in the same call are embedded only once
+        missing = {}
+        for i, (key, vector) in enumerate(zip(keys, vectors)):
+            if vector is None:
+                missing.setdefault(key, []).append(i)
+
+        misses = sum(len(indices) for indices in missing.values())
+        self.misses += misses
+        self.hits += len(texts) - misses
+        get_metrics().increment("embedding_cache_misses_total", misses)
+        get_metrics().increment("embedding_cache_hits_total", len(texts) - misses)
+
+        if missing:
+            missing_keys = list(missing)
+            missing_texts = [texts[missing[key][0]] for key in missing_keys]
+            new_vectors = [
+                _as_stored(vector)
+                for vector in self.embeddings.embed_documents(missing_texts)
+            ]
+            self.cache.put_many(missing_keys, new_vectors)
+
+            for key, vector in zip(missing_keys, new_vectors):
+                for i in missing[key]:
+                    vectors[i] = vector
+
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        # questions are embedded by the answer cache and again by the retriever
+        key = get_embedding_key(text, self.model)
+        (vector,) = self.cache.get_many([key])
+        if vector is None:
+            vector = _as_stored(self.embeddings.embed_query(text))
+            self.cache.put_many([key], [vector])
+        return vector
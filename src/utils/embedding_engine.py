@@ -0,0 +1,263 @@
+"""Batched, concurrent and rate-limit aware OpenAI embeddings."""
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import tiktoken
+from langchain.embeddings.base import Embeddings
+
+from src import logger
+from src.utils.config import (
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_BATCH_TOKENS,
+    EMBEDDING_CONTEXT_LENGTH,
+    EMBEDDING_MAX_RETRIES,
+    EMBEDDING_MAX_WORKERS,
+    EMBEDDING_MODEL,
+)
+from src.utils.metrics import get_metrics
+
+Batch = List[List[int]]
+EmbedBatchFn = Callable[[Batch], Tuple[List[List[float]], Dict[str, str]]]
+
+_DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+class EmbeddingError(Exception):
+    pass
+
+
+def parse_reset_duration(value: Optional[str]) -> Optional[float]:
+    """Parse OpenAI reset headers such as `20ms`, `1s` or `6m0s` into seconds."""
+    if not value:
+        return None
+    matches = _DURATION_PATTERN.findall(value)
+    if not matches:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in matches)
+
+
+def make_batches(
+    tokens: List[List[int]],
+    max_batch_tokens: int,
+    max_batch_size: int,
+) -> List[List[int]]:
+    """Group token lists into batches, returned as lists of input indices."""
+    batches = []
+    current = []
+    current_tokens = 0
+
+    for i, item in enumerate(tokens):
+        if current and (
+            current_tokens + len(item) > max_batch_tokens
+            or len(current) >= max_batch_size
+        ):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(i)
+        current_tokens += len(item)
+
+    if current:
+        batches.append(current)
+    return batches
+
+
+def request_openai_embeddings(
+    inputs: Batch,
+    model: str,
+    request_timeout: Optional[float] = None,
+) -> Tuple[List[List[float]], Dict[str, str]]:
+    """Send one embeddings request and return the vectors with the response headers."""
+    from openai.api_requestor import APIRequestor
+
+    requestor = APIRequestor(key=os.environ.get("OPENAI_API_KEY"))
+    response, _, _ = requestor.request(
+        "post",
+        "/embeddings",
+        params={"input": inputs, "model": model},
+        request_timeout=request_timeout,
+    )
+    data = sorted(response.data["data"], key=lambda item: item["index"])
+    return [item["embedding"] for item in data], response._headers
+
+
+class _RateLimitState(object):
+    """Pause shared by all the workers of the runs of an embeddings object."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._resume_at = 0.0
+
+    def wait(self):
+        while True:
+            with self._lock:
+                delay = self._resume_at - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    def update(self, headers: Dict[str, str], next_batch_tokens: int, workers: int):
+        if not headers:
+            return
+
+        remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+        if remaining_tokens is not None and int(remaining_tokens) < next_batch_tokens:
+            delay = parse_reset_duration(headers.get("x-ratelimit-reset-tokens"))
+            if delay:
+                logger.info(f"embedding token budget is low, pausing {delay:.1f}s")
+                self.pause(delay)
+
+        remaining_requests = headers.get("x-ratelimit-remaining-requests")
+        if remaining_requests is not None and int(remaining_requests) < workers:
+            delay = parse_reset_duration(headers.get("x-ratelimit-reset-requests"))
+            if delay:
+                logger.info(f"embedding request budget is low, pausing {delay:.1f}s")
+                self.pause(delay)
+
+
+def _is_retryable(error: Exception) -> bool:
+    try:
+        import openai.error
+    except ImportError:
+        return False
+
+    return isinstance(
+        error,
+        (
+            openai.error.RateLimitError,
+            openai.error.APIError,
+            openai.error.APIConnectionError,
+            openai.error.ServiceUnavailableError,
+            openai.error.Timeout,
+        ),
+    )
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    headers = getattr(error, "headers", None) or {}
+    for header in (
+        "retry-after",
+        "x-ratelimit-reset-requests",
+        "x-ratelimit-reset-tokens",
+    ):
+        delay = parse_reset_duration(headers.get(header))
+        if delay:
+            return delay
+    return min(2**attempt, 60)
+
+
+class BatchedEmbeddings(Embeddings):
+    """OpenAI embeddings sent in token-budgeted batches with bounded concurrency.
+
+    Rate-limit headers of every response are used to pause all the workers,
+    of every concurrent `embed_documents` call, before the quota is
+    exhausted. Failed batches are retried on their own,
+    batches that already succeeded are never sent again.
+    """
+
+    def __init__(
+        self,
+        model: str = EMBEDDING_MODEL,
+        max_batch_tokens: int = EMBEDDING_BATCH_TOKENS,
+        max_batch_size: int = EMBEDDING_BATCH_SIZE,
+        max_workers: int = EMBEDDING_MAX_WORKERS,
+        max_retries: int = EMBEDDING_MAX_RETRIES,
+        embed_batch: Optional[EmbedBatchFn] = None,
+    ):
+        self.model = model
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.embed_batch = embed_batch or (
+            lambda inputs: request_openai_embeddings(inputs, self.model)
+        )
+        self.encoding = tiktoken.encoding_for_model(model)
+        self._rate_limit = _RateLimitState()
+
+    def _tokenize(self, texts: List[str]) -> List[List[int]]:
+        return [
+            self.encoding.encode(text, disallowed_special=())[:EMBEDDING_CONTEXT_LENGTH]
+            for text in texts
+        ]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+
+        tokens = self._tokenize(texts)
+        batches = make_batches(tokens, self.max_batch_tokens, self.max_batch_size)
+        results: Dict[int, List[List[float]]] = {}
+        rate_limit = self._rate_limit
+        metrics = get_metrics()
+
+        def run(batch_index: int):
+            indices = batches[batch_index]
+            inputs = [tokens[i] for i in indices]
+            rate_limit.wait()
+            metrics.increment("embedding_requests_total", model=self.model)
+            metrics.increment(
+                "embedding_tokens_total",
+                sum(len(item) for item in inputs),
+                model=self.model,
+            )
+            with metrics.timer("embedding_request_seconds", model=self.model):
+                vectors, headers = self.embed_batch(inputs)
+            rate_limit.update(headers, self.max_batch_tokens, self.max_workers)
+            results[batch_index] = vectors
+
+        pending = list(range(len(batches)))
+        errors: Dict[int, Exception] = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for attempt in range(self.max_retries + 1):
+                futures = {i: executor.submit(run, i) for i in pending}
+                errors = {}
+                for i, future in futures.items():
+                    error = future.exception()
+                    if error is None:
+                        continue
+                    if not _is_retryable(error):
+                        raise error
+                    errors[i] = error
+
+                if not errors or attempt == self.max_retries:
+                    break
+
+                pending = sorted(errors)
+                metrics.increment(
+                    "embedding_retries_total", len(pending), model=self.model
+                )
+                delay = max(_retry_delay(error, attempt) for error in errors.values())
+                logger.warning(
+                    f"{len(pending)}/{len(batches)} embedding batches failed, "
+                    f"retrying in {delay:.1f}s"
+                )
+                rate_limit.pause(delay)
+
+        if errors:
+            raise EmbeddingError(
+                f"{len(errors)} embedding batches failed after "
+                f"{self.max_retries} retries: {next(iter(errors.values()))}"
+            )
+
+        embeddings: List[List[float]] = [None] * len(texts)
+        for batch_index, indices in enumerate(batches):
+            for i, vector in zip(indices, results[batch_index]):
+                embeddings[i] = vector
+        return embeddings
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
@@ -0,0 +1,178 @@
+"""Append-only JSON lines log of the conversations."""
+import atexit
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from src import logger
+from src.utils.config import (
+    HISTORY_BACKUP_COUNT,
+    HISTORY_MAX_BYTES,
+    HISTORY_MAX_SOURCES,
+    HISTORY_PATH,
+)
+
+_CLOSE = object()
+
+
+def _source_id(document: str, metadata: Dict[str, Any]) -> str:
+    payload = json.dumps([document, metadata], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class HistoryWriter(object):
+    """Appends one compact JSON line per record from a background thread.
+
+    Each source document is written once per file as a `source` record and
+    referenced by id from the `turn` records, the `max_sources` most
+    recently referenced ones are remembered. The file is rotated to
+    `<path>.1`, `<path>.2`, ... when it grows past `max_bytes`. Use
+    `get_history_writer` so that sessions logging to the same file share
+    one writer.
+    """
+
+    def __init__(
+        self,
+        path: str = HISTORY_PATH,
+        max_bytes: int = HISTORY_MAX_BYTES,
+        backup_count: int = HISTORY_BACKUP_COUNT,
+        max_sources: int = HISTORY_MAX_SOURCES,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.max_sources = max_sources
+        self._queue = queue.Queue()
+        self._file = None
+        # ids of the sources in the current file, least recently referenced first
+        self._written_sources: "OrderedDict[str, None]" = OrderedDict()
+        self._thread = threading.Thread(
+            target=self._run,
+            name="history-writer",
+            daemon=True,
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, record_type: str, session_id: str, payload: Dict[str, Any]):
+        self._queue.put(
+            dict(type=record_type, session=session_id, ts=time.time(), **payload)
+        )
+
+    def write_turn(
+        self,
+        session_id: str,
+        question: str,
+        result: Dict[str, Any],
+        documents: List[str],
+        metadatas: List[Dict[str, Any]],
+        metrics: Optional[Dict[str, Any]] = None,
+    ):
+        turn = dict(
+            question=question,
+            answer=result.get("answer"),
+            sources=list(zip(documents, metadatas)),
+        )
+        if metrics is not None:
+            turn["metrics"] = metrics
+        self.write("turn", session_id, turn)
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(_CLOSE)
+            self._thread.join()
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        # every file is self-contained, sources are written again after rotation
+        self._written_sources.clear()
+        self._open()
+
+    def _serialize(self, record: Dict[str, Any]):
+        """Lines of a record, preceded by the sources not yet in the file."""
+        lines = []
+        new_sources = set()
+
+        if record["type"] == "turn":
+            source_ids = []
+            for document, metadata in record["sources"]:
+                source_id = _source_id(document, metadata)
+                if source_id in self._written_sources:
+                    self._written_sources.move_to_end(source_id)
+                elif source_id not in new_sources:
+                    lines.append(
+                        dict(
+                            type="source",
+                            id=source_id,
+                            document=document,
+                            metadata=metadata,
+                        )
+                    )
+                    new_sources.add(source_id)
+                source_ids.append(source_id)
+            record = dict(record, sources=source_ids)
+
+        lines.append(record)
+        lines = [
+            json.dumps(line, separators=(",", ":"), default=str) + "\n"
+            for line in lines
+        ]
+        return lines, new_sources
+
+    def _write_record(self, record: Dict[str, Any]):
+        lines, new_sources = self._serialize(record)
+        size = sum(len(line) for line in lines)
+        if self._file.tell() and self._file.tell() + size > self.max_bytes:
+            # a turn and the sources it references always end up in the same file
+            self._rotate()
+            lines, new_sources = self._serialize(record)
+
+        self._file.writelines(lines)
+        for source_id in new_sources:
+            self._written_sources[source_id] = None
+        while len(self._written_sources) > self.max_sources:
+            self._written_sources.popitem(last=False)
+
+    def _run(self):
+        self._open()
+        while True:
+            record = self._queue.get()
+            if record is _CLOSE:
+                break
+            try:
+                self._write_record(record)
+            except Exception as e:
+                logger.error(f"could not write history record : {e}")
+            # flush once the backlog is written, so a killed session loses nothing
+            if self._queue.empty():
+                self._file.flush()
+        self._file.close()
+
+
+_writers: Dict[str, HistoryWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_history_writer(path: str = HISTORY_PATH) -> HistoryWriter:
+    with _writers_lock:
+        if path not in _writers:
+            _writers[path] = HistoryWriter(path)
+        return _writers[path]
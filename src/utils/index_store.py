@@ -0,0 +1,383 @@
+"""Named Chroma collections, with their tags and lifecycle."""
+import atexit
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+from functools import lru_cache
+from typing import IO, Any, Dict, List, Optional
+
+from src import logger
+from src.utils.config import INDEX_DIRECTORY, INDEX_TTL
+
+try:
+    import fcntl
+except ImportError:  # Windows, collections are then not locked
+    fcntl = None
+
+MANIFEST_FILE = "manifest.json"
+# search parameters that page a search rather than change its topic
+PAGING_PARAMS = ("number_tweets", "number_submissions", "since_id", "after")
+COMPACTION_SUFFIXES = (".compacted", ".replaced")
+LOCK_SUFFIX = ".lock"
+# lock handed out when there is nothing to lock
+NO_LOCK = object()
+
+
+def slugify(text: str, max_length: int = 48) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")[:max_length]
+
+
+def get_query(search_params: Dict[str, Any]) -> Dict[str, Any]:
+    """What a search is about, whatever the number of posts it fetched."""
+    return {
+        key: value for key, value in search_params.items() if key not in PAGING_PARAMS
+    }
+
+
+def get_collection_name(
+    platform: str,
+    search_params: Dict[str, Any],
+    embedding_backend: str,
+) -> str:
+    """Name of the collection of a search, the same for every run of it.
+
+    Vectors of different backends don't share a collection. Names are
+    valid Chroma names: 3 to 63 characters of `[a-z0-9-]`.
+    """
+    query = get_query(search_params)
+    digest = hashlib.sha256(
+        json.dumps(
+            dict(platform=platform, query=query, embedding_backend=embedding_backend),
+            sort_keys=True,
+        ).encode("utf-8")
+    ).hexdigest()[:8]
+    label = query.get("keywords") or "-".join(
+        query.get("twitter_users") or query.get("subreddits") or []
+    )
+    return f"{platform}-{slugify(label, 40)}-{digest}"
+
+
+def get_session_collection_name(session_id: str) -> str:
+    return f"session-{session_id}"
+
+
+def get_contents_fingerprint(ids: List[str], metadatas: List[Dict[str, Any]]) -> str:
+    """Fingerprint of the chunks of a collection, whatever their order."""
+    fingerprint = hashlib.sha256()
+    for chunk_id, content_hash in sorted(
+        (chunk_id, (metadata or {}).get("content_hash", ""))
+        for chunk_id, metadata in zip(ids, metadatas)
+    ):
+        fingerprint.update(f"{chunk_id}:{content_hash}\n".encode("utf-8"))
+    return fingerprint.hexdigest()
+
+
+def get_collection_fingerprint(collection) -> str:
+    contents = collection.get(include=["metadatas"])
+    return get_contents_fingerprint(contents["ids"], contents["metadatas"])
+
+
+def _directory_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def _release(client):
+    # chromadb persists every client at exit, which also keeps them all alive
+    db = getattr(client, "_db", None)
+    if db is not None and hasattr(db, "persist"):
+        atexit.unregister(db.persist)
+
+
+def _no_embeddings(texts: List[str]):
+    raise ValueError("compaction copies the stored vectors, it never embeds")
+
+
+class IndexStore(object):
+    """Named collections, each persisted in its own directory of `directory`.
+
+    Chroma (duckdb+parquet) loads a whole directory in memory and writes
+    it back as a whole, so collections sharing a directory would overwrite
+    each other. Every collection has its own directory instead, next to a
+    manifest of tags: platform, query, embedding backend, the session that
+    last indexed it, when it was created, fetched and last opened, and the
+    fingerprint of its chunks. Listing and expiring only read the manifests.
+
+    A directory is still loaded by every client opening it, so a session
+    writing a collection holds its `lock` until it is closed. Readers,
+    compaction and expiry don't wait for it, they skip or fail instead.
+
+    Without a `directory`, collections are only kept in memory.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = INDEX_DIRECTORY,
+        ttl: float = INDEX_TTL,
+    ):
+        self.directory = directory
+        self.ttl = ttl
+
+    def path(self, name: str) -> Optional[str]:
+        if self.directory is None:
+            return None
+        return os.path.join(self.directory, name)
+
+    def _manifest_path(self, name: str) -> str:
+        return os.path.join(self.path(name), MANIFEST_FILE)
+
+    def _lock_path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}{LOCK_SUFFIX}")
+
+    def lock(self, name: str, shared: bool = False) -> Optional[IO]:
+        """Lock a collection without waiting, `None` when it is locked elsewhere.
+
+        Writers take an exclusive lock, readers a shared one. The lock is
+        held until `unlock`, or until the process exits.
+        """
+        if self.directory is None or fcntl is None:
+            return NO_LOCK
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._lock_path(name)
+        while True:
+            # a new open file per lock, flock conflicts within a process too
+            f = open(path, "a")
+            try:
+                fcntl.flock(
+                    f, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB
+                )
+            except BlockingIOError:
+                f.close()
+                return None
+            # `delete` removes the lock file, a lock on the removed one is void
+            try:
+                if os.stat(path).st_ino == os.fstat(f.fileno()).st_ino:
+                    return f
+            except FileNotFoundError:
+                pass
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+
+    def unlock(self, lock: Optional[IO]):
+        if lock is None or lock is NO_LOCK:
+            return
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
+
+    def describe(self, name: str) -> Optional[Dict[str, Any]]:
+        """The tags of a collection, `None` when it doesn't exist."""
+        if self.directory is None:
+            return None
+        try:
+            with open(self._manifest_path(name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def record(self, name: str, **tags: Any) -> Dict[str, Any]:
+        """Update the tags of a collection."""
+        if self.directory is None:
+            return tags
+        manifest = self.describe(name) or dict(name=name, created_at=time.time())
+        manifest.update(tags)
+        os.makedirs(self.path(name), exist_ok=True)
+        tmp_path = f"{self._manifest_path(name)}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2, default=str)
+        os.replace(tmp_path, self._manifest_path(name))
+        return manifest
+
+    def open(
+        self,
+        name: str,
+        embeddings,
+        reset: bool = False,
+        read_only: bool = False,
+    ):
+        """The collection `name`, created when missing and emptied on `reset`.
+
+        A `read_only` collection is never written back to its directory.
+        """
+        from langchain.vectorstores import Chroma
+
+        docsearch = Chroma(
+            collection_name=name,
+            embedding_function=embeddings,
+            persist_directory=self.path(name),
+        )
+        if reset and docsearch._collection.count():
+            docsearch.delete_collection()
+            docsearch = Chroma(
+                collection_name=name,
+                embedding_function=embeddings,
+                persist_directory=self.path(name),
+                client=docsearch._client,
+            )
+        if read_only:
+            _release(docsearch._client)
+        return docsearch
+
+    def close(self, docsearch, persist: bool = True):
+        """Persist a collection opened by `open` and release its client."""
+        if persist and self.directory is not None:
+            docsearch.persist()
+        _release(docsearch._client)
+
+    def list(self) -> List[Dict[str, Any]]:
+        """The tags of every collection, most recently opened first."""
+        if self.directory is None or not os.path.isdir(self.directory):
+            return []
+        manifests = [self.describe(name) for name in sorted(os.listdir(self.directory))]
+        return sorted(
+            (manifest for manifest in manifests if manifest is not None),
+            key=lambda manifest: manifest.get("opened_at", 0),
+            reverse=True,
+        )
+
+    def delete(self, name: str):
+        """Delete a collection, unless a session has it open."""
+        lock = self.lock(name)
+        if lock is None:
+            raise ValueError(f"index {name} is open in another session")
+        try:
+            shutil.rmtree(self.path(name), ignore_errors=True)
+            if lock is not NO_LOCK:
+                os.remove(self._lock_path(name))
+        finally:
+            self.unlock(lock)
+        logger.info(f"index {name} deleted")
+
+    def expire(self, ttl: Optional[float] = None) -> List[str]:
+        """Delete the collections that weren't opened for `ttl` seconds.
+
+        Leftovers of an interrupted compaction are deleted once they are
+        as old, other files of the directory are left alone. Collections
+        open in a session are skipped.
+        """
+        if self.directory is None or not os.path.isdir(self.directory):
+            return []
+        deadline = time.time() - (self.ttl if ttl is None else ttl)
+        expired = []
+        for name in sorted(os.listdir(self.directory)):
+            manifest = self.describe(name)
+            if manifest is not None:
+                last_used = manifest.get("opened_at", manifest["created_at"])
+            elif name.endswith(COMPACTION_SUFFIXES):
+                last_used = os.path.getmtime(self.path(name))
+            else:
+                continue
+            if last_used >= deadline:
+                continue
+            try:
+                self.delete(name)
+            except ValueError as e:
+                logger.info(str(e))
+                continue
+            expired.append(name)
+        return expired
+
+    def _client(self, path: str):
+        import chromadb
+        import chromadb.config
+
+        return chromadb.Client(
+            chromadb.config.Settings(
+                chroma_db_impl="duckdb+parquet",
+                persist_directory=path,
+            )
+        )
+
+    def compact(self, name: str, max_age: Optional[float] = None) -> Dict[str, int]:
+        """Rewrite a collection without the space left by replaced vectors.
+
+        hnswlib only marks the vectors of deleted chunks as deleted, and an
+        incremental collection keeps every post it was ever given. With a
+        `max_age`, the chunks indexed longer ago than that many seconds
+        are dropped, the next search returning them indexes them again
+        from the embedding cache. Fails when a session has the collection
+        open.
+        """
+        path = self.path(name)
+        if self.describe(name) is None:
+            raise ValueError(f"no index {name}")
+        lock = self.lock(name)
+        if lock is None:
+            raise ValueError(f"index {name} is open in another session")
+        try:
+            return self._compact(name, path, max_age)
+        finally:
+            self.unlock(lock)
+
+    def _compact(self, name: str, path: str, max_age: Optional[float]):
+        bytes_before = _directory_size(path)
+
+        source = self._client(path)
+        collection = source.get_collection(name, embedding_function=_no_embeddings)
+        contents = collection.get(include=["embeddings", "metadatas", "documents"])
+        keep = [
+            i
+            for i, metadata in enumerate(contents["metadatas"])
+            if max_age is None
+            or (metadata or {}).get("indexed_at", 0) >= time.time() - max_age
+        ]
+
+        compacted_path, replaced_path = (
+            path + suffix for suffix in COMPACTION_SUFFIXES
+        )
+        shutil.rmtree(compacted_path, ignore_errors=True)
+        target = self._client(compacted_path)
+        compacted = target.create_collection(
+            name,
+            metadata=collection.metadata,
+            embedding_function=_no_embeddings,
+        )
+        if keep:
+            compacted.add(
+                ids=[contents["ids"][i] for i in keep],
+                embeddings=[contents["embeddings"][i] for i in keep],
+                metadatas=[contents["metadatas"][i] for i in keep],
+                documents=[contents["documents"][i] for i in keep],
+            )
+            target.persist()
+        _release(source)
+        _release(target)
+
+        os.makedirs(compacted_path, exist_ok=True)
+        shutil.copy(self._manifest_path(name), compacted_path)
+        # the directory is swapped at once, a crash leaves one of the two complete
+        os.rename(path, replaced_path)
+        os.rename(compacted_path, path)
+        shutil.rmtree(replaced_path)
+        self.record(
+            name,
+            num_chunks=len(keep),
+            fingerprint=get_contents_fingerprint(
+                [contents["ids"][i] for i in keep],
+                [contents["metadatas"][i] for i in keep],
+            ),
+            compacted_at=time.time(),
+        )
+
+        stats = dict(
+            chunks_before=len(contents["ids"]),
+            chunks_after=len(keep),
+            bytes_before=bytes_before,
+            bytes_after=_directory_size(path),
+        )
+        logger.info(
+            f"index {name} compacted: {stats['chunks_after']}/{stats['chunks_before']} "
+            f"chunks kept, {stats['bytes_before']} -> {stats['bytes_after']} bytes"
+        )
+        return stats
+
+
+@lru_cache(maxsize=None)
+def get_index_store(directory: Optional[str] = INDEX_DIRECTORY) -> IndexStore:
+    """The store of a directory, shared by every agent of the process."""
+    return IndexStore(directory)
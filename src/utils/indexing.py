@@ -0,0 +1,172 @@
+"""Incremental indexing of documents with stable chunk IDs."""
+import hashlib
+import time
+from typing import Any, Dict, List, Tuple
+
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+
+from src.utils.data_processing import (
+    get_metadatas_from_documents,
+    get_texts_from_documents,
+)
+from src.utils.metrics import get_metrics
+
+
+def get_source_id(metadata: Dict[str, Any]) -> str:
+    """Natural key of the post a chunk was extracted from."""
+    for key in ("tweet_id", "id", "source"):
+        if metadata.get(key) is not None:
+            return str(metadata[key])
+    raise ValueError(f"Can't find a source id in metadata {metadata}")
+
+
+def get_content_hash(document: Document) -> str:
+    return hashlib.sha256(document.page_content.encode("utf-8")).hexdigest()
+
+
+def get_chunk_id(metadata: Dict[str, Any]) -> str:
+    """Deterministic `<source id>-<chunk ordinal>` id of a chunk.
+
+    The ordinal is set by `split_documents`, so the same post always maps
+    to the same ids across runs and when a search returns it twice.
+    """
+    return f"{get_source_id(metadata)}-{metadata.get('chunk', 0)}"
+
+
+def assign_chunk_ids(documents: List[Document]) -> List[str]:
+    return [get_chunk_id(document.metadata) for document in documents]
+
+
+def get_index_fingerprint(collection, documents: List[Document]) -> str:
+    """Fingerprint of a collection's contents after indexing `documents`."""
+    fingerprint = hashlib.sha256(f"{collection.name}:{collection.count()}".encode())
+    for chunk_id, document in zip(assign_chunk_ids(documents), documents):
+        fingerprint.update(chunk_id.encode("utf-8"))
+        fingerprint.update(get_content_hash(document).encode("utf-8"))
+    return fingerprint.hexdigest()
+
+
+def _stale_ids(collection, documents: Dict[str, Document]) -> List[str]:
+    """Ids of the chunks of the sources above their current number of chunks.
+
+    Ordinals are contiguous, so the ids are probed one ordinal at a time
+    from the number of chunks, for the sources still having one.
+    """
+    next_ordinals = {}
+    for document in documents.values():
+        metadata = document.metadata
+        if "num_chunks" in metadata:
+            next_ordinals[get_source_id(metadata)] = metadata["num_chunks"]
+
+    stale = []
+    while next_ordinals:
+        probes = {
+            f"{source_id}-{ordinal}": source_id
+            for source_id, ordinal in next_ordinals.items()
+        }
+        with get_metrics().timer("chroma_seconds", operation="get"):
+            found = collection.get(ids=list(probes), include=[])["ids"]
+        stale.extend(found)
+        next_ordinals = {
+            probes[chunk_id]: next_ordinals[probes[chunk_id]] + 1 for chunk_id in found
+        }
+    return stale
+
+
+def select_delta(
+    collection,
+    ids: List[str],
+    documents: List[Document],
+    stats: Dict[str, int],
+) -> Tuple[List[str], List[Document]]:
+    """Keep the chunks that are new or whose content changed.
+
+    `stats` counts of new, changed, unchanged and deleted chunks are updated
+    in place. The chunks kept are copies tagged with their content hash and
+    the time they are indexed at. Chunks of an earlier, longer version of a
+    post are deleted.
+    """
+    # the same post can be returned twice by a search, keep its first occurrence
+    unique = {}
+    for chunk_id, document in zip(ids, documents):
+        unique.setdefault(chunk_id, document)
+
+    with get_metrics().timer("chroma_seconds", operation="get"):
+        existing = collection.get(ids=list(unique), include=["metadatas"])
+    existing_hashes = {
+        chunk_id: (metadata or {}).get("content_hash")
+        for chunk_id, metadata in zip(existing["ids"], existing["metadatas"])
+    }
+
+    stale = _stale_ids(collection, unique)
+    if stale:
+        with get_metrics().timer("chroma_seconds", operation="delete"):
+            collection.delete(ids=stale)
+        stats["deleted"] += len(stale)
+
+    delta_ids = []
+    delta_documents = []
+    indexed_at = int(time.time())
+    for chunk_id, document in unique.items():
+        content_hash = get_content_hash(document)
+        if chunk_id not in existing_hashes:
+            stats["new"] += 1
+        elif existing_hashes[chunk_id] != content_hash:
+            stats["changed"] += 1
+        else:
+            stats["unchanged"] += 1
+            continue
+
+        document = Document(
+            page_content=document.page_content,
+            metadata=dict(
+                document.metadata,
+                content_hash=content_hash,
+                indexed_at=indexed_at,
+            ),
+        )
+        delta_ids.append(chunk_id)
+        delta_documents.append(document)
+
+    return delta_ids, delta_documents
+
+
+def upsert_embedded(
+    collection,
+    ids: List[str],
+    documents: List[Document],
+    vectors: List[List[float]],
+):
+    if ids:
+        with get_metrics().timer("chroma_seconds", operation="upsert"):
+            collection.upsert(
+                ids=ids,
+                embeddings=vectors,
+                documents=get_texts_from_documents(documents),
+                metadatas=get_metadatas_from_documents(documents),
+            )
+
+
+def upsert_documents(
+    collection,
+    embeddings: Embeddings,
+    documents: List[Document],
+) -> Dict[str, int]:
+    """Embed and upsert only the chunks that are new or whose content changed.
+
+    Returns the number of new, changed, unchanged and deleted chunks.
+    """
+    stats = dict(new=0, changed=0, unchanged=0, deleted=0)
+    ids, documents = select_delta(
+        collection,
+        assign_chunk_ids(documents),
+        documents,
+        stats,
+    )
+
+    if documents:
+        vectors = embeddings.embed_documents(get_texts_from_documents(documents))
+        upsert_embedded(collection, ids, documents, vectors)
+
+    return stats
@@ -0,0 +1,233 @@
+"""Counters and timings of a session, and their exporters."""
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.utils.config import METRICS_PREFIX, METRICS_TEXTFILE_PATH
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    return ",".join(f"{key}={value}" for key, value in labels) or "all"
+
+
+class MetricsRegistry(object):
+    """Thread-safe counters and timers with labels.
+
+    Counters only go up, like Prometheus counters. Timers keep the count,
+    the total and the maximum of the observed durations. Everything
+    recorded is also recorded in the `parent` registry, if any.
+    """
+
+    def __init__(self, parent: Optional["MetricsRegistry"] = None):
+        self.parent = parent
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._timers: Dict[Tuple[str, Labels], Tuple[int, float, float]] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        if self.parent is not None:
+            self.parent.increment(name, value, **labels)
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            count, total, maximum = self._timers.get(key, (0, 0.0, 0.0))
+            self._timers[key] = (count + 1, total + seconds, max(maximum, seconds))
+        if self.parent is not None:
+            self.parent.observe(name, seconds, **labels)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(counters=dict(self._counters), timers=dict(self._timers))
+
+    def to_dict(self, since: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """JSON-friendly metrics, only what was recorded after `since` if given."""
+        current = self.snapshot()
+        since = since or dict(counters={}, timers={})
+        ret = dict(counters={}, timers={})
+
+        for (name, labels), value in current["counters"].items():
+            value -= since["counters"].get((name, labels), 0)
+            if value:
+                ret["counters"].setdefault(name, {})[_format_labels(labels)] = value
+
+        for (name, labels), (count, total, maximum) in current["timers"].items():
+            count_before, total_before, _ = since["timers"].get(
+                (name, labels), (0, 0.0, 0.0)
+            )
+            if count > count_before:
+                ret["timers"].setdefault(name, {})[_format_labels(labels)] = dict(
+                    count=count - count_before,
+                    total_s=round(total - total_before, 4),
+                    max_s=round(maximum, 4),
+                )
+
+        return ret
+
+    def samples(self):
+        """`(name, labels, kind, value)` of every counter and timer."""
+        current = self.snapshot()
+        for (name, labels), value in sorted(current["counters"].items()):
+            yield name, labels, "counter", value
+        for (name, labels), value in sorted(current["timers"].items()):
+            yield name, labels, "timer", value
+
+
+_registry = MetricsRegistry()
+_current: ContextVar[MetricsRegistry] = ContextVar("metrics", default=_registry)
+
+
+def get_process_metrics() -> MetricsRegistry:
+    """Return the process-wide registry, the one that is exported."""
+    return _registry
+
+
+def get_metrics() -> MetricsRegistry:
+    """Return the registry every component records into.
+
+    It is the registry of the session running in the current thread, see
+    `recording_into`, or the process-wide one.
+    """
+    return _current.get()
+
+
+@contextmanager
+def recording_into(registry: MetricsRegistry):
+    """Record what the current thread does into `registry`."""
+    token = _current.set(registry)
+    try:
+        yield registry
+    finally:
+        _current.reset(token)
+
+
+def propagate_metrics(fn):
+    """`fn` recording into the registry of the caller, whatever thread runs it."""
+    registry = get_metrics()
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with recording_into(registry):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+def timed(name: str, **labels):
+    """Decorator recording the duration of every call in the registry."""
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with get_metrics().timer(name, **labels):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class MetricsExporter(ABC):
+    @abstractmethod
+    def export(self, registry: MetricsRegistry):
+        pass
+
+
+class PrometheusTextfileExporter(MetricsExporter):
+    """Writes the metrics in the Prometheus text format.
+
+    The file is meant for the textfile collector of the node exporter, it
+    is replaced atomically so a scrape never reads a partial file. Timers
+    are exported as summaries in seconds.
+    """
+
+    def __init__(self, path: str = METRICS_TEXTFILE_PATH, prefix: str = METRICS_PREFIX):
+        self.path = path
+        self.prefix = prefix
+
+    def _format(self, registry: MetricsRegistry) -> str:
+        lines = []
+        declared = set()
+
+        for name, labels, kind, value in registry.samples():
+            name = f"{self.prefix}_{name}"
+            label_string = ",".join(
+                f'{key}="{_escape(label)}"' for key, label in labels
+            )
+            label_string = f"{{{label_string}}}" if label_string else ""
+
+            if name not in declared:
+                declared.add(name)
+                lines.append(
+                    f"# TYPE {name} {'counter' if kind == 'counter' else 'summary'}"
+                )
+            if kind == "counter":
+                lines.append(f"{name}{label_string} {value}")
+            else:
+                count, total, _ = value
+                lines.append(f"{name}_count{label_string} {count}")
+                lines.append(f"{name}_sum{label_string} {total}")
+
+        return "\n".join(lines) + "\n"
+
+    def export(self, registry: MetricsRegistry):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self._format(registry))
+        os.replace(tmp_path, self.path)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def get_metrics_exporters() -> List[MetricsExporter]:
+    """Exporters enabled in the configuration."""
+    if not METRICS_TEXTFILE_PATH:
+        return []
+    return [PrometheusTextfileExporter()]
+
+
+def instrument_session(
+    session, service: str, registry: Optional[MetricsRegistry] = None
+):
+    """Count the requests, bytes and rate-limited responses of a `requests` session."""
+    registry = registry or get_metrics()
+
+    def on_response(response, *args, **kwargs):
+        registry.increment("http_requests_total", service=service)
+        registry.increment(
+            "http_fetched_bytes_total",
+            len(response.content),
+            service=service,
+        )
+        if response.status_code == 429:
+            registry.increment("http_rate_limited_total", service=service)
+
+    session.hooks["response"].append(on_response)
+    return session
@@ -0,0 +1,147 @@
+"""Staged execution with bounded queues between the stages."""
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple, Union
+
+from src.utils.config import PIPELINE_QUEUE_SIZE
+from src.utils.metrics import propagate_metrics
+
+StageFn = Callable[[Iterator[Any]], Iterable[Any]]
+
+_DONE = object()
+_POLL_INTERVAL = 0.1
+
+
+class PipelineStopped(Exception):
+    pass
+
+
+class StageStats(object):
+    def __init__(self, name: str):
+        self.name = name
+        self.items_in = 0
+        self.items_out = 0
+        self.started_at = None
+        self.ended_at = None
+        # time spent waiting for upstream items
+        self.waiting = 0.0
+        # time spent blocked on a full output queue (backpressure)
+        self.blocked = 0.0
+
+    @property
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.ended_at or time.monotonic()) - self.started_at
+
+    def to_dict(self) -> Dict[str, float]:
+        elapsed = self.elapsed
+        return dict(
+            items_in=self.items_in,
+            items_out=self.items_out,
+            elapsed_s=round(elapsed, 3),
+            busy_s=round(max(0.0, elapsed - self.waiting - self.blocked), 3),
+            waiting_s=round(self.waiting, 3),
+            blocked_s=round(self.blocked, 3),
+            throughput=round(self.items_out / elapsed, 2) if elapsed else 0.0,
+        )
+
+
+def _consume(inbox: queue.Queue, stats: StageStats, stop: threading.Event):
+    while True:
+        start = time.monotonic()
+        try:
+            item = inbox.get(timeout=_POLL_INTERVAL)
+        except queue.Empty:
+            stats.waiting += time.monotonic() - start
+            if stop.is_set():
+                raise PipelineStopped()
+            continue
+        stats.waiting += time.monotonic() - start
+
+        if item is _DONE:
+            return
+        stats.items_in += 1
+        yield item
+
+
+def _produce(outbox: queue.Queue, item, stats: StageStats, stop: threading.Event):
+    start = time.monotonic()
+    try:
+        while True:
+            if stop.is_set():
+                raise PipelineStopped()
+            try:
+                outbox.put(item, timeout=_POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+    finally:
+        stats.blocked += time.monotonic() - start
+
+
+def run_pipeline(
+    source: Tuple[str, Iterable[Any]],
+    stages: List[Tuple[str, StageFn]],
+    queue_size: Union[int, List[int]] = PIPELINE_QUEUE_SIZE,
+) -> Dict[str, Dict[str, float]]:
+    """Run `source` and `stages` concurrently, each in its own thread.
+
+    Every stage receives an iterator over the outputs of the previous one
+    through a bounded queue, so a slow stage throttles the upstream ones
+    instead of letting items pile up in memory. Outputs of the last stage
+    are discarded. `queue_size` is either shared by all the queues or given
+    per queue. Returns per-stage statistics; the first exception raised by
+    a stage stops the whole pipeline and is re-raised.
+    """
+    source_name, source_items = source
+    names = [source_name] + [name for name, _ in stages]
+    functions = [lambda _: source_items] + [fn for _, fn in stages]
+    if isinstance(queue_size, int):
+        queue_size = [queue_size] * len(stages)
+    queues = [queue.Queue(maxsize=size) for size in queue_size]
+    stats = {name: StageStats(name) for name in names}
+    stop = threading.Event()
+    errors = []
+
+    def work(i: int):
+        stage_stats = stats[names[i]]
+        stage_stats.started_at = time.monotonic()
+        inbox = queues[i - 1] if i > 0 else None
+        outbox = queues[i] if i < len(queues) else None
+
+        try:
+            items = _consume(inbox, stage_stats, stop) if inbox is not None else None
+            for item in functions[i](items):
+                stage_stats.items_out += 1
+                if outbox is not None:
+                    _produce(outbox, item, stage_stats, stop)
+            if outbox is not None:
+                _produce(outbox, _DONE, stage_stats, stop)
+        except PipelineStopped:
+            pass
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            stage_stats.ended_at = time.monotonic()
+
+    threads = [
+        threading.Thread(
+            target=propagate_metrics(work),
+            args=(i,),
+            name=f"pipeline-{name}",
+            daemon=True,
+        )
+        for i, name in enumerate(names)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    return {name: stage_stats.to_dict() for name, stage_stats in stats.items()}
@@ -29,3 +29,37 @@ Format the output as a JSON with the following keys and do not forget the curly
 * q3
 
 """
+
+map_summary_template = """Given the following tweets
+
+{text}
+
+Write a concise summary of the discussed topics. Keep the important facts, names, numbers and opinions 
+so that the summary can be merged with summaries of other tweets.
+
+"""
+
+combine_summary_template = """Given the following summaries of tweets
+
+{text}
+
+Merge them into a single concise summary of the discussed topics. Keep the important facts, names, numbers and opinions.
+
+"""
+
+reduce_summary_template = """Given the following summaries of tweets
+
+{text}
+
+I want you to merge them into a short summary and produce three questions that cover the discussed topics.
+Each question should find its answer within the summaries. Don't invent questions that have no answers.
+Questions should also be very different from each other and discuss topics that are not necessarily present in the summary.
+
+Format the output as a JSON with the following keys and do not forget the curly brackets.
+
+* summary
+* q1
+* q2
+* q3
+
+"""
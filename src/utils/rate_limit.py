@@ -0,0 +1,220 @@
+"""Rate limiting for the Twitter and Reddit APIs, shared by threads and processes."""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+from src import logger
+from src.utils.config import (
+    RATE_LIMIT_INTERACTIVE_RESERVE,
+    RATE_LIMIT_STATE_DIRECTORY,
+    RATE_LIMITS,
+)
+from src.utils.metrics import get_metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows, the buckets are then per process
+    fcntl = None
+
+# searches typed by the user go ahead of the bulk fetches of the loaders
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BULK = "bulk"
+
+
+class RateLimiter(object):
+    """Token bucket refilled at `rate` requests per `period` seconds.
+
+    `burst` requests can be made back to back, after which callers are
+    spaced out evenly so the quota is never exceeded. Bulk requests leave
+    `interactive_reserve` of the burst to interactive ones. An interactive
+    request finding the bucket empty books the next token, the bucket goes
+    below zero, so it is served on refill before the bulk requests already
+    waiting, which then wait for the tokens after it.
+
+    With a `state_path`, the bucket is stored in that file and updated
+    under an exclusive lock, so that all the processes calling the same
+    endpoint share one quota. `block_until` holds the bucket until the
+    quota window announced by the API resets.
+    """
+
+    def __init__(
+        self,
+        rate: int,
+        period: float,
+        burst: int = 1,
+        name: str = "",
+        state_path: Optional[str] = None,
+        interactive_reserve: float = RATE_LIMIT_INTERACTIVE_RESERVE,
+    ):
+        self.name = name
+        self.rate = rate
+        self.period = period
+        self.capacity = max(1, burst)
+        # a bucket of one token isn't reserved, bulk requests would never get it
+        self.reserve = min(self.capacity * interactive_reserve, self.capacity - 1)
+        self.state_path = state_path if fcntl is not None else None
+        # wall-clock time, comparable across processes
+        self._state = dict(
+            tokens=float(self.capacity),
+            updated_at=time.time(),
+            blocked_until=0.0,
+        )
+        self._lock = threading.Lock()
+
+        if self.state_path:
+            directory = os.path.dirname(self.state_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def _locked_state(self) -> Iterator[Dict[str, float]]:
+        with self._lock:
+            if not self.state_path:
+                yield self._state
+                return
+
+            # opened on every call, flock locks are shared by forked processes
+            with open(self.state_path, "a+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    content = f.read()
+                    state = dict(self._state)
+                    if content:
+                        state.update(json.loads(content))
+                    yield state
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _refill(self, state: Dict[str, float], now: float):
+        elapsed = max(0.0, now - state["updated_at"])
+        state["tokens"] = min(
+            self.capacity, state["tokens"] + elapsed * self.rate / self.period
+        )
+        state["updated_at"] = now
+
+    def _try_acquire(self, priority: str) -> Tuple[float, bool]:
+        """Return the seconds to wait, and whether a token is taken for after them."""
+        interactive = priority == PRIORITY_INTERACTIVE
+        floor = 0.0 if interactive else self.reserve
+        with self._locked_state() as state:
+            now = time.time()
+            if now < state["blocked_until"]:
+                return state["blocked_until"] - now, False
+            self._refill(state, now)
+            if state["tokens"] >= 1 + floor:
+                state["tokens"] -= 1
+                return 0.0, True
+            if interactive:
+                # booked ahead of the bulk requests, paid back by the refill
+                state["tokens"] -= 1
+                return -state["tokens"] * self.period / self.rate, True
+            return (1 + floor - state["tokens"]) * self.period / self.rate, False
+
+    def acquire(self, priority: str = PRIORITY_BULK):
+        metrics = get_metrics()
+        metrics.increment("api_calls_total", endpoint=self.name, priority=priority)
+        waited = 0.0
+        while True:
+            delay, taken = self._try_acquire(priority)
+            if delay:
+                time.sleep(delay)
+                waited += delay
+            if taken:
+                break
+        if waited:
+            metrics.increment(
+                "rate_limit_wait_seconds_total",
+                waited,
+                endpoint=self.name,
+                priority=priority,
+            )
+
+    def block_until(self, timestamp: float):
+        """Hold every request until `timestamp`, when the API quota resets."""
+        with self._locked_state() as state:
+            state["blocked_until"] = max(state["blocked_until"], timestamp)
+            # the window of the API starts over with a full quota
+            state["tokens"] = float(self.capacity)
+            state["updated_at"] = state["blocked_until"]
+        logger.info(
+            f"{self.name} quota exhausted, waiting "
+            f"{max(0.0, timestamp - time.time()):.0f}s for it to reset"
+        )
+
+
+_rate_limiters: Dict[str, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def _state_path(endpoint: str) -> Optional[str]:
+    if not RATE_LIMIT_STATE_DIRECTORY:
+        return None
+    return os.path.join(RATE_LIMIT_STATE_DIRECTORY, f"{endpoint}.json")
+
+
+def get_rate_limiter(endpoint: str) -> RateLimiter:
+    """Return the limiter of an endpoint declared in `RATE_LIMITS`."""
+    with _rate_limiters_lock:
+        if endpoint not in _rate_limiters:
+            rate, period, burst = RATE_LIMITS[endpoint]
+            _rate_limiters[endpoint] = RateLimiter(
+                rate, period, burst, endpoint, state_path=_state_path(endpoint)
+            )
+        return _rate_limiters[endpoint]
+
+
+def set_rate_limit(endpoint: str, rate: int, period: float, burst: int = 1):
+    """Replace the limiter of an endpoint in this process, e.g. for stand-ins."""
+    with _rate_limiters_lock:
+        _rate_limiters[endpoint] = RateLimiter(rate, period, burst, endpoint)
+
+
+def _reset_at(response) -> Optional[float]:
+    headers = response.headers
+    if "x-rate-limit-reset" in headers:
+        # Twitter, epoch seconds
+        return float(headers["x-rate-limit-reset"])
+    if "x-ratelimit-reset" in headers:
+        # Reddit, seconds left in the window
+        return time.time() + float(headers["x-ratelimit-reset"])
+    if "retry-after" in headers:
+        return time.time() + float(headers["retry-after"])
+    return None
+
+
+def throttle_on_rate_limit(session, endpoint_of: Callable[[str], Optional[str]]):
+    """Hold the limiter of an endpoint when its responses report an exhausted quota.
+
+    `endpoint_of` maps the URL of a response to its endpoint in
+    `RATE_LIMITS`, or `None` for the endpoints that aren't limited.
+    """
+
+    def on_response(response, *args: Any, **kwargs: Any):
+        endpoint = endpoint_of(response.url)
+        if endpoint is None:
+            return
+        remaining = response.headers.get(
+            "x-rate-limit-remaining", response.headers.get("x-ratelimit-remaining")
+        )
+        try:
+            exhausted = remaining is not None and float(remaining) < 1
+            if response.status_code != 429 and not exhausted:
+                return
+            reset_at = _reset_at(response)
+        except ValueError:
+            reset_at = None
+        if reset_at is None:
+            # no hint from the API, wait for a whole window
+            reset_at = time.time() + RATE_LIMITS[endpoint][1]
+        get_rate_limiter(endpoint).block_until(reset_at)
+
+    session.hooks["response"].append(on_response)
+    return session
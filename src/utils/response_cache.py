@@ -0,0 +1,222 @@
+"""Persistent cache of the Twitter and Reddit API responses."""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from functools import lru_cache
+from typing import Any, Callable, Dict, Optional
+
+from src import logger
+from src.utils.config import (
+    RESPONSE_CACHE_MAX_BYTES,
+    RESPONSE_CACHE_PATH,
+    RESPONSE_CACHE_TTLS,
+)
+from src.utils.metrics import get_metrics
+
+
+def _normalize(value: Any) -> Any:
+    # queries differing only by case or spacing hit the same entry
+    if isinstance(value, str):
+        return " ".join(value.lower().split())
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    if isinstance(value, dict):
+        return {
+            key: _normalize(item) for key, item in value.items() if item is not None
+        }
+    return value
+
+
+def get_response_key(endpoint: str, params: Dict[str, Any]) -> str:
+    params = json.dumps(_normalize(params), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{endpoint}\x00{params}".encode("utf-8")).hexdigest()
+
+
+def _dumps(value: Any) -> bytes:
+    return zlib.compress(
+        json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    )
+
+
+def _loads(blob: bytes) -> Any:
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+class ResponseCache(object):
+    """SQLite-backed store of JSON responses with per-endpoint TTLs.
+
+    Responses are keyed by the endpoint and its normalized parameters and
+    stored as zlib-compressed compact JSON. An entry expires `ttls[endpoint]`
+    seconds after it was fetched, endpoints without a TTL are not cached.
+    Once the stored responses exceed `max_bytes`, expired entries are
+    dropped first, then the least recently used ones.
+
+    The database can be shared by concurrent runs of the agent.
+    """
+
+    def __init__(
+        self,
+        path: str = RESPONSE_CACHE_PATH,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+        ttls: Optional[Dict[str, float]] = None,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttls = dict(RESPONSE_CACHE_TTLS if ttls is None else ttls)
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # waits for the write lock of another process instead of failing
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        # readers don't block the writer, and commits don't wait for a sync
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                endpoint TEXT NOT NULL,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_access "
+            "ON responses (last_access)"
+        )
+        self._conn.commit()
+
+    def get(self, endpoint: str, params: Dict[str, Any]) -> Any:
+        """The cached response, or `None` when missing or expired."""
+        key = get_response_key(endpoint, params)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM responses WHERE key = ? AND expires_at > ?",
+                (key, now),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+        return _loads(row[0])
+
+    def put(self, endpoint: str, params: Dict[str, Any], value: Any):
+        ttl = self.ttls.get(endpoint)
+        if not ttl:
+            return
+        blob = _dumps(value)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, endpoint, value, size, expires_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    get_response_key(endpoint, params),
+                    endpoint,
+                    blob,
+                    len(blob),
+                    now + ttl,
+                    now,
+                ),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def fetch(
+        self,
+        endpoint: str,
+        params: Dict[str, Any],
+        fetch: Callable[[], Any],
+    ) -> Any:
+        """Return the cached response of `endpoint`, calling `fetch` on a miss.
+
+        `fetch` must return a JSON-serializable value.
+        """
+        if not self.ttls.get(endpoint):
+            return fetch()
+
+        value = self.get(endpoint, params)
+        if value is not None:
+            get_metrics().increment("response_cache_hits_total", endpoint=endpoint)
+            return value
+
+        get_metrics().increment("response_cache_misses_total", endpoint=endpoint)
+        value = fetch()
+        self.put(endpoint, params, value)
+        return value
+
+    def _evict(self, now: float):
+        (size,) = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if size <= self.max_bytes:
+            return
+
+        expired = self._conn.execute(
+            "DELETE FROM responses WHERE expires_at <= ?", (now,)
+        ).rowcount
+        (size,) = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+
+        evicted = 0
+        rows = self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY last_access ASC"
+        ).fetchall()
+        keys = []
+        for key, entry_size in rows:
+            if size <= self.max_bytes:
+                break
+            keys.append((key,))
+            size -= entry_size
+        if keys:
+            self._conn.executemany("DELETE FROM responses WHERE key = ?", keys)
+            evicted = len(keys)
+        logger.info(
+            f"evicted {expired} expired and {evicted} least recently used "
+            "responses from the cache"
+        )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        return count
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+@lru_cache(maxsize=None)
+def get_response_cache(path: str = RESPONSE_CACHE_PATH) -> Optional[ResponseCache]:
+    """The cache shared by the loaders, `None` when disabled in the configuration."""
+    if not path:
+        return None
+    return ResponseCache(path)
+
+
+def cached_fetch(endpoint: str, params: Dict[str, Any], fetch: Callable[[], Any]):
+    """Call `fetch` through the response cache, if enabled."""
+    cache = get_response_cache()
+    if cache is None:
+        return fetch()
+    return cache.fetch(endpoint, params, fetch)
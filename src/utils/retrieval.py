@@ -0,0 +1,96 @@
+"""Retrieval of the chunks that fit in the prompt of the question answering chain."""
+import asyncio
+from functools import partial
+from typing import Any, Dict, List, Optional
+
+from langchain.chains.qa_with_sources.stuff_prompt import EXAMPLE_PROMPT, PROMPT
+from langchain.docstore.document import Document
+from langchain.prompts import PromptTemplate
+from langchain.schema import BaseRetriever
+from langchain.vectorstores.base import VectorStore
+
+from src.utils.config import (
+    COMPLETION_RESERVED_TOKENS,
+    MAX_CONTEXT_TOKENS,
+    RETRIEVAL_CANDIDATES,
+)
+from src.utils.metrics import get_metrics
+from src.utils.tokens import TokenCounter, pack_documents
+
+# separator of the documents in the prompt of the stuff chain
+DOCUMENT_SEPARATOR = "\n\n"
+
+
+class PackedRetriever(BaseRetriever):
+    """Retrieves `candidates` chunks and keeps the most relevant that fit.
+
+    The budget is the context window minus the tokens reserved for the
+    completion and the tokens of the prompt itself, question included, so
+    the stuff chain never overflows and short chunks fill the window
+    instead of a fixed `k`. A `filter` on the metadata of the chunks, e.g.
+    `{"subreddit": "python"}`, restricts the search to the chunks it matches.
+    """
+
+    def __init__(
+        self,
+        vectorstore: VectorStore,
+        counter: Optional[TokenCounter] = None,
+        candidates: int = RETRIEVAL_CANDIDATES,
+        prompt: PromptTemplate = PROMPT,
+        document_prompt: PromptTemplate = EXAMPLE_PROMPT,
+        max_context_tokens: int = MAX_CONTEXT_TOKENS,
+        filter: Optional[Dict[str, Any]] = None,
+    ):
+        self.vectorstore = vectorstore
+        self.counter = counter or TokenCounter()
+        self.candidates = candidates
+        self.prompt = prompt
+        self.document_prompt = document_prompt
+        self.max_context_tokens = max_context_tokens
+        self.filter = filter
+
+    def token_budget(self, query: str) -> int:
+        overhead = self.counter.count_text(
+            self.prompt.format(question=query, summaries="")
+        )
+        return self.max_context_tokens - COMPLETION_RESERVED_TOKENS - overhead
+
+    def _document_overhead(self, document: Document) -> int:
+        # everything the document prompt adds around the content
+        return self.counter.count_text(
+            self.document_prompt.format(
+                page_content="",
+                source=document.metadata.get("source", ""),
+            )
+            + DOCUMENT_SEPARATOR
+        )
+
+    def _pack(self, query: str, documents: List[Document]) -> List[Document]:
+        packed = pack_documents(
+            documents,
+            self.token_budget(query),
+            self.counter,
+            overhead=self._document_overhead,
+        )
+        get_metrics().increment("retrieved_chunks_total", len(documents))
+        get_metrics().increment("packed_chunks_total", len(packed))
+        return packed
+
+    def get_relevant_documents(self, query: str) -> List[Document]:
+        documents = self.vectorstore.similarity_search(
+            query, k=self.candidates, filter=self.filter
+        )
+        return self._pack(query, documents)
+
+    async def aget_relevant_documents(self, query: str) -> List[Document]:
+        # Chroma has no native async search
+        documents = await asyncio.get_event_loop().run_in_executor(
+            None,
+            partial(
+                self.vectorstore.similarity_search,
+                query,
+                k=self.candidates,
+                filter=self.filter,
+            ),
+        )
+        return self._pack(query, documents)
@@ -1,23 +1,33 @@
-from typing import List
-import os
-from functools import lru_cache
-import tweepy
+from __future__ import annotations
+from typing import TYPE_CHECKING, Iterator, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from src import logger
-from src.utils.config import BLACKLIST, SEARCH_FILTERS
+from src.utils.config import (
+    BLACKLIST,
+    SEARCH_FILTERS,
+    TWITTER_MAX_WORKERS,
+    TWITTER_SEARCH_PAGE_SIZE,
+    TWITTER_TIMELINE_PAGE_SIZE,
+)
+from src.utils.metrics import propagate_metrics
+from src.utils.rate_limit import PRIORITY_INTERACTIVE, get_rate_limiter
+from src.utils.response_cache import cached_fetch
 
-from praw import Reddit
-from praw.models import Subreddit
+# clients, tweepy and praw are imported on first use, for the selected platform
+if TYPE_CHECKING:
+    import tweepy
+    from praw.models import Subreddit
 
 
-@lru_cache(maxsize=None)
-def get_api():
-    auth = tweepy.OAuth2BearerHandler(os.environ.get("TWITTER_BEARER_TOKEN"))
-    api = tweepy.API(auth, parser=tweepy.parsers.JSONParser())
-    return api
+def get_api() -> tweepy.API:
+    from src.utils.clients import get_clients
+
+    return get_clients().twitter()
 
 
 def search_users(q, count):
     api = get_api()
+    get_rate_limiter("twitter.search_users").acquire(PRIORITY_INTERACTIVE)
     users = api.search_users(q=q, count=count)
     extracted_users = []
 
@@ -42,14 +52,106 @@ def search_users(q, count):
     return extracted_users
 
 
-def search_tweets_by_usernames(api: tweepy.API, twitter_users, number_tweets):
-    tweets = []
-    for username in twitter_users:
-        tweets_by_username = api.user_timeline(
-            screen_name=username,
-            count=number_tweets,
-            tweet_mode="extended",
+def _paginate(
+    fetch_page,
+    number_tweets: int,
+    page_size: int,
+    since_id: Optional[int] = None,
+) -> Iterator[List[dict]]:
+    """Page backwards through a timeline with `max_id` cursors.
+
+    `fetch_page` is called with `count`, `max_id` and `since_id` and returns
+    the tweets of one page, newest first.
+    """
+    max_id = None
+    remaining = number_tweets
+
+    while remaining > 0:
+        tweets = fetch_page(
+            count=min(page_size, remaining),
+            max_id=max_id,
+            since_id=since_id,
+        )
+        if not tweets:
+            break
+
+        tweets = tweets[:remaining]
+        yield tweets
+        remaining -= len(tweets)
+        max_id = min(tweet["id"] for tweet in tweets) - 1
+
+
+def iter_user_timeline(
+    api: tweepy.API,
+    username,
+    number_tweets,
+    since_id: Optional[int] = None,
+) -> Iterator[List[dict]]:
+    def fetch_page(**params):
+        def fetch():
+            get_rate_limiter("twitter.user_timeline").acquire()
+            return api.user_timeline(
+                screen_name=username,
+                tweet_mode="extended",
+                **params,
+            )
+
+        return cached_fetch(
+            "twitter.user_timeline", dict(params, screen_name=username), fetch
         )
+
+    return _paginate(fetch_page, number_tweets, TWITTER_TIMELINE_PAGE_SIZE, since_id)
+
+
+def iter_tweets_by_usernames(
+    api: tweepy.API,
+    twitter_users,
+    number_tweets,
+    max_workers=TWITTER_MAX_WORKERS,
+    since_id: Optional[int] = None,
+) -> Iterator[Tuple[str, List[dict]]]:
+    """Fetch user timelines concurrently.
+
+    Yields `(username, tweets)` as soon as each account is fetched. All the
+    workers share the same `user_timeline` rate-limit budget, and a failing
+    account is logged and skipped without aborting the others.
+    """
+
+    @propagate_metrics
+    def fetch(username):
+        tweets = []
+        for page in iter_user_timeline(api, username, number_tweets, since_id):
+            tweets.extend(page)
+        return tweets
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(fetch, username): username for username in twitter_users
+        }
+
+        for future in as_completed(futures):
+            username = futures[future]
+            try:
+                tweets_by_username = future.result()
+            except Exception as e:
+                logger.error(f"could not fetch tweets of {username} : {e}")
+                continue
+            yield username, tweets_by_username
+
+
+def search_tweets_by_usernames(
+    api: tweepy.API,
+    twitter_users,
+    number_tweets,
+    max_workers=TWITTER_MAX_WORKERS,
+):
+    tweets = []
+    for _, tweets_by_username in iter_tweets_by_usernames(
+        api,
+        twitter_users,
+        number_tweets,
+        max_workers=max_workers,
+    ):
         tweets.extend(tweets_by_username)
     return tweets
 
@@ -67,15 +169,35 @@ def prepare_query(keywords):
     return q
 
 
-def search_tweets_by_keywords(api: tweepy.API, keywords, number_tweets):
+def iter_tweets_by_keywords(
+    api: tweepy.API,
+    keywords,
+    number_tweets,
+    since_id: Optional[int] = None,
+) -> Iterator[List[dict]]:
+    """Yield pages of search results until `number_tweets` are fetched."""
     q = prepare_query(keywords)
-    tweets = api.search_tweets(
-        q=q,
-        count=number_tweets,
-        tweet_mode="extended",
-        lang="en",
-    )
-    tweets = tweets["statuses"]
+
+    def fetch_page(**params):
+        def fetch():
+            get_rate_limiter("twitter.search_tweets").acquire()
+            tweets = api.search_tweets(
+                q=q,
+                tweet_mode="extended",
+                lang="en",
+                **params,
+            )
+            return tweets["statuses"]
+
+        return cached_fetch("twitter.search_tweets", dict(params, q=q), fetch)
+
+    return _paginate(fetch_page, number_tweets, TWITTER_SEARCH_PAGE_SIZE, since_id)
+
+
+def search_tweets_by_keywords(api: tweepy.API, keywords, number_tweets):
+    tweets = []
+    for page in iter_tweets_by_keywords(api, keywords, number_tweets):
+        tweets.extend(page)
 
     return tweets
 
@@ -90,10 +212,8 @@ def search_subreddits(q, count=10) -> List[Subreddit]:
     count : int, optional
         max number of results, by default 10
     """
-    reddit = Reddit(
-        client_id=os.environ.get("REDDIT_API_CLIENT_ID"),
-        client_secret=os.environ.get("REDDIT_API_SECRET"),
-        user_agent=os.environ.get("REDDIT_USER_AGENT"),
-    )
+    from src.utils.clients import get_clients
 
-    return list(reddit.subreddits.search(query=q, limit=count))
+    get_rate_limiter("reddit").acquire(PRIORITY_INTERACTIVE)
+    with get_clients().reddit_pool().checkout() as reddit:
+        return list(reddit.subreddits.search(query=q, limit=count))
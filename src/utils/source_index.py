@@ -0,0 +1,81 @@
+"""In-memory index resolving answer sources to the indexed chunks."""
+import re
+from collections import defaultdict
+from typing import Any, Dict, List, Tuple
+
+from langchain.docstore.document import Document
+
+SOURCE_KEYS = ("source", "url", "id", "tweet_id")
+
+_SOURCES_SEPARATOR = re.compile(r"[,\s]+")
+_URL_PREFIX = re.compile(r"^(https?://)?(www\.|old\.|new\.)?", re.IGNORECASE)
+
+
+def normalize_source(source: Any) -> str:
+    """Canonical form of a tweet id or URL, as emitted by the loaders or the LLM.
+
+    `https://www.reddit.com/r/x/comments/abc/`, `reddit.com/r/x/comments/abc`
+    and `"1660000000000000000"` all map to the same keys as the metadata
+    the loaders wrote.
+    """
+    source = str(source).strip().strip("'\"[]()<>.;")
+    source = _URL_PREFIX.sub("", source)
+    return source.rstrip("/").lower()
+
+
+def split_sources(sources: str) -> List[str]:
+    return [source for source in _SOURCES_SEPARATOR.split(sources or "") if source]
+
+
+class SourceIndex(object):
+    """Maps normalized sources to the (document, metadata) of their chunks."""
+
+    def __init__(self):
+        self._chunks: Dict[str, List[Tuple[str, Dict[str, Any]]]] = defaultdict(list)
+        self._seen = set()
+
+    def add(self, documents: List[Document]):
+        for document in documents:
+            metadata = document.metadata
+            chunk_key = (
+                normalize_source(metadata.get("source")),
+                metadata.get("chunk", 0),
+                document.page_content,
+            )
+            if chunk_key in self._seen:
+                continue
+            self._seen.add(chunk_key)
+
+            keys = {
+                normalize_source(metadata[key])
+                for key in SOURCE_KEYS
+                if metadata.get(key) is not None
+            }
+            for key in keys:
+                self._chunks[key].append((document.page_content, metadata))
+
+    def resolve(
+        self, sources: str
+    ) -> Tuple[List[str], List[Dict[str, Any]], List[str]]:
+        """Return the documents and metadatas of `sources`, plus the unknown ones."""
+        documents = []
+        metadatas = []
+        missing = []
+        resolved = set()
+
+        for source in split_sources(sources):
+            chunks = self._chunks.get(normalize_source(source))
+            if not chunks:
+                missing.append(source)
+                continue
+            for document, metadata in chunks:
+                if id(metadata) in resolved:
+                    continue
+                resolved.add(id(metadata))
+                documents.append(document)
+                metadatas.append(metadata)
+
+        return documents, metadatas, missing
+
+    def __len__(self) -> int:
+        return len(self._seen)
@@ -0,0 +1,97 @@
+"""Terminal rendering of the tokens streamed by the LLM."""
+from typing import Any, Optional
+
+from langchain.callbacks.base import BaseCallbackHandler
+from rich.live import Live
+from rich.status import Status
+from rich.text import Text
+
+from src.utils.display import console
+
+
+class TokenStreamHandler(BaseCallbackHandler):
+    """Renders LLM tokens in the terminal as they are generated.
+
+    The spinner `status` is stopped on the first token. Text from
+    `stop_marker` on (e.g. the `SOURCES:` of retrieval answers) is not
+    shown. With `transient`, tokens are rendered in a live area that is
+    cleared once the completion ends.
+    """
+
+    def __init__(
+        self,
+        title: Optional[str] = None,
+        status: Optional[Status] = None,
+        style: str = "yellow",
+        stop_marker: Optional[str] = None,
+        transient: bool = False,
+    ):
+        self.title = title
+        self.status = status
+        self.style = style
+        self.stop_marker = stop_marker
+        self.transient = transient
+        self._started = False
+        self._stopped = False
+        self._buffer = ""
+        self._printed = 0
+        self._live = None
+        self._text = None
+
+    def _start(self):
+        self._started = True
+        if self.status is not None:
+            self.status.stop()
+        if self.title:
+            console.print(self.title, style="red bold underline")
+        if self.transient:
+            self._text = Text(style=self.style)
+            self._live = Live(self._text, console=console, transient=True)
+            self._live.start()
+
+    def _render(self, end: int):
+        if end <= self._printed:
+            return
+        chunk = self._buffer[self._printed : end]
+        self._printed = end
+        if self._live is not None:
+            self._text.append(chunk)
+            self._live.update(self._text)
+        else:
+            console.print(
+                chunk, end="", style=self.style, markup=False, highlight=False
+            )
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if not self._started:
+            self._start()
+        if self._stopped:
+            return
+
+        self._buffer += token
+        if self.stop_marker is None:
+            self._render(len(self._buffer))
+            return
+
+        marker_index = self._buffer.find(self.stop_marker)
+        if marker_index >= 0:
+            self._render(marker_index)
+            self._stopped = True
+        else:
+            # hold back what could be the beginning of the marker
+            self._render(len(self._buffer) - len(self.stop_marker) + 1)
+
+    def _finish(self):
+        if self._live is not None:
+            self._live.stop()
+            self._live = None
+        elif self._started:
+            if not self._stopped:
+                self._render(len(self._buffer))
+            console.print()
+
+    def on_llm_end(self, response: Any, **kwargs: Any) -> None:
+        self._finish()
+
+    def on_llm_error(self, error: BaseException, **kwargs: Any) -> None:
+        self._finish()
@@ -0,0 +1,214 @@
+"""Token accounting shared by the summary, splitting and packing steps."""
+import copy
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+
+import tiktoken
+from langchain.docstore.document import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from src.utils.config import CHUNK_OVERLAP_TOKENS, CHUNK_TOKENS, LLM_MODEL
+
+NUM_TOKENS_KEY = "num_tokens"
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str = LLM_MODEL):
+    return tiktoken.encoding_for_model(model)
+
+
+def count_tokens(text: str, model: str = LLM_MODEL) -> int:
+    return len(get_encoding(model).encode(text, disallowed_special=()))
+
+
+class TokenCounter(object):
+    """Counts tokens once per document and stores the count in its metadata.
+
+    The count is reused by every later step (summary method selection,
+    splitting, context packing) and travels with the chunk into the index.
+    """
+
+    def __init__(self, model: str = LLM_MODEL):
+        self.model = model
+
+    def count_text(self, text: str) -> int:
+        return count_tokens(text, self.model)
+
+    def count(self, document: Document) -> int:
+        num_tokens = document.metadata.get(NUM_TOKENS_KEY)
+        if num_tokens is None:
+            num_tokens = self.count_text(document.page_content)
+            document.metadata[NUM_TOKENS_KEY] = num_tokens
+        return num_tokens
+
+    def count_documents(
+        self,
+        documents: List[Document],
+        limit: Optional[int] = None,
+    ) -> int:
+        """Total tokens of documents joined by newlines.
+
+        Counting stops as soon as `limit` is crossed, the returned value is
+        then only guaranteed to be greater than `limit`.
+        """
+        total = 0
+        for i, document in enumerate(documents):
+            # one token for the newline separating documents
+            total += self.count(document) + (1 if i else 0)
+            if limit is not None and total > limit:
+                break
+        return total
+
+    def exceeds(
+        self,
+        documents: List[Document],
+        limit: int,
+        template: Optional[str] = None,
+    ) -> bool:
+        """Whether documents, formatted into `template`, exceed `limit` tokens."""
+        overhead = self.count_text(template.format(text="")) if template else 0
+        return overhead + self.count_documents(documents, limit - overhead) > limit
+
+
+def group_documents_by_tokens(
+    documents: List[Document],
+    token_budget: int,
+    counter: Optional[TokenCounter] = None,
+) -> List[List[Document]]:
+    """Pack consecutive documents into groups of at most `token_budget` tokens.
+
+    A document larger than the budget gets a group of its own.
+    """
+    counter = counter or TokenCounter()
+    groups = []
+    group = []
+    group_tokens = 0
+
+    for document in documents:
+        num_tokens = counter.count(document) + 1
+        if group and group_tokens + num_tokens > token_budget:
+            groups.append(group)
+            group = []
+            group_tokens = 0
+        group.append(document)
+        group_tokens += num_tokens
+
+    if group:
+        groups.append(group)
+    return groups
+
+
+def pack_documents(
+    documents: List[Document],
+    token_budget: int,
+    counter: Optional[TokenCounter] = None,
+    overhead: Optional[Callable[[Document], int]] = None,
+) -> List[Document]:
+    """Fill `token_budget` with documents, in the given order of priority.
+
+    A document that doesn't fit is skipped and smaller ones after it are
+    still considered. `overhead` gives the tokens a document takes in the
+    prompt besides its content (e.g. its `Source:` line), one token for the
+    separator by default. Documents with the same content are packed once.
+    """
+    counter = counter or TokenCounter()
+    overhead = overhead or (lambda document: 1)
+    packed = []
+    contents = set()
+    used = 0
+
+    for document in documents:
+        if document.page_content in contents:
+            continue
+        num_tokens = counter.count(document) + overhead(document)
+        if used + num_tokens > token_budget:
+            continue
+        packed.append(document)
+        contents.add(document.page_content)
+        used += num_tokens
+
+    return packed
+
+
+def truncate_document(
+    document: Document,
+    max_tokens: int,
+    counter: Optional[TokenCounter] = None,
+) -> Document:
+    """The first `max_tokens` tokens of a document, itself when it fits."""
+    counter = counter or TokenCounter()
+    if counter.count(document) <= max_tokens:
+        return document
+    encoding = get_encoding(counter.model)
+    tokens = encoding.encode(document.page_content, disallowed_special=())
+    text = encoding.decode(tokens[:max_tokens])
+    return Document(
+        page_content=text,
+        metadata={**document.metadata, NUM_TOKENS_KEY: counter.count_text(text)},
+    )
+
+
+class TokenTextSplitter(RecursiveCharacterTextSplitter):
+    """Splits on paragraphs, lines then words into chunks of `chunk_tokens`.
+
+    Chunk sizes are measured with the tokenizer of the model. Documents
+    whose stored count already fits are not split nor encoded again, the
+    pieces of longer ones are encoded once, and every chunk gets in its
+    metadata the tokens of the pieces it was merged from, which may
+    slightly overestimate those of its text.
+    """
+
+    def __init__(
+        self,
+        chunk_tokens: int = CHUNK_TOKENS,
+        chunk_overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+        counter: Optional[TokenCounter] = None,
+    ):
+        self.counter = counter or TokenCounter()
+        # tokens of the pieces and chunks of the document being split
+        self._lengths: Dict[str, int] = {}
+        self._chunk_tokens: Dict[str, int] = {}
+        super().__init__(
+            chunk_size=chunk_tokens,
+            chunk_overlap=chunk_overlap_tokens,
+            length_function=self._length,
+        )
+
+    def _length(self, text: str) -> int:
+        # pieces are measured again and again while they are merged
+        num_tokens = self._lengths.get(text)
+        if num_tokens is None:
+            num_tokens = self._lengths[text] = self.counter.count_text(text)
+        return num_tokens
+
+    def _join_docs(self, docs: List[str], separator: str) -> Optional[str]:
+        text = super()._join_docs(docs, separator)
+        if text is not None:
+            self._chunk_tokens[text] = sum(map(self._length, docs)) + self._length(
+                separator
+            ) * (len(docs) - 1)
+        return text
+
+    def split_text(self, text: str) -> List[str]:
+        if self._length(text) <= self._chunk_size:
+            return [text]
+        return super().split_text(text)
+
+    def split_documents(self, documents: List[Document]) -> List[Document]:
+        chunks = []
+        for document in documents:
+            num_tokens = self.counter.count(document)
+            if num_tokens <= self._chunk_size:
+                texts, counts = [document.page_content], [num_tokens]
+            else:
+                self._lengths, self._chunk_tokens = {}, {}
+                texts = self.split_text(document.page_content)
+                counts = [
+                    self._chunk_tokens.get(text) or self._length(text) for text in texts
+                ]
+                self._lengths, self._chunk_tokens = {}, {}
+            for text, count in zip(texts, counts):
+                metadata = copy.deepcopy(document.metadata)
+                metadata[NUM_TOKENS_KEY] = count
+                chunks.append(Document(page_content=text, metadata=metadata))
+        return chunks
@@ -2,11 +2,9 @@ import atexit
 import os
 import sys
 import json
+import time
+import uuid
 from rich.console import Console
-from langchain.vectorstores import Chroma
-from langchain.embeddings.openai import OpenAIEmbeddings
-import chromadb
-from chromadb.config import Settings
 import tiktoken
 from src import logger
 from src.utils.chains import (
@@ -19,7 +17,17 @@ from src.utils.data_processing import (
 )
 from src.utils.display import display_bot_answer, display_summary_and_questions
 from src.utils.document_loader import TwitterTweetLoader
+from src.utils.embedding_engine import BatchedEmbeddings
+from src.utils.index_store import (
+    get_collection_fingerprint,
+    get_collection_name,
+    get_index_store,
+    get_query,
+    get_session_collection_name,
+)
 from src.utils.prompts import summarization_question_template, summarization_template
+from src.utils.retrieval import PackedRetriever
+from src.utils.source_index import SourceIndex
 
 
 class TwitterAgent(object):
@@ -34,12 +42,15 @@ class TwitterAgent(object):
         self.keywords = keywords
         self.number_tweets = number_tweets
         self.loaded_documents = []
-        self.embeddings = OpenAIEmbeddings()
+        self.embeddings = BatchedEmbeddings()
         self.persist_db = persist_db
         self.chain = None
-        self.client = None
         self.collection = None
+        self.source_index = SourceIndex()
         self.console = Console()
+        self.session_id = uuid.uuid4().hex
+        self.index_store = get_index_store()
+        self.index_lock = None
         self.history = {"history": []}
 
         def save_history():
@@ -92,23 +103,43 @@ class TwitterAgent(object):
         texts = get_texts_from_documents(self.loaded_documents)
         metadatas = get_metadatas_from_documents(self.loaded_documents)
 
-        self.docsearch = Chroma.from_texts(
-            texts,
+        search_params = self._get_tweets_loader()._get_search_params()
+        # its chunks have random ids and no content hashes, so it never shares
+        # the collection the agent indexes incrementally and reopens
+        collection_name = get_collection_name("twitter-agent", search_params, "openai")
+        self.index_lock = self.index_store.lock(collection_name)
+        if self.index_lock is None:
+            logger.warning(
+                f"index {collection_name} is open in another session, "
+                "indexing into a collection of this session"
+            )
+            collection_name = get_session_collection_name(self.session_id)
+            self.index_lock = self.index_store.lock(collection_name)
+        self.docsearch = self.index_store.open(
+            collection_name,
             self.embeddings,
-            metadatas=metadatas,
-            persist_directory="db",
+            reset=True,
         )
+        self.docsearch.add_texts(texts, metadatas=metadatas)
 
         if self.persist_db:
             self.docsearch.persist()
-        self.chain = get_retrieval_qa_chain(self.docsearch.as_retriever())
-        self.client = chromadb.Client(
-            Settings(
-                chroma_db_impl="duckdb+parquet",
-                persist_directory="db",
+            now = time.time()
+            self.index_store.record(
+                collection_name,
+                platform="twitter-agent",
+                query=get_query(search_params),
+                embedding_backend="openai",
+                session_id=self.session_id,
+                fetched_at=now,
+                opened_at=now,
+                num_documents=len(self.loaded_documents),
+                num_chunks=self.docsearch._collection.count(),
+                fingerprint=get_collection_fingerprint(self.docsearch._collection),
             )
-        )
-        self.collection = self.client.get_collection("langchain")
+        self.chain = get_retrieval_qa_chain(PackedRetriever(self.docsearch))
+        self.collection = self.docsearch._collection
+        self.source_index.add(self.loaded_documents)
 
     def summarize(self):
         if self.loaded_documents is not None:
@@ -175,9 +206,15 @@ class TwitterAgent(object):
                 {"question": user_input},
                 return_only_outputs=True,
             )
-        display_bot_answer(
-            result,
-            self.collection,
-            self.history,
-            user_input,
+        documents, metadatas, _ = self.source_index.resolve(result["sources"])
+        display_bot_answer(result, documents, metadatas)
+        self.history["history"].append(
+            {
+                "question": user_input,
+                "answer": result,
+                "sources": [
+                    {"document": document, "metadata": metadata}
+                    for document, metadata in zip(documents, metadatas)
+                ],
+            }
         )